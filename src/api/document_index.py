@@ -0,0 +1,131 @@
+import logging
+from collections import defaultdict
+import numpy as np
+
+try:
+    from src.api.vector_index import iter_collection_embeddings
+except ImportError:
+    from vector_index import iter_collection_embeddings
+
+logger = logging.getLogger(__name__)
+
+# Peso de la similitud con el centroide de la categoría al puntuar un documento
+CATEGORY_WEIGHT = 0.5
+
+
+class DocumentIndex:
+    """Índice a nivel de documento: un centroide por `source` y otro por `category`.
+
+    Primera etapa de la recuperación en dos pasos: elige los documentos más
+    prometedores para una query y la búsqueda de chunks se restringe a ellos
+    con un filtro de metadata. Se guardan sumas y conteos (no solo la media)
+    para poder añadir o quitar chunks sin reconstruir.
+    """
+
+    def __init__(self):
+        self._reset()
+
+    def _reset(self):
+        self.sums = {} # source -> suma de embeddings normalizados
+        self.counts = defaultdict(int) # source -> nº de chunks
+        self.categories = {} # source -> category
+        self.category_sums = {}
+        self.category_counts = defaultdict(int)
+        self._matrix = None # cache de centroides normalizados (documentos)
+        self._sources = []
+        self._category_matrix = None
+        self._category_names = []
+        self._doc_category = None # posición de la categoría de cada documento
+
+    def __len__(self):
+        return len(self.sums)
+
+    def build_from_collection(self, collection):
+        """Calcula los centroides recorriendo todos los embeddings de la colección."""
+        self._reset()
+        for _, vectors, data in iter_collection_embeddings(collection, include=["metadatas"]):
+            self.add(vectors, data["metadatas"])
+        logger.info(f"✅ Índice de documentos: {len(self.sums)} documentos, {len(self.category_sums)} categorías.")
+        return self
+
+    def _update(self, vectors: np.ndarray, metadatas: list, sign: int):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        norms = np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        vectors = vectors / norms
+        for vec, meta in zip(vectors, metadatas):
+            meta = meta or {}
+            source = meta.get("source")
+            if not source:
+                continue
+            category = meta.get("category") or self.categories.get(source) or "General"
+            self.categories[source] = category
+            self.sums[source] = self.sums.get(source, 0) + sign * vec
+            self.counts[source] += sign
+            self.category_sums[category] = self.category_sums.get(category, 0) + sign * vec
+            self.category_counts[category] += sign
+            if self.counts[source] <= 0:
+                del self.sums[source], self.counts[source], self.categories[source]
+            if self.category_counts[category] <= 0:
+                del self.category_sums[category], self.category_counts[category]
+        self._matrix = None
+
+    def add(self, vectors, metadatas: list):
+        self._update(vectors, metadatas, +1)
+
+    def remove(self, vectors, metadatas: list):
+        self._update(vectors, metadatas, -1)
+
+    def drop_sources(self, sources):
+        """Quita documentos completos (p. ej. antes de re-añadir sus chunks actualizados)."""
+        for source in sources:
+            if source not in self.sums:
+                continue
+            category = self.categories.pop(source)
+            self.category_sums[category] = self.category_sums[category] - self.sums.pop(source)
+            self.category_counts[category] -= self.counts.pop(source)
+            if self.category_counts[category] <= 0:
+                del self.category_sums[category], self.category_counts[category]
+        self._matrix = None
+
+    def _ensure_matrices(self):
+        if self._matrix is not None:
+            return
+        self._sources = list(self.sums)
+        self._category_names = list(self.category_sums)
+        self._matrix = self._normalized([self.sums[s] for s in self._sources])
+        self._category_matrix = self._normalized([self.category_sums[c] for c in self._category_names])
+        category_pos = {c: i for i, c in enumerate(self._category_names)}
+        self._doc_category = np.array([category_pos[self.categories[s]] for s in self._sources], dtype=np.int64)
+
+    @staticmethod
+    def _normalized(rows: list) -> np.ndarray:
+        if not rows:
+            return np.zeros((0, 0), dtype=np.float32)
+        matrix = np.vstack(rows).astype(np.float32)
+        return matrix / np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+
+    def top_categories(self, query_vec, top_n=3) -> list:
+        self._ensure_matrices()
+        if not self._category_names:
+            return []
+        sims = self._category_matrix @ self._query(query_vec)
+        return [self._category_names[i] for i in np.argsort(-sims)[:top_n]]
+
+    def top_documents(self, query_vec, top_n=5, candidates: set = None) -> list:
+        """Devuelve los `source` más similares a la query (documento + su categoría)."""
+        self._ensure_matrices()
+        if not self._sources:
+            return []
+        query = self._query(query_vec)
+        cat_sims = self._category_matrix @ query
+        scores = self._matrix @ query + CATEGORY_WEIGHT * cat_sims[self._doc_category]
+        if candidates is not None:
+            mask = np.array([s in candidates for s in self._sources])
+            scores = np.where(mask, scores, -np.inf)
+        order = np.argsort(-scores)[:top_n]
+        return [self._sources[i] for i in order if np.isfinite(scores[i])]
+
+    @staticmethod
+    def _query(query_vec) -> np.ndarray:
+        query = np.asarray(query_vec, dtype=np.float32).ravel()
+        return query / max(float(np.linalg.norm(query)), 1e-12)
@@ -0,0 +1,109 @@
+import os
+import time
+import uuid
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# Ingestas simultáneas (cada una usa el modelo de embeddings; 1 es lo seguro en GPU)
+INGEST_JOB_WORKERS = int(os.getenv("INGEST_JOB_WORKERS", "1"))
+# Trabajos terminados que se conservan para consultar su estado
+MAX_FINISHED_JOBS = 100
+
+# Estados de fichero de `process_pdf` que añaden/cambian chunks en Chroma
+INDEX_CHANGING_STATUSES = ("new", "updated", "legacy", "renamed")
+
+
+class IngestJobManager:
+    """Cola de trabajos de ingesta en segundo plano.
+
+    `submit` devuelve un job_id al momento; los ficheros se procesan en un
+    pool de hilos y el progreso (páginas parseadas, chunks embebidos) se
+    consulta con `get`. `on_file_done(filename, status, renamed_from)` se
+    llama al acabar cada fichero (p. ej. para actualizar los índices del
+    motor; `renamed_from` es el nombre antiguo si fue un renombrado) y puede
+    devolver un mensaje legible para ese fichero.
+    """
+
+    def __init__(self, process_fn, on_file_done=None, max_workers: int = INGEST_JOB_WORKERS):
+        self.process_fn = process_fn
+        self.on_file_done = on_file_done
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ingest-job")
+        self.jobs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def submit(self, filepaths: list) -> str:
+        job_id = uuid.uuid4().hex
+        job = {
+            "job_id": job_id,
+            "status": "queued",
+            "created_at": time.time(),
+            "started_at": None,
+            "finished_at": None,
+            "files": [
+                {
+                    "filename": os.path.basename(path),
+                    "status": "queued",
+                    "pages_total": 0,
+                    "pages_parsed": 0,
+                    "chunks_total": 0,
+                    "chunks_embedded": 0
+                }
+                for path in filepaths
+            ]
+        }
+        with self._lock:
+            self.jobs[job_id] = job
+            self._evict()
+        self.executor.submit(self._run, job, filepaths)
+        return job_id
+
+    def _evict(self):
+        finished = [job_id for job_id, job in self.jobs.items() if job["finished_at"]]
+        for job_id in finished[:max(0, len(finished) - MAX_FINISHED_JOBS)]:
+            del self.jobs[job_id]
+
+    def _run(self, job: dict, filepaths: list):
+        job["status"] = "running"
+        job["started_at"] = time.time()
+        for path, file_state in zip(filepaths, job["files"]):
+            file_state["status"] = "running"
+
+            def progress(**fields):
+                file_state.update(fields)
+
+            try:
+                status = self.process_fn(path, progress=progress)
+            except Exception as e:
+                logger.error(f"❌ Error en ingesta de {path}: {e}")
+                status = "error"
+                file_state["message"] = str(e)
+            file_state["status"] = status
+            if self.on_file_done:
+                try:
+                    message = self.on_file_done(file_state["filename"], status, file_state.get("renamed_from"))
+                    if message and not file_state.get("message"):
+                        file_state["message"] = message
+                except Exception as e:
+                    logger.error(f"❌ Error actualizando índices tras {path}: {e}")
+        errors = sum(1 for f in job["files"] if f["status"] == "error")
+        job["status"] = "error" if errors == len(job["files"]) else "done"
+        job["finished_at"] = time.time()
+
+    def get(self, job_id: str) -> dict:
+        job = self.jobs.get(job_id)
+        if job is None:
+            return None
+        files = job["files"]
+        done_files = sum(1 for f in files if f["status"] not in ("queued", "running"))
+        return {
+            **job,
+            "files_done": done_files,
+            "files_total": len(files),
+            "pages_parsed": sum(f["pages_parsed"] for f in files),
+            "chunks_embedded": sum(f["chunks_embedded"] for f in files),
+            "elapsed_seconds": round((job["finished_at"] or time.time()) - (job["started_at"] or time.time()), 2)
+        }
@@ -20,11 +20,17 @@ import shutil
 from fastapi import UploadFile, File
 from sentence_transformers import SentenceTransformer 
 # from src.ingestion.ingest_multimodal import process_pdf  # Lazy import
-from fastapi.responses import StreamingResponse, JSONResponse
+from fastapi.responses import StreamingResponse, JSONResponse, FileResponse
 try:
-    from src.api.retrieval_engine import RetrievalEngine
+    from src.api.retrieval_engine import RetrievalEngine, resolve_fusion_config
 except ImportError:
-    from retrieval_engine import RetrievalEngine
+    from retrieval_engine import RetrievalEngine, resolve_fusion_config
+from src.utils.parent_store import ParentStore
+from src.utils.image_derivatives import get_image_derivatives
+from src.utils.hr_analytics import get_hr_analytics
+from src.utils.entity_extractor import get_entity_extractor
+from src.utils.hr_answers import get_hr_answers, needs_reasoning, uncovered_words, use_template, render as render_hr_answer
+from src.api.jobs import IngestJobManager, INDEX_CHANGING_STATUSES
 
 
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -37,6 +43,9 @@ EMBEDDING_MODEL_NAME = "all-MiniLM-L6-v2"
 
 # Inicialización Global Engine
 retrieval_engine = RetrievalEngine(CHROMA_PATH, COLLECTION_NAME)
+parent_store = ParentStore()
+# Un texto padre más largo que esto no se expande (se usa el chunk)
+MAX_PARENT_CHARS = 6000
 
 LLM_TEXT_MODEL = "llama3.2"
 LLM_VISION_MODEL = "llama3.2-vision"
@@ -50,6 +59,13 @@ class ChatRequest(BaseModel):
     question: str
     image: Optional[str] = None
     style: Optional[str] = "Formal"
+    # Fusión por petición: {"method": "rrf"|"score", "weights": [bm25, vector], "cutoff_gap": 0.3, ...}
+    retrieval_config: Optional[dict] = None
+
+class IndexRefreshRequest(BaseModel):
+    upserted: List[str] = [] # `source` ingestados o modificados
+    removed: List[str] = [] # `source` borrados
+    full: bool = False # reconstrucción completa
 
 # --- SECURITY CONSTANTS ---
 SECURITY_DIRECTIVE = """
@@ -115,14 +131,21 @@ def get_image_collection():
     )
     return client.get_or_create_collection(name=COLLECTION_IMAGES_NAME, embedding_function=ef)
 
+def resolve_static_image(image_relative_path: str) -> Optional[Path]:
+    """Ruta absoluta de una imagen bajo static/ (None si no existe o se sale de static/)."""
+    safe_path = (Path(BASE_DIR) / image_relative_path.lstrip("/")).resolve()
+    if not safe_path.is_relative_to(Path(STATIC_DIR).resolve()) or not safe_path.is_file():
+        return None
+    return safe_path
+
 def encode_image_base64(image_relative_path: str) -> Optional[str]:
-    safe_path = Path(BASE_DIR) / image_relative_path.lstrip("/")
-    if not safe_path.exists():
+    """Base64 del JPEG reducido para el modelo de visión (precalculado en la caché de derivados)."""
+    safe_path = resolve_static_image(image_relative_path)
+    if not safe_path:
         return None
     try:
-        with open(safe_path, "rb") as img_file:
-            return base64.b64encode(img_file.read()).decode('utf-8')
-    except:
+        return get_image_derivatives().vision_b64(str(safe_path))
+    except Exception:
         return None
 
 def generar_hyde(pregunta):
@@ -139,6 +162,7 @@ def generar_hyde(pregunta):
 class GraphState(TypedDict):
     pregunta: str
     docs_recuperados: str
+    contextos: List[str]
     imagenes_candidatas: List[str]
     datos_visuales_extraidos: str
     imagenes_finales: List[str]
@@ -151,6 +175,9 @@ class GraphState(TypedDict):
     categoria_detectada: str
     sources: List[dict]
     destino: Optional[str]
+    retrieval_config: Optional[dict]
+    structured_result: Optional[dict]
+    answer_path: Optional[str]
 
 def query_image_analyzer(state: GraphState):
     logger.info("--- QUERY IMAGE ANALYZER ---")
@@ -182,6 +209,14 @@ def query_image_analyzer(state: GraphState):
         logger.error(f"Error analizando imagen query: {e}")
         return {"image_description": ""}
 
+def extract_entities(question: str) -> dict:
+    """Empleados (nombre canónico + IDs) y tipo de consulta, por diccionario sobre los datos de RR.HH."""
+    try:
+        return get_entity_extractor().extract(question)
+    except Exception as e:
+        logger.warning(f"Error en el extractor de entidades: {e}")
+        return {"employees": [], "type": "general", "elapsed_us": 0.0}
+
 def router_node(state: GraphState):
     logger.info("--- ROUTER (V5 Enhanced) ---")
     question = state["pregunta"]
@@ -189,14 +224,35 @@ def router_node(state: GraphState):
     if state["debug_pipeline"] is None:
          state["debug_pipeline"] = []
     
+    # AGREGADOS DE RR.HH. (cuántos/total/coste/media... sobre bajas o vacaciones): SQL exacto en DATA tools
+    try:
+        analytics_plan = get_hr_analytics().match(question)
+    except Exception as e:
+        logger.warning(f"Error en el motor SQL de RR.HH.: {e}")
+        analytics_plan = None
+    if analytics_plan:
+        state["debug_pipeline"].append(f"📡 Router: Agregado de RR.HH. ({analytics_plan['table']}/{analytics_plan['metric']}) → DATA (SQL)")
+        return {"classificacion": "data", "destino": "data_tools", "categoria_detectada": "RRHH"}
+    
+    # FICHA DE UN EMPLEADO con intención inequívoca (saldo de vacaciones, puesto, última subida): plantilla sin LLM
+    try:
+        answer_plan = get_hr_answers().match(question)
+    except Exception as e:
+        logger.warning(f"Error en las respuestas directas de RR.HH.: {e}")
+        answer_plan = None
+    if answer_plan:
+        state["debug_pipeline"].append(f"📡 Router: Ficha de empleado ({answer_plan['intent']}: {answer_plan['employee']}) → DATA (plantilla)")
+        return {"classificacion": "data", "destino": "data_tools", "categoria_detectada": "RRHH"}
+    
     # DETECCIÓN PRIORITARIA: Si es consulta de empleados, ir directo a RAG (no a DATA tools)
     employee_keywords = ["vacaciones", "baja", "empleado", "EMP", "sueldo", "salario", "días pendientes", "permiso"]
     question_lower = question.lower()
     is_employee_query = any(kw in question_lower for kw in employee_keywords)
-    has_name = any(word[0].isupper() and len(word) > 3 for word in question.split() if word.isalpha())
+    entities = extract_entities(question)
+    employees = [e["name"] for e in entities["employees"]]
     
-    if is_employee_query or has_name:
-        state["debug_pipeline"].append(f"📡 Router: Detectada consulta de empleado → RAG (ChromaDB)")
+    if is_employee_query or employees:
+        state["debug_pipeline"].append(f"📡 Router: Detectada consulta de empleado {employees} → RAG (ChromaDB)")
         return {"classificacion": "rag", "destino": "retriever", "categoria_detectada": "RRHH"}
     
     # Para otras consultas, usar el LLM router
@@ -227,7 +283,7 @@ def router_node(state: GraphState):
     state["debug_pipeline"].append(f"📡 Router: Clasificado como '{decision.upper()}'")
     
     if decision == "saludo":
-        return {"classificacion": "saludo", "destino": "fin", "respuesta": "¡Hola! Soy tu Asistente RAG Multimodal. ¿En qué puedo ayudarte con los documentos del BOE o datos de RRHH?"}
+        return {"classificacion": "saludo", "destino": "fin", "answer_path": "saludo", "respuesta": "¡Hola! Soy tu Asistente RAG Multimodal. ¿En qué puedo ayudarte con los documentos del BOE o datos de RRHH?"}
     elif decision == "data":
         return {"classificacion": "data", "destino": "data_tools"}
     else:
@@ -238,6 +294,55 @@ def data_tool_node(state: GraphState):
     question = state["pregunta"]
     state["debug_pipeline"].append("📊 Ejecutando Herramienta de Datos...")
     
+    # 1. Agregados: plantilla SQL parametrizada sobre los CSV (cifras exactas, sin LLM).
+    # Un plan parcial (criterios de la pregunta sin filtro) también se calcula, pero solo como contexto del LLM
+    try:
+        analytics = get_hr_analytics().answer(question, partial=True)
+    except Exception as e:
+        logger.warning(f"Error en el motor SQL de RR.HH.: {e}")
+        analytics = None
+    if analytics:
+        state["debug_pipeline"].append(f"    🧮 SQL ({analytics['elapsed_ms']} ms): {analytics['sql']} {analytics['params']}")
+        scope = "cálculo parcial" if analytics["leftover"] else "cálculo exacto sobre todos los registros"
+        return {
+            "docs_recuperados": f"DATOS DE RRHH CONSULTADOS ({scope}):\n{analytics['text']}",
+            "datos_visuales_extraidos": "",
+            "structured_result": {"intent": "aggregate", "result": analytics}
+        }
+    
+    # 2. Ficha de un empleado con intención inequívoca: resultado estructurado para la plantilla del generador
+    try:
+        structured = get_hr_answers().answer(question)
+    except Exception as e:
+        logger.warning(f"Error en las respuestas directas de RR.HH.: {e}")
+        structured = None
+    if structured:
+        record = structured["record"]
+        state["debug_pipeline"].append(f"    🗂️ Ficha ({structured['elapsed_ms']} ms): {record['nombre']} → {structured['intent']}")
+        return {
+            "docs_recuperados": "DATOS DE RRHH CONSULTADOS:\n" + "\n".join(f"{key}: {value}" for key, value in record.items()),
+            "datos_visuales_extraidos": "",
+            "structured_result": structured
+        }
+    
+    # 3. Consulta de un empleado concreto: diccionario de empleados (microsegundos, sin LLM)
+    from src.utils.tools_data import query_employee_data
+    entities = extract_entities(question)
+    if entities["employees"]:
+        state["debug_pipeline"].append(
+            f"    👤 Entidades ({entities['elapsed_us']:.0f} µs, tipo={entities['type']}): "
+            + ", ".join(f"{e['name']} [{e['method']}]" for e in entities["employees"])
+        )
+        try:
+            result = "\n\n".join(query_employee_data(e["name"], entities["type"]) for e in entities["employees"])
+            return {
+                "docs_recuperados": f"DATOS DE RRHH CONSULTADOS:\n{result}",
+                "datos_visuales_extraidos": ""
+            }
+        except Exception as e:
+            return {"docs_recuperados": "Error consultando la base de datos."}
+    
+    # 4. Sin coincidencias en el diccionario: extracción de entidades con el LLM
     prompt = f"""Eres un extractor de entidades.
     Tu OBJETIVO es leer la PREGUNTA y extraer:
     1. 'name': El nombre propio o ID de empleado EXACTO que aparece en el texto. Si no hay nombre, devuelve "Desconocido".
@@ -254,7 +359,6 @@ def data_tool_node(state: GraphState):
     Responde JSON: {{"name": "...", "type": "..."}}"""
     
     try:
-        from src.utils.tools_data import query_employee_data
         import json
         
         res = ollama.chat(model=LLM_TEXT_MODEL, messages=[{'role': 'user', 'content': prompt}])
@@ -281,6 +385,8 @@ def retriever(state: GraphState):
     logger.info(f"--- RETRIEVING (Hybrid + Rerank) ---")
     state["debug_pipeline"].append("🔍 Iniciando Búsqueda Híbrida...")
     question = state["pregunta"]
+    # Fuera del try: una configuración de fusión inválida es un error de la petición (400), no "sin contexto"
+    fusion = resolve_fusion_config(state.get("retrieval_config"))
     
     # 1. HyDE (Mantenemos V5 logic)
     hyde_doc = generar_hyde(question)
@@ -295,42 +401,32 @@ def retriever(state: GraphState):
     # Detectar si parece una consulta de RRHH
     is_employee_query = any(kw in question_lower for kw in employee_keywords)
     
-    # También detectar IDs (formato EMPXXX)
-    import re
-    has_emp_id = bool(re.search(r'EMP\d+', question, re.IGNORECASE))
-    
-    # Detectar nombres propios capitalizados (heurística simple)
-    palabras = question.split()
-    nombres_detectados = [word for word in palabras if word[0].isupper() and len(word) > 2 and word.isalpha()]
+    # Empleados por nombre, nombre de pila, ID o con erratas (diccionario compartido con router y DATA tools)
+    entities = extract_entities(question)
+    nombres_detectados = [e["name"] for e in entities["employees"]]
     
-    state["debug_pipeline"].append(f"🔍 Detección: employee_query={is_employee_query}, emp_id={has_emp_id}, nombres={nombres_detectados}")
+    state["debug_pipeline"].append(f"🔍 Detección: employee_query={is_employee_query}, nombres={nombres_detectados} ({entities['elapsed_us']:.0f} µs)")
     
     metadata_filter = None
     direct_employee_docs = []
     
-    if is_employee_query or has_emp_id or nombres_detectados:
+    if is_employee_query or nombres_detectados:
         # Filtro: solo documentos de RRHH con los nuevos sources granulares
         metadata_filter = {"source": {"$in": ["vacaciones_rrhh", "bajas_rrhh", "employees_rrhh"]}}
         state["debug_pipeline"].append(f"✅ Aplicando filtro RRHH")
         
         # NUEVO: Si detectamos nombres, intentar recuperación DIRECTA por metadata primero
         if nombres_detectados:
-            nombre_hint = " ".join(nombres_detectados[:2])
-            state["debug_pipeline"].append(f"    👤 Buscando empleado: '{nombre_hint}' en docs RRHH")
+            state["debug_pipeline"].append(f"    👤 Buscando empleado: {nombres_detectados} en docs RRHH")
             
-            # Búsqueda directa: recuperar TODOS los chunks de RRHH y filtrar por nombre
+            # Búsqueda directa: nombres canónicos, el filtro exacto lo resuelve Chroma
             try:
                 collection = get_chroma_collection()
-                all_rrhh = collection.get(
-                    where={"source": {"$in": ["vacaciones_rrhh", "bajas_rrhh", "employees_rrhh"]}}
-                )
-                
-                # Filtrar manualmente por nombre en metadata
-                for i, meta in enumerate(all_rrhh['metadatas']):
-                    emp_name = meta.get('employee_name', '')
-                    # Buscar si alguno de los nombres detectados está en employee_name
-                    if any(nombre.lower() in emp_name.lower() for nombre in nombres_detectados):
-                        direct_employee_docs.append(all_rrhh['documents'][i])
+                employee_rrhh = collection.get(where={"$and": [
+                    {"source": {"$in": ["vacaciones_rrhh", "bajas_rrhh", "employees_rrhh"]}},
+                    {"employee_name": {"$in": nombres_detectados}}
+                ]})
+                direct_employee_docs.extend(employee_rrhh['documents'])
                 
                 if direct_employee_docs:
                     state["debug_pipeline"].append(f"    ✅ Recuperación directa: {len(direct_employee_docs)} chunks encontrados")
@@ -349,27 +445,10 @@ def retriever(state: GraphState):
         context_parts.extend(direct_employee_docs[:3])  # Top 3 de recuperación directa
     
     try:
-        if metadata_filter:
-            # Búsqueda DIRECTA en colección con filtro
-            collection = get_chroma_collection()
-            vector_results = collection.query(
-                query_texts=[question],
-                n_results=15,
-                where=metadata_filter
-            )
-            # Convertir a formato esperado por reranker
-            candidates = []
-            if vector_results['documents'][0]:
-                for i in range(len(vector_results['documents'][0])):
-                    candidates.append({
-                        "id": vector_results['ids'][0][i],
-                        "document": vector_results['documents'][0][i],
-                        "metadata": vector_results['metadatas'][0][i],
-                        "score": 0
-                    })
-        else:
-            # Búsqueda híbrida normal (sin filtro)
-            candidates = retrieval_engine.hybrid_search(question, top_k_fusion=15)
+        # Búsqueda híbrida (BM25 + Vector); el filtro RRHH se empuja a ambos índices
+        candidates = retrieval_engine.hybrid_search(
+            question, top_k_fusion=15, where=metadata_filter, fusion=fusion
+        )
         state["debug_pipeline"].append(f"    🧩 Fusión completada: {len(candidates)} candidatos.")
         
         # 3. RERANKING
@@ -380,14 +459,29 @@ def retriever(state: GraphState):
         sources_list = []
         
         if final_results:
+            # Auto-Merging: los textos padre se leen solo para el top-k final
+            parents = {}
+            try:
+                parents = parent_store.get_many(item['metadata'].get("parent_id") for item in final_results)
+            except Exception as e:
+                logger.warning(f"Error leyendo parent store: {e}")
+            merged_parents = set()
+            
             for item in final_results:
                 doc = item['document']
                 meta = item['metadata']
                 score = item.get('rerank_score', 0)
                 
                 # Auto-Merging Logic
+                parent_id = meta.get("parent_id")
+                parent_text = parents.get(parent_id)
                 expanded = meta.get("contexto_expandido") or meta.get("expanded_context")
-                if expanded:
+                if parent_text and len(parent_text) <= MAX_PARENT_CHARS:
+                    # Hermanos con el mismo padre se fusionan en una sola entrada de contexto
+                    if parent_id not in merged_parents:
+                        merged_parents.add(parent_id)
+                        context_parts.append(parent_text)
+                elif expanded:
                     # state["debug_pipeline"].append("    📂 Usando contexto expandido.") # Reduce noise
                     context_parts.append(expanded)
                 else:
@@ -397,7 +491,9 @@ def retriever(state: GraphState):
                     "source": meta.get("source", "Desconocido"),
                     "page": meta.get("page", 0),
                     "chunk": doc[:50] + "...",
-                    "score": f"{score:.3f}"
+                    "score": f"{score:.3f}",
+                    # Otros documentos que contienen el mismo texto (duplicados colapsados)
+                    "also_in": [s for s in item.get("sources", []) if s != meta.get("source")]
                 })
 
         # 4. Recuperación de IMÁGENES (Multimodal existente)
@@ -406,7 +502,9 @@ def retriever(state: GraphState):
         if not metadata_filter:  # Solo buscar imágenes si NO es consulta de empleados
             try:
                 img_collection = get_image_collection()
-                results_img = img_collection.query(query_texts=[question], n_results=3)
+                # Mismo modelo de embeddings: se reutiliza el vector cacheado de la pregunta
+                question_emb = retrieval_engine.embed_queries([question])[0]
+                results_img = img_collection.query(query_embeddings=[question_emb.tolist()], n_results=3)
                 if results_img['metadatas']:
                     for i, meta_list in enumerate(results_img['metadatas']):
                         for meta in meta_list:
@@ -422,13 +520,14 @@ def retriever(state: GraphState):
 
         return {
             "docs_recuperados": "\n\n".join(context_parts),
+            "contextos": context_parts,
             "imagenes_candidatas": stats_imgs,
             "datos_visuales_extraidos": "",
             "sources": sources_list
         }
     except Exception as e:
         logger.error(f"Error Retrieve: {e}")
-        return {"docs_recuperados": "", "imagenes_candidatas": []}
+        return {"docs_recuperados": "", "contextos": [], "imagenes_candidatas": []}
 
 def visual_filter(state: GraphState):
     logger.info("--- VISUAL ANALYTIC FILTER ---")
@@ -483,9 +582,23 @@ def generator(state: GraphState):
     question = state["pregunta"]
     style = state.get("style", "Formal")
     
+    # Respuesta directa: resultado estructurado de RR.HH. redactado con plantilla (milisegundos, sin LLM)
+    # (solo si cubre la pregunta entera; si pide razonar o normativa, o el plan es parcial, el dato va al LLM como contexto)
+    structured = state.get("structured_result")
+    if structured and needs_reasoning(question):
+        state["debug_pipeline"].append(f"📝 Pregunta con razonamiento/normativa: el resultado {structured['intent']} pasa al LLM como contexto")
+    elif structured and uncovered_words(structured):
+        state["debug_pipeline"].append(f"📝 Resultado parcial (sin aplicar: {', '.join(uncovered_words(structured))}): pasa al LLM como contexto")
+    elif structured:
+        started = time.perf_counter()
+        text = render_hr_answer(structured, style)
+        if text:
+            state["debug_pipeline"].append(f"📝 Respuesta por plantilla ({structured['intent']}, {(time.perf_counter() - started) * 1000:.2f} ms)")
+            return {"respuesta": text, "answer_path": "template"}
+    
     if not context and not visual_data:
         state["debug_pipeline"].append("    ⚠️ Sin contexto encontrado. Usando fallback.")
-        return {"respuesta": "No he encontrado información relevante en los documentos ni en la base de datos para responder a tu pregunta."}
+        return {"answer_path": "fallback", "respuesta": "No he encontrado información relevante en los documentos ni en la base de datos para responder a tu pregunta."}
 
     final_context = f"INFORMACIÓN:\n{context}\n\n"
     if visual_data:
@@ -530,10 +643,10 @@ PREGUNTA: {question}"""
     try:
         res = ollama.chat(model=LLM_TEXT_MODEL, messages=[{'role': 'user', 'content': prompt}])
         safe_response = check_security_leak(res['message']['content'])
-        return {"respuesta": safe_response}
+        return {"respuesta": safe_response, "answer_path": "llm"}
     except Exception as e:
         logger.error(f"Error Gen: {e}")
-        return {"respuesta": f"Error generando respuesta: {str(e)}"}
+        return {"respuesta": f"Error generando respuesta: {str(e)}", "answer_path": "error"}
 
 def route_decision(state: GraphState):
     return state["destino"]
@@ -574,10 +687,15 @@ app.mount("/static", StaticFiles(directory=STATIC_DIR), name="static")
 
 @app.post("/chat", response_model=ChatResponse)
 async def chat(req: ChatRequest):
+    try:
+        resolve_fusion_config(req.retrieval_config)
+    except (ValueError, TypeError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
     initial_state = {
         "pregunta": req.question, 
         "query_image": req.image, 
         "style": req.style,
+        "retrieval_config": req.retrieval_config,
         "debug_pipeline": []
     }
     res = app_graph.invoke(initial_state)
@@ -585,32 +703,67 @@ async def chat(req: ChatRequest):
         respuesta=res.get("respuesta", ""),
         imagenes_finales=res.get("imagenes_finales", []),
         sources=res.get("sources", []),
-        debug_info={"pipeline": res.get("debug_pipeline", [])}
+        debug_info={"pipeline": res.get("debug_pipeline", []), "answer_path": res.get("answer_path", "llm")}
     )
 
+def ingest_status_message(filename: str, status: str) -> str:
+    messages = {
+        "new": f"Documento '{filename}' procesado correctamente.",
+        "legacy": f"Documento '{filename}' procesado correctamente.",
+        "updated": f"Documento '{filename}' actualizado (solo páginas modificadas).",
+        "renamed": f"Documento '{filename}' registrado como renombrado (mismo contenido).",
+        "unchanged": f"El documento '{filename}' YA existe y no ha cambiado.",
+        "duplicate": f"El documento '{filename}' es idéntico a otro ya indexado.",
+        "empty": f"El documento '{filename}' no generó contenido."
+    }
+    return messages.get(status, f"Error procesando '{filename}'.")
+
+def _process_pdf(file_path: str, progress=None) -> str:
+    # Lazy import to avoid startup errors
+    from src.ingestion.ingest_multimodal import process_pdf
+    return process_pdf(file_path, progress=progress)
+
+def _on_ingested(filename: str, status: str, renamed_from: str = None) -> str:
+    if status in INDEX_CHANGING_STATUSES:
+        # Actualización incremental de BM25/ANN/centroides (solo este documento; en un renombrado, fuera el nombre antiguo)
+        retrieval_engine.apply_source_changes(upserted=[filename], removed=[renamed_from] if renamed_from else [])
+    return ingest_status_message(filename, status)
+
+ingest_jobs = IngestJobManager(_process_pdf, on_file_done=_on_ingested)
+
 @app.post("/ingest")
-async def ingest_document(file: UploadFile = File(...)):
+async def ingest_document(file: List[UploadFile] = File(None), files: List[UploadFile] = File(None)):
+    """Guarda uno o varios PDFs en docs/ y encola su ingesta; devuelve un job_id para `GET /ingest/{job_id}`."""
+    uploads = (file or []) + (files or [])
+    if not uploads:
+        raise HTTPException(status_code=400, detail="No se ha enviado ningún fichero.")
     try:
         os.makedirs("docs", exist_ok=True)
-        file_path = os.path.join("docs", file.filename)
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
+        saved = []
+        for upload in uploads:
+            file_path = os.path.join("docs", os.path.basename(upload.filename))
+            with open(file_path, "wb") as buffer:
+                shutil.copyfileobj(upload.file, buffer)
+            saved.append(file_path)
             
-        # Lazy import to avoid startup errors
-        from src.ingestion.ingest_multimodal import process_pdf
-        was_processed = process_pdf(file_path)
-        
-        if was_processed:
-            # Refresh BM25 index dynamic
-            retrieval_engine.refresh_bm25()
-            return {"status": "success", "message": f"Documento '{file.filename}' procesado correctamente."}
-        else:
-            return {"status": "warning", "message": f"El documento '{file.filename}' YA existe."}
+        job_id = ingest_jobs.submit(saved)
+        return {
+            "status": "queued",
+            "job_id": job_id,
+            "message": f"{len(saved)} documento(s) en cola de ingesta."
+        }
             
     except Exception as e:
         logger.error(f"Error ingesta upload: {e}")
         return {"status": "error", "message": str(e)}
 
+@app.get("/ingest/{job_id}")
+async def ingest_status(job_id: str):
+    job = ingest_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Trabajo '{job_id}' no encontrado.")
+    return job
+
 @app.get("/documents")
 async def list_documents():
     try:
@@ -627,24 +780,64 @@ async def list_documents():
 @app.delete("/documents")
 async def delete_document(filename: str):
     try:
-        coll = get_chroma_collection()
-        coll.delete(where={"source": filename})
+        from src.ingestion.ingest_multimodal import remove_document, process_pdf
+        aliases = remove_document(filename)
         
         file_path = os.path.join("docs", filename)
         if os.path.exists(file_path):
             os.remove(file_path)
-            
-        retrieval_engine.refresh_bm25()
+        
+        # Copias idénticas que dependían de este documento: se ingestan ahora con su nombre
+        restored = [os.path.basename(path) for path in aliases if process_pdf(path) in ("new", "updated")]
+        retrieval_engine.apply_source_changes(upserted=restored, removed=[filename])
         return {"status": "success", "message": f"Documento '{filename}' eliminado."}
     except Exception as e:
         return {"error": str(e)}
 
+@app.get("/thumbnails/{image_path:path}")
+def thumbnail(image_path: str):
+    """Miniatura (JPEG) de una imagen de static/; se regenera si el original cambia."""
+    safe_path = resolve_static_image(image_path)
+    if not safe_path:
+        raise HTTPException(status_code=404, detail="Imagen no encontrada")
+    try:
+        thumb_path = get_image_derivatives().thumbnail_path(str(safe_path))
+    except Exception as e:
+        logger.warning(f"Error generando miniatura de {image_path}: {e}")
+        return FileResponse(safe_path)
+    # Revalidación por ETag: si el original cambia, el derivado es otro fichero (hash de contenido)
+    return FileResponse(thumb_path, media_type="image/jpeg", headers={"Cache-Control": "no-cache"})
+
+@app.get("/engine/stats")
+async def engine_stats():
+    """Estado de las cachés del motor de recuperación y del daemon de ingesta."""
+    from src.ingestion.watch_docs import read_watch_status
+    return {
+        "embedding_cache": retrieval_engine.embedding_cache_stats(),
+        "corpus_chunks": len(retrieval_engine.bm25_corpus),
+        "watcher": read_watch_status()
+    }
+
+@app.post("/index/refresh")
+def refresh_index(req: IndexRefreshRequest):
+    """Actualiza los índices en memoria tras cambios en Chroma (lo usa el daemon watch_docs)."""
+    if req.full:
+        retrieval_engine.refresh_bm25()
+        return {"status": "success", "mode": "full", "corpus": len(retrieval_engine.bm25_corpus)}
+    stats = retrieval_engine.apply_source_changes(upserted=req.upserted, removed=req.removed)
+    return {"status": "success", "mode": "incremental", **stats}
+
 @app.post("/chat/stream")
 async def chat_stream(req: ChatRequest):
+    try:
+        resolve_fusion_config(req.retrieval_config)
+    except (ValueError, TypeError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
     state = {
         "pregunta": req.question, 
         "query_image": req.image, 
         "style": req.style,
+        "retrieval_config": req.retrieval_config,
         "debug_pipeline": [],
         "destino": "",
         "imagenes_candidatas": [],
@@ -690,9 +883,18 @@ Usa el siguiente contexto para responder. Si no sabes, dilo.
         messages[1]['images'] = [req.image]
     
     import json
+    
+    # Respuesta directa por plantilla: se envía de una vez, sin LLM
+    templated = None
+    if use_template(state.get("structured_result"), req.question):
+        templated = render_hr_answer(state["structured_result"], req.style)
 
     async def generate_chunks():
         try:
+            if templated:
+                yield templated
+                yield f"\n__METADATA_JSON__{json.dumps({'images': [], 'sources': [], 'answer_path': 'template'})}"
+                return
             stream = ollama.chat(model=LLM_TEXT_MODEL, messages=messages, stream=True)
             accumulated_response = ""
             for chunk in stream:
@@ -708,7 +910,8 @@ Usa el siguiente contexto para responder. Si no sabes, dilo.
             # Yield images/sources at the very end using a special delimiter
             meta = {
                 "images": state.get("imagenes_finales", []),
-                "sources": state.get("sources", [])
+                "sources": state.get("sources", []),
+                "answer_path": "llm"
             }
             yield f"\n__METADATA_JSON__{json.dumps(meta)}"
             
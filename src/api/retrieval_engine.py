@@ -1,4 +1,5 @@
 import os
+import sys
 import logging
 import chromadb
 import torch
@@ -6,12 +7,61 @@ from chromadb.utils import embedding_functions
 from sentence_transformers import CrossEncoder, SentenceTransformer
 from rank_bm25 import BM25Okapi
 import numpy as np
+from scipy import sparse
+import json
+import hashlib
 import string
-from functools import lru_cache
+import threading
+import time
+import unicodedata
+from collections import OrderedDict, defaultdict
+try:
+    from src.api.vector_index import ANNIndex, DEFAULT_HNSW_M, DEFAULT_EF_SEARCH
+    from src.api.document_index import DocumentIndex
+    from src.utils.dedup import collapse_near_duplicates
+except ImportError:
+    from vector_index import ANNIndex, DEFAULT_HNSW_M, DEFAULT_EF_SEARCH
+    from document_index import DocumentIndex
+    # Ejecutado desde src/api: la raíz del proyecto no está en el path
+    sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../../')))
+    from src.utils.dedup import collapse_near_duplicates
 
 # Configuracion
 EMBEDDING_MODEL_NAME = "all-MiniLM-L6-v2"
 RERANKER_MODEL_NAME = "BAAI/bge-reranker-v2-m3"
+# Campos de metadata con índice invertido precalculado para filtrar BM25
+FILTERABLE_FIELDS = ("source", "category", "type")
+# Pares (query, pasaje) por lote del Cross-Encoder en rerank/search_many
+RERANK_BATCH_SIZE = 32
+# Entradas máximas de la caché LRU de embeddings de queries
+QUERY_EMBEDDING_CACHE_SIZE = 2048
+# Backend vectorial: "chroma" (HNSW interno) o índice ANN local "hnswlib" / "faiss"
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "chroma")
+ANN_QUANTIZATION = os.getenv("ANN_QUANTIZATION") or None # None | "int8" | "pq" (solo faiss)
+ANN_HNSW_M = int(os.getenv("ANN_HNSW_M", DEFAULT_HNSW_M))
+ANN_EF_SEARCH = int(os.getenv("ANN_EF_SEARCH", DEFAULT_EF_SEARCH))
+# Con filtro `where` el ANN no filtra: se piden k * factor vecinos y se filtran después
+ANN_FILTER_OVERFETCH = 4
+# Fracción de vectores obsoletos (borrados/reemplazados) a partir de la cual se reconstruye el ANN
+ANN_MAX_DELETED_FRACTION = 0.2
+# Recuperación en dos etapas: documentos (centroides) -> chunks de esos documentos
+TWO_STAGE_RETRIEVAL = os.getenv("TWO_STAGE_RETRIEVAL", "0") == "1"
+TWO_STAGE_TOP_DOCUMENTS = 5
+# Fusión por defecto (sobrescribible por petición con `fusion={...}`):
+# - method "rrf": RRF ponderado; "score": suma ponderada de scores normalizados min-max
+# - weights: (peso BM25, peso vectorial)
+# - cutoff_gap: corta la lista en el primer salto de score (relativo al primero) mayor que este valor
+# - min_candidates: mínimo de candidatos que sobreviven al corte
+DEFAULT_FUSION_CONFIG = {
+    "method": os.getenv("FUSION_METHOD", "rrf"),
+    "weights": (1.0, 1.0),
+    "rrf_k": 60,
+    "cutoff_gap": float(os.getenv("FUSION_CUTOFF_GAP", "0")) or None,
+    "min_candidates": 3
+}
+FUSION_METHODS = ("rrf", "score")
+# Colapsar candidatos casi duplicados (SimHash) entre la fusión y el rerank
+DEDUP_CANDIDATES = os.getenv("DEDUP_CANDIDATES", "1") == "1"
 
 # Logger
 logger = logging.getLogger(__name__)
@@ -21,6 +71,153 @@ def clean_text(text: str) -> str:
     text = text.lower()
     return text.translate(str.maketrans('', '', string.punctuation))
 
+def _match_condition(value, op, operand) -> bool:
+    """Evalua un operador estilo Chroma sobre un valor de metadata (ruta lenta, sin índice)."""
+    if op == "$eq":
+        return value == operand
+    if op == "$ne":
+        return value is not None and value != operand
+    if op == "$in":
+        return value in operand
+    if op == "$nin":
+        return value is not None and value not in operand
+    if value is None:
+        return False
+    if op == "$gt":
+        return value > operand
+    if op == "$gte":
+        return value >= operand
+    if op == "$lt":
+        return value < operand
+    if op == "$lte":
+        return value <= operand
+    raise ValueError(f"Operador de filtro no soportado: {op}")
+
+def _group_by_where(num_queries: int, where) -> list:
+    """Agrupa las queries por filtro (`where` puede ser un dict común o una lista por query)."""
+    if not isinstance(where, list):
+        return [(where, list(range(num_queries)))]
+    groups = {}
+    for idx, w in enumerate(where):
+        key = json.dumps(w, sort_keys=True, default=str)
+        groups.setdefault(key, (w, []))[1].append(idx)
+    return list(groups.values())
+
+def _is_number(value) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and np.isfinite(value)
+
+def resolve_fusion_config(fusion: dict = None) -> dict:
+    """Mezcla la configuración de fusión de una petición con los valores por defecto.
+
+    Valida tipos y rangos (ValueError, que la API devuelve como 400) para que
+    un valor inválido no llegue a la búsqueda y acabe en una respuesta vacía.
+    """
+    config = dict(DEFAULT_FUSION_CONFIG)
+    if fusion:
+        if not isinstance(fusion, dict):
+            raise ValueError("La configuración de fusión debe ser un objeto {parámetro: valor}.")
+        unknown = set(fusion) - set(config)
+        if unknown:
+            raise ValueError(f"Parámetros de fusión desconocidos: {sorted(unknown)}")
+        config.update({key: value for key, value in fusion.items() if value is not None})
+    if config["method"] not in FUSION_METHODS:
+        raise ValueError(f"Método de fusión no soportado: {config['method']}. Opciones: {FUSION_METHODS}")
+    weights = config["weights"]
+    if not isinstance(weights, (list, tuple)) or len(weights) != 2 or not all(_is_number(w) and w >= 0 for w in weights):
+        raise ValueError("`weights` debe ser (peso BM25, peso vectorial), dos números >= 0.")
+    if not any(weights):
+        raise ValueError("`weights` no puede ser (0, 0).")
+    config["weights"] = tuple(float(w) for w in weights)
+    if not _is_number(config["rrf_k"]) or config["rrf_k"] <= 0:
+        raise ValueError("`rrf_k` debe ser un número > 0.")
+    if config["cutoff_gap"] is not None and (not _is_number(config["cutoff_gap"]) or config["cutoff_gap"] < 0):
+        raise ValueError("`cutoff_gap` debe ser un número >= 0 (o null para desactivar el corte).")
+    if not isinstance(config["min_candidates"], int) or isinstance(config["min_candidates"], bool) or config["min_candidates"] < 1:
+        raise ValueError("`min_candidates` debe ser un entero >= 1.")
+    return config
+
+def _min_max(scores: np.ndarray) -> np.ndarray:
+    if not len(scores):
+        return scores
+    low, high = scores.min(), scores.max()
+    if high - low < 1e-12:
+        return np.ones_like(scores)
+    return (scores - low) / (high - low)
+
+def adaptive_cutoff(scores: list, cutoff_gap: float = None, min_candidates: int = 3) -> int:
+    """Número de candidatos a conservar: se corta en el primer salto grande de score.
+
+    El salto se mide relativo al mejor score, así que una query "fácil" (un
+    candidato claramente por encima del resto) manda menos pares al reranker.
+    """
+    if not cutoff_gap or len(scores) <= min_candidates:
+        return len(scores)
+    top = scores[0]
+    if top <= 0:
+        return len(scores)
+    for i in range(max(min_candidates, 1), len(scores)):
+        if (scores[i - 1] - scores[i]) / top > cutoff_gap:
+            return i
+    return len(scores)
+
+def normalize_query(text: str) -> str:
+    """Clave de caché: Unicode NFC y espacios colapsados (no cambia mayúsculas ni acentos)."""
+    return unicodedata.normalize("NFC", " ".join(text.split()))
+
+class QueryEmbeddingCache:
+    """Caché LRU de embeddings de queries con estadísticas de aciertos y memoria."""
+
+    def __init__(self, maxsize=QUERY_EMBEDDING_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._data = OrderedDict() # {texto_normalizado: np.ndarray}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_many(self, texts: list, embed_fn) -> list:
+        """Devuelve los embeddings de `texts`; los que faltan se calculan en un solo lote."""
+        keys = [normalize_query(t) for t in texts]
+        found = {}
+        with self._lock:
+            for key in keys:
+                if key in self._data:
+                    self._data.move_to_end(key)
+                    found[key] = self._data[key]
+                    self.hits += 1
+                else:
+                    self.misses += 1
+
+        missing = list(dict.fromkeys(k for k in keys if k not in found))
+        if missing:
+            computed = embed_fn(missing)
+            with self._lock:
+                for key, emb in zip(missing, computed):
+                    emb = np.asarray(emb, dtype=np.float32)
+                    found[key] = emb
+                    self._data[key] = emb
+                    self._data.move_to_end(key)
+                while len(self._data) > self.maxsize:
+                    self._data.popitem(last=False)
+
+        return [found[key] for key in keys]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            memory = sum(emb.nbytes + len(key.encode("utf-8")) for key, emb in self._data.items())
+            return {
+                "entries": len(self._data),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "memory_bytes": memory
+            }
+
 class RetrievalEngine:
     _instance = None
 
@@ -45,6 +242,8 @@ class RetrievalEngine:
             device=device
         )
         
+        self.embedding_cache = QueryEmbeddingCache()
+        
         # 2. Conectar Chroma
         self.client = chromadb.PersistentClient(path=self.chroma_path)
         self.collection = self.client.get_or_create_collection(
@@ -55,8 +254,27 @@ class RetrievalEngine:
         # 3. Inicializar BM25 (Lazy load)
         self.bm25 = None
         self.bm25_corpus = [] # [(id, text, metadata), ...]
+        self.bm25_tokens = [] # tokens de cada documento del corpus (mismo orden)
+        self.corpus_positions = {} # {id: posicion en bm25_corpus}
+        self.metadata_index = {} # {campo: {valor: np.array(posiciones)}}
+        self.bm25_vocab = {} # {termino: columna}
+        self.bm25_matrix = None # Pesos BM25 precalculados (terminos x documentos)
+        self._update_lock = threading.Lock() # serializa refrescos/actualizaciones de índices
+        self._index_version = None # huella del corpus indexado (se recalcula al cambiar)
+        self._corpus_version = None # huella solo del contenido (versiona el ANN persistido)
         self._build_bm25_index()
         
+        # 3.5 Índice ANN local opcional (si no, Chroma resuelve la búsqueda vectorial)
+        self.ann_index = None
+        self.ann_index_dir = os.path.join(self.chroma_path, "ann_index")
+        if VECTOR_BACKEND != "chroma":
+            self._load_ann_index()
+        
+        # 3.6 Índice de documentos (centroides) para la recuperación en dos etapas (lazy)
+        self.document_index = None
+        if TWO_STAGE_RETRIEVAL:
+            self._ensure_document_index()
+        
         # 4. Inicializar Cross-Encoder (Reranker)
         logger.info(f"⏳ Cargando Reranker: {RERANKER_MODEL_NAME} (Puede tardar la primera vez)...")
         try:
@@ -83,119 +301,574 @@ class RetrievalEngine:
                 logger.warning("⚠️ ChromaDB vacía. BM25 no indexará nada.")
                 return
 
-            self.bm25_corpus = []
-            tokenized_corpus = []
-            
-            for doc_id, text, meta in zip(ids, docs, metas):
-                cleaned = clean_text(text)
-                tokenized_corpus.append(cleaned.split())
-                self.bm25_corpus.append({
-                    "id": doc_id,
-                    "text": text,
-                    "metadata": meta
-                })
-                
-            self.bm25 = BM25Okapi(tokenized_corpus)
+            corpus, tokenized_corpus = self._tokenize_corpus(ids, docs, metas)
+            self._set_bm25_corpus(corpus, tokenized_corpus)
             logger.info(f"✅ BM25 Indexado: {len(self.bm25_corpus)} documentos.")
             
         except Exception as e:
             logger.error(f"❌ Error construyendo BM25: {e}")
 
+    @staticmethod
+    def _tokenize_corpus(ids: list, docs: list, metas: list):
+        corpus, tokenized_corpus = [], []
+        for doc_id, text, meta in zip(ids, docs, metas):
+            cleaned = clean_text(text)
+            tokenized_corpus.append(cleaned.split())
+            corpus.append({
+                "id": doc_id,
+                "text": text,
+                "metadata": meta
+            })
+        return corpus, tokenized_corpus
+
+    def _set_bm25_corpus(self, corpus: list, tokenized_corpus: list):
+        """Instala un corpus ya tokenizado: BM25, matriz de pesos, posiciones e índice de metadata."""
+        self._index_version = None
+        self._corpus_version = None
+        if not corpus:
+            self.bm25, self.bm25_corpus, self.bm25_tokens = None, [], []
+            self.corpus_positions, self.metadata_index = {}, {}
+            self.bm25_vocab, self.bm25_matrix = {}, None
+            return
+        self.bm25_corpus = corpus
+        self.bm25_tokens = tokenized_corpus # se conservan para actualizaciones incrementales
+        self.corpus_positions = {doc_info["id"]: pos for pos, doc_info in enumerate(corpus)}
+        self.bm25 = BM25Okapi(tokenized_corpus)
+        self._build_bm25_matrix()
+        self._build_metadata_index()
+
+    def _build_bm25_matrix(self):
+        """Precalcula la contribución BM25 de cada (término, documento) como matriz dispersa.
+
+        score(q, d) = sum_t count(t, q) * W[t, d], así que puntuar un lote de queries
+        es un único producto disperso Q @ W con los mismos idf/k1/b que BM25Okapi.
+        """
+        bm25 = self.bm25
+        self.bm25_vocab = {term: col for col, term in enumerate(bm25.idf)}
+        k1, b = bm25.k1, bm25.b
+
+        rows, cols, weights = [], [], []
+        for doc_idx, freqs in enumerate(bm25.doc_freqs):
+            length_norm = k1 * (1 - b + b * bm25.doc_len[doc_idx] / bm25.avgdl)
+            for term, tf in freqs.items():
+                rows.append(self.bm25_vocab[term])
+                cols.append(doc_idx)
+                weights.append(bm25.idf[term] * tf * (k1 + 1) / (tf + length_norm))
+
+        self.bm25_matrix = sparse.csr_matrix(
+            (np.array(weights, dtype=np.float64), (rows, cols)),
+            shape=(len(self.bm25_vocab), len(bm25.doc_freqs))
+        )
+
+    def _bm25_query_matrix(self, queries: list):
+        """Matriz dispersa (queries x vocabulario) con el conteo de cada término de la query."""
+        rows, cols = [], []
+        for row, query in enumerate(queries):
+            for token in clean_text(query).split():
+                col = self.bm25_vocab.get(token)
+                if col is not None:
+                    rows.append(row)
+                    cols.append(col)
+        data = np.ones(len(rows), dtype=np.float64)
+        # Los duplicados se suman al convertir, igual que BM25Okapi suma por ocurrencia
+        return sparse.csr_matrix((data, (rows, cols)), shape=(len(queries), len(self.bm25_vocab)))
+
+    def _build_metadata_index(self):
+        """Índice invertido valor -> posiciones del corpus BM25 para los campos filtrables."""
+        buckets = {field: defaultdict(list) for field in FILTERABLE_FIELDS}
+        for pos, doc_info in enumerate(self.bm25_corpus):
+            meta = doc_info["metadata"] or {}
+            for field in FILTERABLE_FIELDS:
+                if field in meta:
+                    buckets[field][meta[field]].append(pos)
+
+        self.metadata_index = {
+            field: {value: np.array(positions, dtype=np.int64) for value, positions in values.items()}
+            for field, values in buckets.items()
+        }
+
+    def _filter_positions(self, where: dict) -> np.ndarray:
+        """Traduce un filtro `where` estilo Chroma a las posiciones del corpus BM25 que lo cumplen."""
+        conditions = []
+        for key, cond in where.items():
+            if key == "$and":
+                conditions.append(self._reduce_positions(cond, np.intersect1d))
+            elif key == "$or":
+                conditions.append(self._reduce_positions(cond, np.union1d))
+            else:
+                conditions.append(self._field_positions(key, cond))
+
+        # Varias claves en el mismo dict se interpretan como AND implícito
+        positions = conditions[0]
+        for other in conditions[1:]:
+            positions = np.intersect1d(positions, other, assume_unique=True)
+        return positions
+
+    def _reduce_positions(self, sub_filters: list, combine) -> np.ndarray:
+        positions = self._filter_positions(sub_filters[0])
+        for sub in sub_filters[1:]:
+            positions = combine(positions, self._filter_positions(sub))
+        return positions
+
+    def _field_positions(self, field: str, cond) -> np.ndarray:
+        op, operand = next(iter(cond.items())) if isinstance(cond, dict) else ("$eq", cond)
+        index = self.metadata_index.get(field)
+        empty = np.array([], dtype=np.int64)
+
+        if index is not None and op in ("$eq", "$in", "$ne", "$nin"):
+            if op in ("$eq", "$ne"):
+                wanted = {operand}
+            else:
+                wanted = set(operand)
+            if op in ("$ne", "$nin"):
+                wanted = set(index) - wanted
+            parts = [index[v] for v in wanted if v in index]
+            return np.unique(np.concatenate(parts)) if parts else empty
+
+        # Campo sin índice u operador de rango: escaneo de metadata
+        return np.array([
+            pos for pos, doc_info in enumerate(self.bm25_corpus)
+            if _match_condition((doc_info["metadata"] or {}).get(field), op, operand)
+        ], dtype=np.int64)
+
+    def _load_ann_index(self):
+        """Carga el índice ANN de disco si coincide con la configuración y el corpus; si no, lo reconstruye."""
+        try:
+            meta_path = os.path.join(self.ann_index_dir, "index_meta.json")
+            if os.path.exists(meta_path):
+                ann = ANNIndex.load(self.ann_index_dir)
+                same_config = (ann.backend, ann.quantization, ann.M) == (VECTOR_BACKEND, ANN_QUANTIZATION, ANN_HNSW_M)
+                # Huella de contenido, no solo de ids: un upsert que reutiliza ids deja vectores obsoletos
+                if same_config and ann.corpus_version == self._content_version():
+                    ann.set_ef_search(ANN_EF_SEARCH)
+                    self.ann_index = ann
+                    logger.info(f"✅ Índice ANN cargado de disco ({len(ann)} vectores).")
+                    return
+                logger.info("♻️ Índice ANN desactualizado. Reconstruyendo...")
+            self.rebuild_ann_index()
+        except Exception as e:
+            logger.error(f"❌ Error cargando índice ANN, se usa Chroma: {e}")
+            self.ann_index = None
+
+    def rebuild_ann_index(self, backend=None, quantization=ANN_QUANTIZATION, M=ANN_HNSW_M, ef_search=ANN_EF_SEARCH, save=True):
+        """Reconstruye el índice ANN local desde los embeddings guardados en Chroma."""
+        backend = backend or (VECTOR_BACKEND if VECTOR_BACKEND != "chroma" else "hnswlib")
+        logger.info(f"🏗️ Construyendo índice ANN ({backend}, {quantization or 'float32'}, M={M})...")
+        ann = ANNIndex(backend=backend, quantization=quantization, M=M, ef_search=ef_search)
+        ann.build_from_collection(self.collection)
+        ann.corpus_version = self._content_version()
+        if save and ann.index is not None:
+            ann.save(self.ann_index_dir)
+        self.ann_index = ann
+        return ann
+
+    def _ensure_document_index(self):
+        if self.document_index is None:
+            logger.info("🏗️ Construyendo índice de documentos (centroides)...")
+            self.document_index = DocumentIndex().build_from_collection(self.collection)
+        return self.document_index
+
+    def select_documents(self, query_embeddings: list, top_n=TWO_STAGE_TOP_DOCUMENTS, where: dict = None) -> list:
+        """Primera etapa: los `source` más prometedores por query (restringidos a los que cumplen `where`)."""
+        doc_index = self._ensure_document_index()
+        candidates = None
+        if where:
+            candidates = {
+                (self.bm25_corpus[pos]["metadata"] or {}).get("source")
+                for pos in self._filter_positions(where).tolist()
+            }
+        return [doc_index.top_documents(emb, top_n=top_n, candidates=candidates) for emb in query_embeddings]
+
+    def _two_stage_wheres(self, query_embeddings: list, where: dict, top_documents: int) -> list:
+        """Un filtro por query: el `where` original restringido a sus documentos de la primera etapa."""
+        wheres = []
+        for sources in self.select_documents(query_embeddings, top_n=top_documents, where=where):
+            if not sources:
+                wheres.append(where)
+                continue
+            doc_filter = {"source": {"$in": sources}}
+            wheres.append({"$and": [where, doc_filter]} if where else doc_filter)
+        return wheres
+
+    def _content_version(self) -> str:
+        """Huella del contenido indexado: modelo de embeddings + (id, fuente, texto) de cada chunk.
+
+        No toma `_update_lock` (se llama desde código que ya lo tiene o desde
+        `__init__`); versiona el ANN guardado en disco.
+        """
+        if self._corpus_version is None:
+            digest = hashlib.sha256(EMBEDDING_MODEL_NAME.encode("utf-8"))
+            for doc_info in sorted(self.bm25_corpus, key=lambda d: d["id"]):
+                source = (doc_info["metadata"] or {}).get("source", "")
+                digest.update(f"{doc_info['id']}\0{source}\0{doc_info['text']}\0".encode("utf-8"))
+            self._corpus_version = digest.hexdigest()[:16]
+        return self._corpus_version
+
+    def index_version(self) -> str:
+        """Huella del índice: corpus (id, texto, fuente), modelos y backend vectorial.
+
+        Cambia con cualquier ingesta, borrado o cambio de modelo; sirve de
+        clave para cachés externas de resultados (p. ej. la evaluación).
+        """
+        with self._update_lock:
+            if self._index_version is None:
+                settings = (self._content_version(), RERANKER_MODEL_NAME if self.reranker else "sin-reranker",
+                            VECTOR_BACKEND, ANN_QUANTIZATION, ANN_HNSW_M, ANN_EF_SEARCH)
+                self._index_version = hashlib.sha256(repr(settings).encode("utf-8")).hexdigest()[:16]
+            return self._index_version
+
     def refresh_bm25(self):
         """Llamar despues de ingestas nuevas."""
-        self._build_bm25_index()
+        with self._update_lock:
+            self._build_bm25_index()
+            if self.document_index is not None:
+                self.document_index = None
+                self._ensure_document_index()
+            if self.ann_index is not None:
+                self.rebuild_ann_index(self.ann_index.backend, self.ann_index.quantization,
+                                       self.ann_index.M, self.ann_index.ef_search)
+
+    def apply_source_changes(self, upserted=(), removed=()) -> dict:
+        """Actualización incremental tras ingestar, modificar o borrar documentos concretos.
+
+        Solo se leen de Chroma los chunks de los `source` afectados; el resto
+        del corpus reutiliza sus tokens, así que BM25 (idf incluido) queda
+        igual que tras `refresh_bm25` sin volver a leer toda la colección.
+        El índice de documentos y el ANN se actualizan en sitio.
+        """
+        upserted, removed = set(upserted), set(removed)
+        changed = upserted | removed
+        if not changed:
+            return {"upserted": 0, "removed": 0}
+        with self._update_lock:
+            started = time.perf_counter()
+            keep = [pos for pos, doc_info in enumerate(self.bm25_corpus)
+                    if (doc_info["metadata"] or {}).get("source") not in changed]
+            stale = [doc_info for doc_info in self.bm25_corpus
+                     if (doc_info["metadata"] or {}).get("source") in changed]
+
+            include = ["documents", "metadatas"]
+            if self.ann_index is not None or self.document_index is not None:
+                include.append("embeddings")
+            data = {"ids": [], "documents": [], "metadatas": [], "embeddings": []}
+            if upserted:
+                data = self.collection.get(where={"source": {"$in": sorted(upserted)}}, include=include)
 
-    def search_bm25(self, query: str, top_k=20):
+            new_corpus, new_tokens = self._tokenize_corpus(data["ids"], data["documents"], data["metadatas"])
+            self._set_bm25_corpus(
+                [self.bm25_corpus[pos] for pos in keep] + new_corpus,
+                [self.bm25_tokens[pos] for pos in keep] + new_tokens
+            )
+
+            vectors = np.asarray(data.get("embeddings") if data.get("embeddings") is not None else [], dtype=np.float32)
+            if self.document_index is not None:
+                self.document_index.drop_sources(changed)
+                if len(vectors):
+                    self.document_index.add(vectors, data["metadatas"])
+            if self.ann_index is not None:
+                self._update_ann_index([doc_info["id"] for doc_info in stale], data["ids"], vectors)
+
+            stats = {
+                "upserted": len(new_corpus),
+                "removed": len(stale),
+                "corpus": len(self.bm25_corpus),
+                "seconds": round(time.perf_counter() - started, 3)
+            }
+        logger.info(f"♻️ Índices actualizados: +{stats['upserted']} / -{stats['removed']} chunks en {stats['seconds']}s")
+        return stats
+
+    def _update_ann_index(self, stale_ids: list, new_ids: list, vectors: np.ndarray):
+        ann = self.ann_index
+        ann.remove(stale_ids)
+        if len(new_ids):
+            ann.add(new_ids, vectors)
+        # Demasiadas etiquetas obsoletas degradan el recall del grafo: reconstruir
+        if len(ann.deleted) > ANN_MAX_DELETED_FRACTION * max(len(ann), 1):
+            self.rebuild_ann_index(ann.backend, ann.quantization, ann.M, ann.ef_search)
+        else:
+            ann.corpus_version = self._content_version()
+            ann.save(self.ann_index_dir)
+
+    def search_bm25(self, query: str, top_k=20, where: dict = None):
+        return self.search_bm25_many([query], top_k=top_k, where=where)[0]
+
+    def search_bm25_many(self, queries: list, top_k=20, where=None):
+        """BM25 vectorizado para un lote de queries (un solo producto disperso).
+
+        `where` puede ser un filtro común o una lista con un filtro por query.
+        """
         if not self.bm25:
-            return []
-            
-        tokenized_query = clean_text(query).split()
-        scores = self.bm25.get_scores(tokenized_query)
-        
-        # Obtener indices con mejores scores
-        top_n_indices = np.argsort(scores)[::-1][:top_k]
-        
-        results = []
-        for idx in top_n_indices:
-            score = scores[idx]
-            if score > 0: # Solo relevantes
-                doc_info = self.bm25_corpus[idx]
+            return [[] for _ in queries]
+
+        # Pushdown: solo se consideran los documentos que cumplen el filtro
+        allowed_per_query = [None] * len(queries)
+        for group_where, indices in _group_by_where(len(queries), where):
+            if group_where:
+                allowed = self._filter_positions(group_where)
+                for idx in indices:
+                    allowed_per_query[idx] = allowed
+
+        scores = (self._bm25_query_matrix(queries) @ self.bm25_matrix).tocsr()
+
+        all_results = []
+        for row in range(len(queries)):
+            allowed = allowed_per_query[row]
+            start, end = scores.indptr[row], scores.indptr[row + 1]
+            doc_positions = scores.indices[start:end]
+            doc_scores = scores.data[start:end]
+
+            keep = doc_scores > 0 # Solo relevantes
+            if allowed is not None:
+                keep &= np.isin(doc_positions, allowed, assume_unique=True)
+            doc_positions, doc_scores = doc_positions[keep], doc_scores[keep]
+
+            # Orden: score descendente, desempate estable por posición en el corpus
+            order = np.lexsort((doc_positions, -doc_scores))[:top_k]
+
+            results = []
+            for idx in order:
+                doc_info = self.bm25_corpus[doc_positions[idx]]
                 results.append({
                     "id": doc_info["id"],
                     "document": doc_info["text"],
                     "metadata": doc_info["metadata"],
-                    "score": score
+                    "score": float(doc_scores[idx])
                 })
-        return results
+            all_results.append(results)
+        return all_results
 
-    def search_vector(self, query: str, top_k=20):
-        results = self.collection.query(query_texts=[query], n_results=top_k)
-        
-        formatted = []
-        if results['ids']:
-            ids = results['ids'][0]
-            docs = results['documents'][0]
-            metas = results['metadatas'][0]
-            # Chroma distances are dissimilarity usually, but langgraph uses cosine similarity?
-            # actually collection.query returns distances. Smaller is better if L2.
-            # Using distances as inverse score proxy locally or just rank position.
-            
-            for i in range(len(ids)):
-                formatted.append({
-                    "id": ids[i],
-                    "document": docs[i],
-                    "metadata": metas[i],
-                    "score": 0.0 # Vector rank es implícito por orden
-                })
-        return formatted
+    def embed_queries(self, queries: list) -> list:
+        """Embeddings de las queries (caché LRU; los fallos se calculan en un solo lote).
 
-    def reciprocal_rank_fusion(self, results_lists, k=60):
-        """Combina listas de resultados usando RRF."""
-        rrf_map = {}
-        
-        for result_list in results_lists:
-            for rank, item in enumerate(result_list):
+        Reutilizable para cualquier colección con el mismo modelo: pasar el
+        resultado a Chroma como `query_embeddings` evita re-embeber la pregunta.
+        """
+        return self.embedding_cache.get_many(list(queries), self.emb_fn)
+
+    def embedding_cache_stats(self) -> dict:
+        return self.embedding_cache.stats()
+
+    def search_vector(self, query: str, top_k=20, where: dict = None):
+        return self.search_vector_many([query], top_k=top_k, where=where)[0]
+
+    def search_vector_many(self, queries: list, top_k=20, where=None, query_embeddings: list = None):
+        """Búsqueda vectorial multi-query: embeddings en lote y una llamada al backend por filtro distinto."""
+        if query_embeddings is None:
+            query_embeddings = self.embed_queries(queries)
+        search = self._search_vector_ann if self.ann_index is not None and len(self.ann_index) else self._search_vector_chroma
+
+        all_formatted = [None] * len(queries)
+        for group_where, indices in _group_by_where(len(queries), where):
+            group_results = search(
+                [queries[i] for i in indices], [query_embeddings[i] for i in indices], top_k, group_where
+            )
+            for idx, formatted in zip(indices, group_results):
+                all_formatted[idx] = formatted
+        return all_formatted
+
+    @staticmethod
+    def _vector_result(doc_id, document, metadata, distance):
+        """Resultado vectorial con la distancia L2² y su similitud coseno (1 - d/2) como score."""
+        return {
+            "id": doc_id,
+            "document": document,
+            "metadata": metadata,
+            "distance": distance,
+            "score": 1.0 - distance / 2.0 if distance is not None else 0.0
+        }
+
+    def _search_vector_chroma(self, queries: list, query_embeddings: list, top_k: int, where: dict):
+        results = self.collection.query(
+            query_embeddings=[np.asarray(emb).tolist() for emb in query_embeddings],
+            n_results=top_k,
+            where=where or None
+        )
+
+        all_formatted = []
+        for q_idx in range(len(queries)):
+            formatted = []
+            if results['ids'] and q_idx < len(results['ids']):
+                ids = results['ids'][q_idx]
+                docs = results['documents'][q_idx]
+                metas = results['metadatas'][q_idx]
+                # Chroma devuelve distancias L2² (menor es mejor) sobre embeddings normalizados
+
+                dists = results['distances'][q_idx] if results.get('distances') else [None] * len(ids)
+
+                for i in range(len(ids)):
+                    formatted.append(self._vector_result(ids[i], docs[i], metas[i], dists[i]))
+            all_formatted.append(formatted)
+        return all_formatted
+
+    def _search_vector_ann(self, queries: list, query_embeddings: list, top_k: int, where: dict):
+        allowed = set(self._filter_positions(where).tolist()) if where else None
+        fetch_k = top_k * ANN_FILTER_OVERFETCH if where else top_k
+        ann = self.ann_index
+        if ann.backend == "faiss" and ann.deleted:
+            # faiss devuelve también las etiquetas obsoletas (se descartan abajo): se piden más en proporción
+            live = len(ann.ids) - len(ann.deleted)
+            fetch_k = int(np.ceil(fetch_k * len(ann.ids) / max(live, 1)))
+        labels, dists = ann.search(np.vstack(query_embeddings), fetch_k)
+
+        # Sin filtro se esperan top_k (o todo el corpus si es menor); si las obsoletas o los huecos dejan
+        # menos, la query se resuelve en Chroma igual que con filtro
+        expected = top_k if where else min(top_k, len(self.bm25_corpus))
+        all_formatted = []
+        fallback = [] # queries que, tras descartar, no llegan a lo esperado: se resuelven en Chroma
+        for q_idx in range(len(queries)):
+            formatted = []
+            for label, dist in zip(labels[q_idx], dists[q_idx]):
+                if label < 0 or label in ann.deleted:
+                    continue
+                pos = self.corpus_positions.get(ann.ids[label])
+                if pos is None or (allowed is not None and pos not in allowed):
+                    continue
+                doc_info = self.bm25_corpus[pos]
+                formatted.append(self._vector_result(doc_info["id"], doc_info["text"], doc_info["metadata"], float(dist)))
+                if len(formatted) == top_k:
+                    break
+            if len(formatted) < expected:
+                fallback.append(q_idx)
+            all_formatted.append(formatted)
+
+        if fallback:
+            chroma_results = self._search_vector_chroma(
+                [queries[i] for i in fallback], [query_embeddings[i] for i in fallback], top_k, where
+            )
+            for q_idx, formatted in zip(fallback, chroma_results):
+                all_formatted[q_idx] = formatted
+        return all_formatted
+
+    def reciprocal_rank_fusion(self, results_lists, k=60, weights=None):
+        """Combina listas de resultados usando RRF (opcionalmente ponderado por lista)."""
+        return self.fuse(results_lists, method="rrf", weights=weights, rrf_k=k)
+
+    def fuse(self, results_lists, method="rrf", weights=None, rrf_k=60):
+        """Fusiona listas de resultados (BM25, vectorial...) conservando sus scores.
+
+        - "rrf": sum(w_i / (k + rank_i)).
+        - "score": sum(w_i * score_i normalizado min-max); ausente en una lista cuenta 0.
+
+        Cada item fusionado lleva `fusion_score` y los scores originales de
+        cada lista en `scores` (p. ej. BM25 bruto y similitud vectorial).
+        """
+        weights = weights or [1.0] * len(results_lists)
+        fused = {}
+        for list_idx, (result_list, weight) in enumerate(zip(results_lists, weights)):
+            if method == "score":
+                contributions = weight * _min_max(np.array([item.get('score', 0.0) for item in result_list], dtype=np.float64))
+            else:
+                # Formula: w / (k + rank)
+                contributions = [weight / (rrf_k + rank + 1) for rank in range(len(result_list))]
+            for item, contribution in zip(result_list, contributions):
                 doc_id = item['id']
-                if doc_id not in rrf_map:
-                    rrf_map[doc_id] = {"score": 0, "item": item}
-                
-                # Formula: 1 / (k + rank)
-                rrf_map[doc_id]["score"] += 1 / (k + rank + 1)
-        
-        # Convertir a lista ordenada
-        sorted_results = sorted(rrf_map.values(), key=lambda x: x['score'], reverse=True)
-        return [x['item'] for x in sorted_results]
+                if doc_id not in fused:
+                    fused[doc_id] = {"score": 0.0, "item": item, "scores": [None] * len(results_lists)}
+                fused[doc_id]["score"] += float(contribution)
+                fused[doc_id]["scores"][list_idx] = item.get('score')
+
+        # Orden estable: a igual score se respeta el orden de aparición
+        sorted_results = sorted(fused.values(), key=lambda x: x['score'], reverse=True)
+        output = []
+        for entry in sorted_results:
+            item = dict(entry["item"])
+            item["fusion_score"] = entry["score"]
+            item["scores"] = entry["scores"]
+            output.append(item)
+        return output
+
+    def hybrid_search(self, query: str, top_k_fusion=10, where: dict = None, two_stage: bool = None, fusion: dict = None):
+        """Búsqueda híbrida. `where` (filtro estilo Chroma) se aplica a BM25 y al vector antes de fusionar.
+
+        Con `two_stage` (por defecto TWO_STAGE_RETRIEVAL) primero se eligen los
+        documentos más cercanos por centroide y solo se buscan chunks en ellos.
+        `fusion` sobrescribe DEFAULT_FUSION_CONFIG (método, pesos, corte adaptativo).
+        """
+        logger.info(f"🔎 Hybrid Search: '{query}'" + (f" | filtro={where}" if where else ""))
+        return self._hybrid_many([query], top_k_fusion=top_k_fusion, where=where, two_stage=two_stage, fusion=fusion)[0]
+
+    def _hybrid_many(self, queries: list, top_k_fusion=10, where: dict = None, two_stage: bool = None,
+                     top_documents=TWO_STAGE_TOP_DOCUMENTS, fusion: dict = None):
+        config = resolve_fusion_config(fusion)
+        query_embeddings = self.embed_queries(queries)
+        where = self.query_wheres(query_embeddings, where, two_stage=two_stage, top_documents=top_documents)
 
-    def hybrid_search(self, query: str, top_k_fusion=10):
-        logger.info(f"🔎 Hybrid Search: '{query}'")
-        
         # 1. Parallel Search (Simulated)
-        res_bm25 = self.search_bm25(query, top_k=top_k_fusion*2)
-        res_vec = self.search_vector(query, top_k=top_k_fusion*2)
+        res_bm25 = self.search_bm25_many(queries, top_k=top_k_fusion*2, where=where)
+        res_vec = self.search_vector_many(queries, top_k=top_k_fusion*2, where=where, query_embeddings=query_embeddings)
         
         # 2. Fusion
-        fused = self.reciprocal_rank_fusion([res_bm25, res_vec])
-        return fused[:top_k_fusion]
+        return [self.fuse_candidates(bm25_list, vec_list, top_k_fusion, config) for bm25_list, vec_list in zip(res_bm25, res_vec)]
+
+    def query_wheres(self, query_embeddings: list, where: dict = None, two_stage: bool = None,
+                     top_documents=TWO_STAGE_TOP_DOCUMENTS):
+        """Filtro de búsqueda: el `where` tal cual o, con `two_stage`, uno por query restringido a sus documentos."""
+        if two_stage is None:
+            two_stage = TWO_STAGE_RETRIEVAL
+        if two_stage:
+            return self._two_stage_wheres(query_embeddings, where, top_documents)
+        return where
+
+    def fuse_candidates(self, bm25_list: list, vec_list: list, top_k_fusion: int, config: dict) -> list:
+        """Fusión + corte adaptativo + colapso de duplicados de una query (`config` ya resuelta)."""
+        fused = self.fuse(
+            [bm25_list, vec_list], method=config["method"], weights=config["weights"], rrf_k=config["rrf_k"]
+        )[:top_k_fusion]
+        keep = adaptive_cutoff([item["fusion_score"] for item in fused], config["cutoff_gap"], config["min_candidates"])
+        fused = fused[:keep]
+        if DEDUP_CANDIDATES:
+            # Mismo texto republicado en varios códigos BOE -> un solo candidato con todas sus fuentes
+            fused = collapse_near_duplicates(fused)
+        return fused
+
+    def search_many(self, queries: list, top_k_fusion=10, top_k=5, where: dict = None, rerank=True, two_stage: bool = None,
+                    fusion: dict = None):
+        """Hybrid search + rerank para un lote de queries.
+
+        Devuelve una lista de resultados por query, idéntica a llamar a
+        `hybrid_search` + `rerank` con cada una, pero con un solo lote de
+        embeddings, una sola consulta multi-query a Chroma, BM25 vectorizado
+        y los pares del Cross-Encoder compartiendo lotes.
+        """
+        queries = list(queries)
+        if not queries:
+            return []
+        logger.info(f"🔎 Hybrid Search (batch): {len(queries)} queries")
+
+        fused_lists = self._hybrid_many(queries, top_k_fusion=top_k_fusion, where=where, two_stage=two_stage, fusion=fusion)
+        if not rerank:
+            return [fused[:top_k] for fused in fused_lists]
+        return self.rerank_many(queries, fused_lists, top_k=top_k)
 
     def rerank(self, query: str, candidates: list, top_k=5):
-        if not self.reranker or not candidates:
-            return candidates[:top_k]
+        return self.rerank_many([query], [candidates], top_k=top_k)[0]
+
+    def rerank_many(self, queries: list, candidates_lists: list, top_k=5):
+        """Reordena los candidatos de varias queries puntuando todos los pares en lotes compartidos."""
+        if not self.reranker:
+            return [candidates[:top_k] for candidates in candidates_lists]
+
+        pairs = [[query, c['document']] for query, candidates in zip(queries, candidates_lists) for c in candidates]
+        if not pairs:
+            return [candidates[:top_k] for candidates in candidates_lists]
             
-        logger.info(f"⚖️ Reranking {len(candidates)} candidatos...")
-        
-        pairs = [[query, c['document']] for c in candidates]
-        scores = self.reranker.predict(pairs)
+        logger.info(f"⚖️ Reranking {len(pairs)} candidatos...")
+        scores = self.reranker.predict(pairs, batch_size=RERANK_BATCH_SIZE)
         
-        # Adjuntar score y ordenar
-        for i, candidate in enumerate(candidates):
-            candidate['rerank_score'] = float(scores[i])
+        reranked_lists = []
+        offset = 0
+        for candidates in candidates_lists:
+            # Adjuntar score y ordenar
+            for i, candidate in enumerate(candidates):
+                candidate['rerank_score'] = float(scores[offset + i])
+            offset += len(candidates)
             
-        # Ordenar por rerank_score descendente
-        reranked = sorted(candidates, key=lambda x: x['rerank_score'], reverse=True)
+            # Ordenar por rerank_score descendente
+            reranked = sorted(candidates, key=lambda x: x['rerank_score'], reverse=True)
+            reranked_lists.append(reranked[:top_k])
         
         # Debug Log de cambios
         # for i, r in enumerate(reranked[:3]):
         #    logger.info(f"   #{i+1} Score: {r['rerank_score']:.4f} | {r['metadata'].get('source')}")
             
-        return reranked[:top_k]
-
+        return reranked_lists
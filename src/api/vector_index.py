@@ -0,0 +1,249 @@
+import os
+import json
+import logging
+import numpy as np
+
+# Backends opcionales: solo se exigen si se activan
+try:
+    import hnswlib
+except ImportError:
+    hnswlib = None
+
+try:
+    import faiss
+except ImportError:
+    faiss = None
+
+logger = logging.getLogger(__name__)
+
+# Parámetros HNSW por defecto
+DEFAULT_HNSW_M = 32
+DEFAULT_EF_CONSTRUCTION = 200
+DEFAULT_EF_SEARCH = 64
+# Sub-cuantizadores PQ (384 dims / 48 = 8 dims por sub-vector, 48 bytes por vector)
+DEFAULT_PQ_M = 48
+# Lote de lectura de embeddings desde Chroma
+FETCH_BATCH_SIZE = 5000
+
+BACKENDS = ("hnswlib", "faiss")
+QUANTIZATIONS = (None, "int8", "pq")
+
+
+def iter_collection_embeddings(collection, batch_size=FETCH_BATCH_SIZE, include=None):
+    """Recorre una colección de Chroma por páginas devolviendo (ids, embeddings float32, datos)."""
+    include = list(include or []) + ["embeddings"]
+    offset = 0
+    while True:
+        data = collection.get(include=include, limit=batch_size, offset=offset)
+        ids = data["ids"]
+        if not ids:
+            break
+        yield ids, np.asarray(data["embeddings"], dtype=np.float32), data
+        offset += len(ids)
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+class ANNIndex:
+    """Índice ANN local sobre los embeddings de Chroma.
+
+    - backend "hnswlib": HNSW con vectores float32.
+    - backend "faiss": HNSW con vectores float32, int8 (scalar quantizer) o PQ.
+
+    Los vectores se normalizan y se indexan con L2, así que las distancias
+    devueltas (L2 al cuadrado) son comparables con las del espacio por
+    defecto de Chroma y el orden coincide con el de similitud coseno.
+    """
+
+    def __init__(self, backend="hnswlib", quantization=None, M=DEFAULT_HNSW_M,
+                 ef_construction=DEFAULT_EF_CONSTRUCTION, ef_search=DEFAULT_EF_SEARCH, pq_m=DEFAULT_PQ_M):
+        if backend not in BACKENDS:
+            raise ValueError(f"Backend ANN no soportado: {backend}. Opciones: {BACKENDS}")
+        if quantization not in QUANTIZATIONS:
+            raise ValueError(f"Cuantización no soportada: {quantization}. Opciones: {QUANTIZATIONS}")
+        if backend == "hnswlib" and quantization:
+            raise ValueError("hnswlib solo soporta vectores float32; usa backend='faiss' para int8/pq.")
+        if backend == "hnswlib" and hnswlib is None:
+            raise ImportError("hnswlib no está instalado (pip install hnswlib).")
+        if backend == "faiss" and faiss is None:
+            raise ImportError("faiss no está instalado (pip install faiss-cpu).")
+
+        self.backend = backend
+        self.quantization = quantization
+        self.M = M
+        self.ef_construction = ef_construction
+        self.ef_search = ef_search
+        self.pq_m = pq_m
+        self.index = None
+        self.ids = [] # etiqueta interna (posición) -> id de Chroma
+        self.deleted = set() # etiquetas obsoletas (chunks borrados o re-ingestados)
+        self.dim = None
+        self.corpus_version = None # huella del contenido indexado (la fija quien construye/actualiza el índice)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def config(self) -> dict:
+        return {
+            "backend": self.backend,
+            "quantization": self.quantization,
+            "M": self.M,
+            "ef_construction": self.ef_construction,
+            "ef_search": self.ef_search,
+            "pq_m": self.pq_m
+        }
+
+    def _create(self, dim: int, capacity: int):
+        self.dim = dim
+        if self.backend == "hnswlib":
+            index = hnswlib.Index(space="l2", dim=dim)
+            index.init_index(max_elements=max(capacity, 1), M=self.M, ef_construction=self.ef_construction)
+            index.set_ef(self.ef_search)
+            return index
+
+        if self.quantization == "int8":
+            index = faiss.IndexHNSWSQ(dim, faiss.ScalarQuantizer.QT_8bit, self.M)
+        elif self.quantization == "pq":
+            index = faiss.IndexHNSWPQ(dim, self.pq_m, self.M)
+        else:
+            index = faiss.IndexHNSWFlat(dim, self.M)
+        index.hnsw.efConstruction = self.ef_construction
+        index.hnsw.efSearch = self.ef_search
+        return index
+
+    def build(self, ids: list, vectors: np.ndarray):
+        """Construye el índice desde cero."""
+        vectors = _normalize(vectors)
+        self.index = self._create(vectors.shape[1], len(ids))
+        self.ids = []
+        self.deleted = set()
+        if self.backend == "faiss" and not self.index.is_trained:
+            # int8/PQ necesitan aprender los rangos/centroides antes de añadir
+            self.index.train(vectors)
+        self.add(ids, vectors)
+
+    def add(self, ids: list, vectors: np.ndarray):
+        if not len(ids):
+            return
+        vectors = _normalize(vectors)
+        start = len(self.ids)
+        if self.backend == "hnswlib":
+            needed = start + len(ids)
+            if needed > self.index.get_max_elements():
+                self.index.resize_index(max(needed, 2 * self.index.get_max_elements()))
+            self.index.add_items(vectors, np.arange(start, start + len(ids)))
+        else:
+            self.index.add(vectors)
+        self.ids.extend(ids)
+
+    def remove(self, ids: list):
+        """Marca como obsoletos los vectores de estos ids (HNSW no permite borrar de verdad).
+
+        hnswlib los excluye de las búsquedas; con faiss el llamador descarta
+        las etiquetas de `deleted`.
+        """
+        ids = set(ids)
+        labels = [label for label, doc_id in enumerate(self.ids) if doc_id in ids and label not in self.deleted]
+        if self.backend == "hnswlib":
+            for label in labels:
+                self.index.mark_deleted(label)
+        self.deleted.update(labels)
+
+    def live_ids(self) -> list:
+        return [doc_id for label, doc_id in enumerate(self.ids) if label not in self.deleted]
+
+    def build_from_collection(self, collection, batch_size=FETCH_BATCH_SIZE):
+        """Reconstruye el índice leyendo todos los embeddings de una colección de Chroma."""
+        all_ids, chunks = [], []
+        for ids, vectors, _ in iter_collection_embeddings(collection, batch_size):
+            all_ids.extend(ids)
+            chunks.append(vectors)
+        if not all_ids:
+            logger.warning("⚠️ Colección vacía: índice ANN sin vectores.")
+            self.index, self.ids = None, []
+            return self
+        self.build(all_ids, np.vstack(chunks))
+        logger.info(f"✅ Índice ANN ({self.backend}/{self.quantization or 'float32'}) con {len(self.ids)} vectores.")
+        return self
+
+    def set_ef_search(self, ef_search: int):
+        self.ef_search = ef_search
+        if self.index is None:
+            return
+        if self.backend == "hnswlib":
+            self.index.set_ef(ef_search)
+        else:
+            self.index.hnsw.efSearch = ef_search
+
+    def search(self, query_vectors, k: int):
+        """Devuelve (etiquetas, distancias L2²) de forma (n_queries, k); -1 indica hueco."""
+        queries = _normalize(np.atleast_2d(np.asarray(query_vectors, dtype=np.float32)))
+        if self.index is None or not self.ids:
+            empty = np.full((len(queries), k), -1, dtype=np.int64)
+            return empty, np.full((len(queries), k), np.inf, dtype=np.float32)
+
+        k_eff = min(k, len(self.ids))
+        if self.backend == "hnswlib":
+            # Los marcados como borrados no se devuelven: no pedir más vecinos de los que quedan
+            k_eff = min(k_eff, len(self.ids) - len(self.deleted))
+            if k_eff <= 0:
+                empty = np.full((len(queries), k), -1, dtype=np.int64)
+                return empty, np.full((len(queries), k), np.inf, dtype=np.float32)
+            # hnswlib exige ef >= k
+            self.index.set_ef(max(self.ef_search, k_eff))
+            labels, dists = self.index.knn_query(queries, k=k_eff)
+            labels = labels.astype(np.int64)
+        else:
+            dists, labels = self.index.search(queries, k_eff)
+
+        if k_eff < k:
+            pad = k - k_eff
+            labels = np.pad(labels, ((0, 0), (0, pad)), constant_values=-1)
+            dists = np.pad(dists, ((0, 0), (0, pad)), constant_values=np.inf)
+        return labels, dists
+
+    def memory_bytes(self) -> int:
+        """Tamaño aproximado del índice serializado (vectores + grafo)."""
+        if self.index is None:
+            return 0
+        if self.backend == "hnswlib":
+            # Vectores float32 + lista de vecinos del nivel 0 (2*M enlaces int32) + etiqueta
+            per_item = self.dim * 4 + (2 * self.M + 1) * 4 + 8
+            return per_item * self.index.get_current_count()
+        return int(faiss.serialize_index(self.index).nbytes)
+
+    def save(self, directory: str):
+        os.makedirs(directory, exist_ok=True)
+        index_path = os.path.join(directory, "index.bin")
+        if self.backend == "hnswlib":
+            self.index.save_index(index_path)
+        else:
+            faiss.write_index(self.index, index_path)
+        with open(os.path.join(directory, "index_meta.json"), "w", encoding="utf-8") as f:
+            json.dump({"config": self.config(), "dim": self.dim, "ids": self.ids, "deleted": sorted(self.deleted),
+                       "corpus_version": self.corpus_version}, f)
+
+    @classmethod
+    def load(cls, directory: str):
+        with open(os.path.join(directory, "index_meta.json"), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        ann = cls(**meta["config"])
+        ann.dim = meta["dim"]
+        ann.ids = meta["ids"]
+        ann.deleted = set(meta.get("deleted", []))
+        ann.corpus_version = meta.get("corpus_version")
+        index_path = os.path.join(directory, "index.bin")
+        if ann.backend == "hnswlib":
+            ann.index = hnswlib.Index(space="l2", dim=ann.dim)
+            ann.index.load_index(index_path, max_elements=max(len(ann.ids), 1))
+            ann.index.set_ef(ann.ef_search)
+        else:
+            # read_index ya devuelve la subclase concreta (IndexHNSWFlat/SQ/PQ)
+            ann.index = faiss.read_index(index_path)
+            ann.index.hnsw.efSearch = ann.ef_search
+        return ann
@@ -7,6 +7,9 @@ from ragas.metrics import faithfulness, answer_relevancy
 from langchain_community.chat_models import ChatOllama
 from langchain_community.embeddings import OllamaEmbeddings
 import json
+import time
+import hashlib
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 # Setup logging
 logging.basicConfig(level=logging.ERROR)
@@ -27,18 +30,117 @@ llm_judge = ChatOllama(
 
 embeddings_judge = OllamaEmbeddings(model="llama3.2")
 
+BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '../../'))
+# Respuestas concurrentes del grafo (acotado: Ollama atiende pocas peticiones en paralelo)
+RAGAS_GENERATION_WORKERS = int(os.getenv("RAGAS_GENERATION_WORKERS", "2"))
+RAGAS_STYLE = "Formal"
+# Caché de respuestas generadas, por pregunta y versión del pipeline
+RESPONSE_CACHE_PATH = os.path.join("eval_cache", "ragas", "responses.json")
+# Código del pipeline de respuesta (todo lo que importa el grafo): si cambia algún módulo, las respuestas se regeneran
+PIPELINE_DIRS = ("src/api", "src/utils")
+
+def pipeline_files() -> list:
+    """Módulos .py de PIPELINE_DIRS (subcarpetas incluidas), en orden estable."""
+    files = []
+    for relative_dir in PIPELINE_DIRS:
+        for root, dirs, names in os.walk(os.path.join(BASE_DIR, relative_dir)):
+            dirs[:] = sorted(d for d in dirs if d != "__pycache__")
+            files.extend(os.path.join(root, name) for name in sorted(names) if name.endswith(".py"))
+    return files
+
 def load_dataset(path="data/golden_dataset.json"):
     with open(path, "r") as f:
         return json.load(f)
 
+def pipeline_version(main_module) -> str:
+    """Versión del pipeline de respuesta: índice (corpus + modelos), LLM, código del grafo y CSV de RR.HH."""
+    from src.utils.hr_analytics import get_hr_analytics
+    digest = hashlib.sha256()
+    digest.update(main_module.retrieval_engine.index_version().encode("utf-8"))
+    digest.update(f"{main_module.LLM_TEXT_MODEL}|{RAGAS_STYLE}".encode("utf-8"))
+    for path in pipeline_files():
+        digest.update(os.path.relpath(path, BASE_DIR).encode("utf-8"))
+        with open(path, "rb") as f:
+            digest.update(f.read())
+    # Datos que consultan el motor SQL, las plantillas y el extractor de entidades (mismos ficheros que HRAnalytics)
+    for path in get_hr_analytics().files.values():
+        mtime = os.path.getmtime(path) if os.path.exists(path) else None
+        digest.update(f"{os.path.basename(path)}|{mtime}".encode("utf-8"))
+    return digest.hexdigest()[:16]
+
+def load_response_cache(path=RESPONSE_CACHE_PATH) -> dict:
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def save_response_cache(cache: dict, path=RESPONSE_CACHE_PATH):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(cache, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+def response_key(question: str, version: str) -> str:
+    return hashlib.sha256(f"{version}\0{question}".encode("utf-8")).hexdigest()[:24]
+
+def generate_one(app_graph, question: str) -> dict:
+    # Invocar Grafo
+    initial_state = {
+        "pregunta": question,
+        "style": RAGAS_STYLE,
+        "debug_pipeline": []
+    }
+    start = time.perf_counter()
+    res = app_graph.invoke(initial_state)
+    latency_ms = (time.perf_counter() - start) * 1000
+    # RAGAS espera 'contexts' como lista de strings: un elemento por chunk recuperado
+    contexts = [c for c in (res.get("contextos") or []) if c]
+    if not contexts and res.get("docs_recuperados"):
+        # Rutas sin chunks (DATA tools): el bloque de datos es el único contexto
+        contexts = [res["docs_recuperados"]]
+    return {
+        "question": question,
+        "answer": res.get("respuesta", ""),
+        "contexts": contexts or [""],
+        "answer_path": res.get("answer_path", "llm"),
+        "latency_ms": latency_ms
+    }
+
 def generate_responses(dataset):
     """
     Genera respuestas usando el 'main.py' actual.
-    Importante: Importar `app_graph` o la función `chat`.
+
+    Las respuestas se guardan en una caché por (pregunta, versión del
+    pipeline): si RAGAS falla y se relanza, solo se generan las que faltan o
+    cuyo pipeline cambió. La generación va en paralelo con un máximo de
+    RAGAS_GENERATION_WORKERS peticiones a la vez.
     """
     import sys
-    sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../../')))
-    from src.api.main import app_graph
+    sys.path.append(BASE_DIR)
+    import src.api.main as main_module
+    
+    version = pipeline_version(main_module)
+    cache = load_response_cache()
+    keys = [response_key(item["question"], version) for item in dataset]
+    pending = [item["question"] for item, key in zip(dataset, keys) if key not in cache]
+    
+    print(f"🔄 Generando respuestas para {len(dataset)} preguntas (pipeline {version}): "
+          f"{len(dataset) - len(pending)} en caché, {len(pending)} por generar...")
+    
+    with ThreadPoolExecutor(max_workers=RAGAS_GENERATION_WORKERS, thread_name_prefix="ragas-gen") as executor:
+        futures = {executor.submit(generate_one, main_module.app_graph, q): q for q in pending}
+        for done, future in enumerate(as_completed(futures), start=1):
+            q = futures[future]
+            try:
+                entry = future.result()
+            except Exception as e:
+                print(f"   ❌ [{done}/{len(pending)}] {q}: {e}")
+                continue
+            # Guardado tras cada respuesta (en este hilo): una ejecución interrumpida se retoma
+            cache[response_key(q, version)] = entry
+            save_response_cache(cache)
+            print(f"   [{done}/{len(pending)}] {entry['latency_ms'] / 1000:.1f}s ({entry['answer_path']}) Pregunta: {q}")
     
     ragas_data = {
         "question": [],
@@ -46,41 +148,31 @@ def generate_responses(dataset):
         "contexts": [],
         "ground_truth": []
     }
+    generation = {"generation_ms": [], "answer_path": []}
     
-    print(f"🔄 Generando respuestas para {len(dataset)} preguntas...")
-    
-    for i, item in enumerate(dataset):
-        q = item["question"]
-        gt = item["ground_truth"]
-        
-        print(f"   [{i+1}/{len(dataset)}] Pregunta: {q}")
-        
-        # Invocar Grafo
-        initial_state = {
-            "pregunta": q,
-            "style": "Formal",
-            "debug_pipeline": []
-        }
-        res = app_graph.invoke(initial_state)
-        
-        answer = res.get("respuesta", "")
-        # Extraer contextos (docs_recuperados es un string gigante, hay que ver si lo podemos trocear o lo pasamos entero)
-        # RAGAS espera 'contexts' como lista de strings.
-        context_str = res.get("docs_recuperados", "")
-        contexts = [context_str] if context_str else [""]
-        
-        ragas_data["question"].append(q)
-        ragas_data["answer"].append(answer)
-        ragas_data["contexts"].append(contexts)
-        ragas_data["ground_truth"].append(gt)
+    for item, key in zip(dataset, keys):
+        entry = cache.get(key)
+        if not entry:
+            continue
+        ragas_data["question"].append(item["question"])
+        ragas_data["answer"].append(entry["answer"])
+        ragas_data["contexts"].append(entry["contexts"])
+        ragas_data["ground_truth"].append(item["ground_truth"])
+        generation["generation_ms"].append(entry["latency_ms"])
+        generation["answer_path"].append(entry["answer_path"])
         
-    return ragas_data
+    return ragas_data, generation
 
 def main():
     print("📋 Iniciando Evaluación RAGAS...")
     
     dataset_raw = load_dataset()
-    data_dict = generate_responses(dataset_raw)
+    data_dict, generation = generate_responses(dataset_raw)
+    if not data_dict["question"]:
+        print("⚠️ No se generó ninguna respuesta. Revisa el grafo y vuelve a ejecutar.")
+        return
+    latencies = pd.Series(generation["generation_ms"])
+    print(f"⏱️ Generación por pregunta: p50={latencies.quantile(0.5) / 1000:.1f}s p95={latencies.quantile(0.95) / 1000:.1f}s")
     
     # Crear HF Dataset
     eval_dataset = Dataset.from_dict(data_dict)
@@ -113,6 +205,8 @@ def main():
     
     # Guardar CSV detallado
     df = results.to_pandas()
+    df["generation_ms"] = generation["generation_ms"]
+    df["answer_path"] = generation["answer_path"]
     df.to_csv("ragas_metrics.csv", index=False)
     print("💾 Resultados guardados en 'ragas_metrics.csv'")
 
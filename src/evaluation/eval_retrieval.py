@@ -1,106 +1,224 @@
 import json
 import logging
+import hashlib
 import pandas as pd
-import sys
-sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../../')))
-from src.api.retrieval_engine import RetrievalEngine
+import numpy as np
 import os
 import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../../')))
+from src.api.retrieval_engine import RetrievalEngine, DEFAULT_FUSION_CONFIG, DEDUP_CANDIDATES, TWO_STAGE_RETRIEVAL
 
 # Setup logging
 logging.basicConfig(level=logging.ERROR) # Only errors to keep output clean
 logger = logging.getLogger(__name__)
 
+# Candidatos fusionados por pregunta (todos se rerankean una vez; cada config recorta su Top-K)
+TOP_K_FUSION = 20
+# Configuraciones comparadas: solo difiere el corte, así que todas salen de la misma caché
+TOP_K_CONFIGS = [("Top-3 (Strict)", 3), ("Top-10 (Broad)", 10)]
+# Preguntas por lote de `search_many` y lotes evaluados en paralelo
+EVAL_BATCH_SIZE = int(os.getenv("EVAL_BATCH_SIZE", "8"))
+EVAL_WORKERS = int(os.getenv("EVAL_WORKERS", "2"))
+# Caché de candidatos en disco, un fichero por versión del índice
+EVAL_CACHE_DIR = os.path.join("eval_cache", "retrieval")
+# p50/p95 salen del lote completo repartido entre sus preguntas, el mismo para todas las configs
+LATENCY_NOTE = "lote amortizado (común a todas las configs)"
+
 def load_dataset(path="data/golden_dataset.json"):
     with open(path, "r") as f:
         return json.load(f)
 
-def evaluate_config(engine, dataset, top_k=5, config_name="Config A"):
+def question_key(question: str) -> str:
+    return hashlib.sha256(question.encode("utf-8")).hexdigest()[:16]
+
+class CandidateCache:
+    """Candidatos rerankeados por pregunta, persistidos en JSON por versión de índice.
+
+    La clave combina `RetrievalEngine.index_version()` (corpus y modelos) con
+    los ajustes de recuperación que afectan a los candidatos; si algo cambia
+    se usa otro fichero y no se mezclan resultados. Se guarda tras cada lote:
+    una evaluación interrumpida continúa donde se quedó.
+    """
+
+    def __init__(self, engine, cache_dir: str = EVAL_CACHE_DIR, top_k_fusion: int = TOP_K_FUSION):
+        settings = {
+            "index": engine.index_version(),
+            "top_k_fusion": top_k_fusion,
+            "fusion": DEFAULT_FUSION_CONFIG,
+            "dedup": DEDUP_CANDIDATES,
+            "two_stage": TWO_STAGE_RETRIEVAL
+        }
+        self.version = hashlib.sha256(json.dumps(settings, sort_keys=True, default=str).encode("utf-8")).hexdigest()[:16]
+        self.path = os.path.join(cache_dir, f"candidates_{self.version}.json")
+        self.entries = {}
+        if os.path.exists(self.path):
+            with open(self.path, "r", encoding="utf-8") as f:
+                self.entries = json.load(f).get("questions", {})
+        self.settings = settings
+
+    def missing(self, questions: list) -> list:
+        return [q for q in questions if question_key(q) not in self.entries]
+
+    def get(self, question: str) -> dict:
+        return self.entries.get(question_key(question))
+
+    def put_many(self, entries: dict):
+        self.entries.update(entries)
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"settings": self.settings, "questions": self.entries}, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+def retrieve_batch(engine, questions: list) -> dict:
+    """Fusión + rerank de todos los candidatos de un lote; la latencia es la del lote repartida por pregunta.
+
+    Si el lote falla devuelve {}: sus preguntas quedan fuera de la caché y
+    `fill_cache` las informa como fallidas (no cuentan como fallos de recuperación).
+    """
+    start = time.perf_counter()
+    try:
+        batch_results = engine.search_many(questions, top_k_fusion=TOP_K_FUSION, top_k=TOP_K_FUSION)
+    except Exception as e:
+        print(f"Error processing batch: {e}")
+        return {}
+    latency_ms = (time.perf_counter() - start) * 1000 / len(questions)
+    entries = {}
+    for question, final_results in zip(questions, batch_results):
+        entries[question_key(question)] = {
+            "question": question,
+            "latency_ms": latency_ms,
+            "candidates": [
+                {
+                    "id": res["id"],
+                    "source": res["metadata"].get("source", ""),
+                    "rerank_score": res.get("rerank_score"),
+                    "fusion_score": res.get("fusion_score")
+                }
+                for res in final_results
+            ]
+        }
+    return entries
+
+def fill_cache(engine, cache: CandidateCache, questions: list) -> list:
+    """Calcula las preguntas que faltan en la caché; devuelve las que fallaron (se reintentan en la próxima ejecución)."""
+    pending = cache.missing(questions)
+    print(f"🗂️ Caché {cache.version}: {len(questions) - len(pending)} preguntas en caché, {len(pending)} por calcular.")
+    if not pending:
+        return []
+    failed = []
+    batches = [pending[i:i + EVAL_BATCH_SIZE] for i in range(0, len(pending), EVAL_BATCH_SIZE)]
+    with ThreadPoolExecutor(max_workers=EVAL_WORKERS, thread_name_prefix="eval-retrieval") as executor:
+        # Los resultados se guardan en el hilo principal a medida que termina cada lote
+        results = executor.map(lambda batch: retrieve_batch(engine, batch), batches)
+        for done, (batch, entries) in enumerate(zip(batches, results), start=1):
+            if entries:
+                cache.put_many(entries)
+            failed.extend(q for q in batch if question_key(q) not in entries)
+            print(f"   Lote {done}/{len(batches)} ({len(entries)} preguntas)")
+    return failed
+
+def latency_stats(latencies: list) -> dict:
+    if not latencies:
+        return {"p50 (ms)": float("nan"), "p95 (ms)": float("nan")}
+    return {
+        "p50 (ms)": float(np.percentile(latencies, 50)),
+        "p95 (ms)": float(np.percentile(latencies, 95))
+    }
+
+def evaluate_config(cache, dataset, top_k=5, config_name="Config A"):
     print(f"\n🚀 Evaluando: {config_name} (Top-K={top_k})...")
-    
+
     hits = 0
     mrr_sum = 0
-    total = len(dataset)
-    
+    total = 0
+    failed = 0
+
     results_detail = []
+    latencies = []
 
     for item in dataset:
         question = item["question"]
         expected_doc = item["reference_doc"]
-        
-        # Retrieval (Hybrid + Rerank)
-        # We simulate different configs by changing top_k in the final step or retrieval
-        try:
-             # Get more candidates first to allow reranker to work
-            hybrid_candidates = engine.hybrid_search(question, top_k_fusion=20) 
-            final_results = engine.rerank(question, hybrid_candidates, top_k=top_k)
-            
-            # Check correctness
-            found = False
-            rank = 0
-            
-            retrieved_docs_names = []
-            
-            for i, res in enumerate(final_results):
-                doc_name = res['metadata'].get('source', '')
-                retrieved_docs_names.append(doc_name)
-                
-                # Check match (exact filename)
-                if expected_doc == doc_name:
-                    found = True
-                    rank = i + 1
-                    break
-            
-            if found:
-                hits += 1
-                mrr_sum += 1.0 / rank
-                
-            results_detail.append({
-                "Question": question,
-                "Expected": expected_doc,
-                "Found": found,
-                "Rank": rank
-            })
-            
-        except Exception as e:
-            print(f"Error processing '{question}': {e}")
-            
-    hit_rate = hits / total
-    mrr = mrr_sum / total
-    
+        entry = cache.get(question)
+        if entry is None:
+            # La recuperación falló: se excluye de las métricas (no es un fallo del ranking)
+            failed += 1
+            continue
+        total += 1
+        # Top-K de esta config = prefijo de la lista rerankeada completa
+        final_results = entry["candidates"][:top_k]
+        latencies.append(entry["latency_ms"])
+
+        # Check correctness
+        found = False
+        rank = 0
+
+        for i, res in enumerate(final_results):
+            # Check match (exact filename)
+            if expected_doc == res["source"]:
+                found = True
+                rank = i + 1
+                break
+
+        if found:
+            hits += 1
+            mrr_sum += 1.0 / rank
+
+        results_detail.append({
+            "Question": question,
+            "Expected": expected_doc,
+            "Found": found,
+            "Rank": rank
+        })
+
+    hit_rate = hits / total if total else float("nan")
+    mrr = mrr_sum / total if total else float("nan")
+
     return {
         "Config": config_name,
         "Hit Rate": hit_rate,
-        "MRR": mrr
+        "MRR": mrr,
+        "Preguntas": total,
+        "Fallidas": failed,
+        **latency_stats(latencies),
+        "Latencia": LATENCY_NOTE
     }
 
 def main():
     print("📋 Iniciando Evaluación de Retrieval...")
-    
+
     # Initialize Engine
     BASE_DIR = os.getcwd()
     CHROMA_PATH = os.path.join(BASE_DIR, "chroma_db")
     COLLECTION_NAME = "rag_multimodal"
-    
+
     engine = RetrievalEngine(CHROMA_PATH, COLLECTION_NAME)
-    
+
     dataset = load_dataset()
-    
+
+    # Candidatos (fusión + rerank) una sola vez por pregunta y versión de índice
+    cache = CandidateCache(engine)
+    failed = fill_cache(engine, cache, [item["question"] for item in dataset])
+    if failed:
+        print(f"⚠️ {len(failed)} preguntas sin candidatos por errores de recuperación (excluidas de las métricas):")
+        for question in failed:
+            print(f"   - {question}")
+
     # Run Comparison (Requirement: Comparative Table)
-    # Config 1: Strict (Top-3)
-    res1 = evaluate_config(engine, dataset, top_k=3, config_name="Top-3 (Strict)")
-    
-    # Config 2: Broad (Top-10)
-    res2 = evaluate_config(engine, dataset, top_k=10, config_name="Top-10 (Broad)")
-    
+    rows = [evaluate_config(cache, dataset, top_k=top_k, config_name=name) for name, top_k in TOP_K_CONFIGS]
+
     # Create DataFrame
-    df = pd.DataFrame([res1, res2])
-    
+    df = pd.DataFrame(rows)
+
     print("\n\n📊 TABLA COMPARATIVA DE RESULTADOS (Retrieval):")
     print("="*60)
     print(df.to_string(index=False))
     print("="*60)
-    
+    print("ℹ️ Latencia por pregunta = tiempo del lote (fusión + rerank de todos los candidatos) / tamaño del lote; común a todas las configs.")
+
     # Save to CSV
     df.to_csv("retrieval_metrics.csv", index=False)
     print("💾 Resultados guardados en 'retrieval_metrics.csv'")
@@ -0,0 +1,146 @@
+import json
+import logging
+import os
+import sys
+import time
+import numpy as np
+import pandas as pd
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../../')))
+import chromadb
+import torch
+from chromadb.utils import embedding_functions
+from src.api.vector_index import ANNIndex, iter_collection_embeddings
+
+# Setup logging
+logging.basicConfig(level=logging.ERROR) # Only errors to keep output clean
+logger = logging.getLogger(__name__)
+
+EMBEDDING_MODEL_NAME = "all-MiniLM-L6-v2"
+TOP_K = 10
+# Chunks del corpus usados como queries extra (además del golden dataset)
+NUM_SAMPLE_QUERIES = 200
+
+# Configuraciones a comparar contra la búsqueda vectorial actual (Chroma)
+ANN_CONFIGS = [
+    {"backend": "hnswlib", "quantization": None, "M": 16, "ef_search": 32},
+    {"backend": "hnswlib", "quantization": None, "M": 32, "ef_search": 64},
+    {"backend": "hnswlib", "quantization": None, "M": 32, "ef_search": 128},
+    {"backend": "faiss", "quantization": None, "M": 32, "ef_search": 64},
+    {"backend": "faiss", "quantization": "int8", "M": 32, "ef_search": 64},
+    {"backend": "faiss", "quantization": "pq", "M": 32, "ef_search": 128},
+]
+
+def load_dataset(path="data/golden_dataset.json"):
+    with open(path, "r") as f:
+        return json.load(f)
+
+def exact_neighbors(corpus: np.ndarray, queries: np.ndarray, k: int) -> np.ndarray:
+    """Vecinos exactos (fuerza bruta) sobre vectores normalizados: verdad terreno para recall."""
+    sims = queries @ corpus.T
+    top = np.argpartition(-sims, kth=min(k, sims.shape[1] - 1), axis=1)[:, :k]
+    order = np.take_along_axis(sims, top, axis=1).argsort(axis=1)[:, ::-1]
+    return np.take_along_axis(top, order, axis=1)
+
+def recall_at_k(retrieved: list, expected: np.ndarray) -> float:
+    total = 0.0
+    for got, truth in zip(retrieved, expected):
+        total += len(set(got) & set(truth.tolist())) / len(truth)
+    return total / len(expected)
+
+def latency_stats(latencies: list) -> dict:
+    return {
+        "p50 (ms)": float(np.percentile(latencies, 50)) * 1000,
+        "p95 (ms)": float(np.percentile(latencies, 95)) * 1000
+    }
+
+def main():
+    print("📋 Comparando backends vectoriales (Chroma vs ANN local)...")
+
+    BASE_DIR = os.getcwd()
+    CHROMA_PATH = os.path.join(BASE_DIR, "chroma_db")
+    COLLECTION_NAME = "rag_multimodal"
+
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    ef = embedding_functions.SentenceTransformerEmbeddingFunction(model_name=EMBEDDING_MODEL_NAME, device=device)
+    client = chromadb.PersistentClient(path=CHROMA_PATH)
+    collection = client.get_or_create_collection(name=COLLECTION_NAME, embedding_function=ef)
+
+    # 1. Corpus completo (ids + embeddings) desde Chroma
+    ids, chunks, docs = [], [], []
+    for batch_ids, vectors, data in iter_collection_embeddings(collection, include=["documents"]):
+        ids.extend(batch_ids)
+        chunks.append(vectors)
+        docs.extend(data["documents"])
+    if not ids:
+        print("⚠️ Colección vacía. Ejecuta la ingesta primero.")
+        return
+    corpus = np.vstack(chunks)
+    corpus /= np.maximum(np.linalg.norm(corpus, axis=1, keepdims=True), 1e-12)
+    id_to_pos = {doc_id: pos for pos, doc_id in enumerate(ids)}
+    print(f"   Corpus: {len(ids)} vectores de {corpus.shape[1]} dims.")
+
+    # 2. Queries: golden dataset + muestra de chunks
+    rng = np.random.default_rng(42)
+    sample = rng.choice(len(docs), size=min(NUM_SAMPLE_QUERIES, len(docs)), replace=False)
+    query_texts = [item["question"] for item in load_dataset()] + [docs[i][:300] for i in sample]
+    queries = np.asarray(ef(query_texts), dtype=np.float32)
+    queries /= np.maximum(np.linalg.norm(queries, axis=1, keepdims=True), 1e-12)
+    k = min(TOP_K, len(ids))
+    truth = exact_neighbors(corpus, queries, k)
+
+    rows = []
+
+    # 3. Ruta actual: HNSW interno de Chroma
+    latencies, retrieved = [], []
+    for q in queries:
+        start = time.perf_counter()
+        res = collection.query(query_embeddings=[q.tolist()], n_results=k, include=[])
+        latencies.append(time.perf_counter() - start)
+        retrieved.append([id_to_pos[i] for i in res["ids"][0]])
+    rows.append({
+        "Config": "chroma (actual)",
+        f"Recall@{k}": recall_at_k(retrieved, truth),
+        **latency_stats(latencies),
+        "Memoria (MB)": corpus.nbytes / 1e6, # vectores float32 en bruto (sin grafo)
+        "Build (s)": float("nan")
+    })
+
+    # 4. Índices ANN locales
+    for cfg in ANN_CONFIGS:
+        name = f"{cfg['backend']} {cfg['quantization'] or 'float32'} M={cfg['M']} ef={cfg['ef_search']}"
+        # El build también puede fallar (p. ej. PQ necesita más vectores que centroides para entrenar)
+        try:
+            ann = ANNIndex(**cfg)
+            start = time.perf_counter()
+            ann.build(ids, corpus)
+            build_time = time.perf_counter() - start
+        except Exception as e:
+            print(f"   ⏭️  {name}: {e}")
+            continue
+
+        latencies, retrieved = [], []
+        for q in queries:
+            start = time.perf_counter()
+            labels, _ = ann.search(q, k)
+            latencies.append(time.perf_counter() - start)
+            retrieved.append([int(label) for label in labels[0] if label >= 0])
+        rows.append({
+            "Config": name,
+            f"Recall@{k}": recall_at_k(retrieved, truth),
+            **latency_stats(latencies),
+            "Memoria (MB)": ann.memory_bytes() / 1e6,
+            "Build (s)": build_time
+        })
+        print(f"   ✅ {name}")
+
+    df = pd.DataFrame(rows)
+    print("\n\n📊 TABLA COMPARATIVA (Backend vectorial):")
+    print("="*60)
+    print(df.to_string(index=False))
+    print("="*60)
+
+    df.to_csv("vector_index_metrics.csv", index=False)
+    print("💾 Resultados guardados en 'vector_index_metrics.csv'")
+
+if __name__ == "__main__":
+    main()
@@ -21,7 +21,8 @@ def generate_plots():
             df_retrieval = pd.read_csv(retrieval_csv_path)
             
             # Melt for seaborn grouped bar plot
-            df_melted = df_retrieval.melt(id_vars="Config", var_name="Metric", value_name="Score")
+            # Solo métricas 0-1 (las columnas de latencia van en ms)
+            df_melted = df_retrieval.melt(id_vars="Config", value_vars=["Hit Rate", "MRR"], var_name="Metric", value_name="Score")
             
             plt.figure(figsize=(10, 6))
             sns.set_theme(style="whitegrid")
@@ -81,5 +82,39 @@ def generate_plots():
     else:
         print(f"⚠️ File not found: {ragas_csv_path}")
 
+    # 3. Retrieval Sweep: frontera de Pareto latencia vs calidad
+    sweep_csv_path = os.path.join(base_dir, "sweep_metrics.csv")
+    if os.path.exists(sweep_csv_path):
+        try:
+            df_sweep = pd.read_csv(sweep_csv_path)
+            front = df_sweep[df_sweep["Pareto"]].sort_values("p50 (ms)")
+
+            plt.figure(figsize=(11, 7))
+            sns.set_theme(style="whitegrid")
+            sns.scatterplot(data=df_sweep, x="p50 (ms)", y="MRR", hue="reranker", style="rerank_top_k",
+                            size="top_k_fusion", sizes=(40, 160), alpha=0.7, palette="viridis")
+            plt.step(front["p50 (ms)"], front["MRR"], where="post", color="crimson", linewidth=2, label="Frontera de Pareto")
+
+            # Etiquetar solo las configs de la frontera
+            for _, row in front.iterrows():
+                plt.annotate(row["Config"], (row["p50 (ms)"], row["MRR"]), textcoords="offset points",
+                             xytext=(5, 5), fontsize=8)
+
+            plt.title("Retrieval Sweep: Latency vs MRR (Pareto Frontier)", fontsize=16)
+            plt.ylim(0, 1.1)
+            plt.xlabel("Latencia p50 por pregunta (ms)", fontsize=12)
+            plt.ylabel("MRR (0-1)", fontsize=12)
+            plt.legend(bbox_to_anchor=(1.02, 1), loc="upper left", fontsize=8)
+
+            plt.tight_layout()
+            output_path = os.path.join(static_metrics_dir, "retrieval_pareto.png")
+            plt.savefig(output_path)
+            print(f"✅ Generated: {output_path}")
+            plt.close()
+        except Exception as e:
+            print(f"❌ Error processing sweep metrics: {e}")
+    else:
+        print(f"⚠️ File not found: {sweep_csv_path}")
+
 if __name__ == "__main__":
     generate_plots()
@@ -0,0 +1,191 @@
+import argparse
+import itertools
+import logging
+import os
+import sys
+import time
+from collections import defaultdict
+import numpy as np
+import pandas as pd
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../../')))
+from src.api.retrieval_engine import RetrievalEngine, RERANKER_MODEL_NAME, RERANK_BATCH_SIZE, resolve_fusion_config
+from src.evaluation.eval_retrieval import load_dataset, latency_stats
+
+# Setup logging
+logging.basicConfig(level=logging.ERROR) # Only errors to keep output clean
+logger = logging.getLogger(__name__)
+
+# Rejilla por defecto (sobrescribible por línea de comandos); "none" = sin rerank (orden de la fusión)
+SWEEP_GRID = {
+    "top_k_fusion": [10, 20, 40],
+    "rrf_k": [20, 60],
+    "rerank_top_k": [3, 5, 10],
+    "reranker": [RERANKER_MODEL_NAME, "cross-encoder/mmarco-mMiniLMv2-L12-H384-v1", "none"]
+}
+# Etapas cronometradas por pregunta (ms); la latencia total de una config es la suma de las que usa
+# ("documents" = primera etapa de TWO_STAGE_RETRIEVAL; 0 si está desactivada)
+STAGES = ("embed", "documents", "bm25", "vector", "fusion", "rerank")
+
+def load_reranker(engine, name: str):
+    """CrossEncoder de la rejilla (el del motor se reutiliza); None si es "none" o no carga."""
+    if name == "none":
+        return None
+    if name == RERANKER_MODEL_NAME and engine.reranker is not None:
+        return engine.reranker
+    try:
+        import torch
+        from sentence_transformers import CrossEncoder
+        return CrossEncoder(name, device="cuda" if torch.cuda.is_available() else "cpu")
+    except Exception as e:
+        print(f"   ⏭️  Reranker '{name}' no disponible: {e}")
+        return False
+
+def reciprocal_rank(sources: list, expected_doc: str) -> float:
+    for i, source in enumerate(sources):
+        if source == expected_doc:
+            return 1.0 / (i + 1)
+    return 0.0
+
+def pareto_front(df: pd.DataFrame, cost: str = "p50 (ms)", quality: str = "MRR") -> pd.Series:
+    """True en las configs que ninguna otra supera (más calidad con igual o menos latencia)."""
+    front = pd.Series(False, index=df.index)
+    best = -np.inf
+    # Orden por coste ascendente (a igual coste, mejor calidad primero)
+    for idx in df.sort_values([cost, quality], ascending=[True, False]).index:
+        if df.at[idx, quality] > best:
+            front[idx] = True
+            best = df.at[idx, quality]
+    return front
+
+def run_sweep(engine, dataset: list, grid: dict, where: dict = None, two_stage: bool = None) -> pd.DataFrame:
+    """Evalúa toda la rejilla reutilizando etapas: búsquedas por top_k_fusion, fusión por rrf_k, rerank por modelo.
+
+    Las preguntas se lanzan de una en una (como `hybrid_search` en producción)
+    para que la latencia por pregunta sea real; el Top-K del rerank solo
+    recorta la lista ya ordenada, así que no añade tiempo. Cada etapa usa los
+    mismos pasos del motor que `_hybrid_many` (filtro/two-stage, fusión con
+    DEFAULT_FUSION_CONFIG, corte adaptativo y colapso de duplicados): solo
+    cambian los parámetros de la rejilla.
+    """
+    questions = [item["question"] for item in dataset]
+    expected = [item["reference_doc"] for item in dataset]
+
+    # 1. Embeddings de las preguntas (comunes a toda la rejilla)
+    engine.embedding_cache.clear()
+    embeddings, embed_ms = [], []
+    for question in questions:
+        start = time.perf_counter()
+        embeddings.append(engine.embed_queries([question])[0])
+        embed_ms.append((time.perf_counter() - start) * 1000)
+
+    rerankers = {name: load_reranker(engine, name) for name in grid["reranker"]}
+    rerankers = {name: model for name, model in rerankers.items() if model is not False}
+
+    rows = []
+    for top_k_fusion in grid["top_k_fusion"]:
+        # 2. Filtro (two-stage) + BM25 + vectorial (dependen solo de top_k_fusion)
+        searched = []
+        for question, embedding in zip(questions, embeddings):
+            times = {}
+            start = time.perf_counter()
+            query_where = engine.query_wheres([embedding], where, two_stage=two_stage)
+            times["documents"] = (time.perf_counter() - start) * 1000
+            start = time.perf_counter()
+            bm25_list = engine.search_bm25_many([question], top_k=top_k_fusion * 2, where=query_where)[0]
+            times["bm25"] = (time.perf_counter() - start) * 1000
+            start = time.perf_counter()
+            vec_list = engine.search_vector_many([question], top_k=top_k_fusion * 2, where=query_where,
+                                                 query_embeddings=[embedding])[0]
+            times["vector"] = (time.perf_counter() - start) * 1000
+            searched.append((bm25_list, vec_list, times))
+
+        for rrf_k in grid["rrf_k"]:
+            # 3. Fusión + corte adaptativo + colapso de duplicados (el mismo paso que `_hybrid_many`)
+            config = resolve_fusion_config({"rrf_k": rrf_k})
+            fused_lists, fusion_ms = [], []
+            for bm25_list, vec_list, _ in searched:
+                start = time.perf_counter()
+                fused_lists.append(engine.fuse_candidates(bm25_list, vec_list, top_k_fusion, config))
+                fusion_ms.append((time.perf_counter() - start) * 1000)
+
+            for reranker_name, model in rerankers.items():
+                # 4. Rerank de todos los candidatos una vez por modelo
+                ranked_sources, rerank_ms = [], []
+                for question, fused in zip(questions, fused_lists):
+                    start = time.perf_counter()
+                    if model is not None and fused:
+                        scores = model.predict([[question, c["document"]] for c in fused], batch_size=RERANK_BATCH_SIZE)
+                        order = sorted(range(len(fused)), key=lambda i: float(scores[i]), reverse=True)
+                        fused = [fused[i] for i in order]
+                    rerank_ms.append((time.perf_counter() - start) * 1000)
+                    ranked_sources.append([c["metadata"].get("source", "") for c in fused])
+
+                stage_ms = defaultdict(list)
+                totals = []
+                for i in range(len(questions)):
+                    per_stage = {"embed": embed_ms[i], **searched[i][2], "fusion": fusion_ms[i], "rerank": rerank_ms[i]}
+                    for stage in STAGES:
+                        stage_ms[stage].append(per_stage[stage])
+                    totals.append(sum(per_stage.values()))
+
+                for rerank_top_k in grid["rerank_top_k"]:
+                    rr = [reciprocal_rank(sources[:rerank_top_k], doc) for sources, doc in zip(ranked_sources, expected)]
+                    short_name = reranker_name.split("/")[-1]
+                    rows.append({
+                        "Config": f"fus={top_k_fusion} rrf={rrf_k} top={rerank_top_k} {short_name}",
+                        "top_k_fusion": top_k_fusion,
+                        "fusion": config["method"],
+                        "rrf_k": rrf_k,
+                        "rerank_top_k": rerank_top_k,
+                        "reranker": reranker_name,
+                        "Hit Rate": float(np.mean([r > 0 for r in rr])),
+                        "MRR": float(np.mean(rr)),
+                        **latency_stats(totals),
+                        **{f"{stage} (ms)": float(np.mean(stage_ms[stage])) for stage in STAGES}
+                    })
+            print(f"   ✅ top_k_fusion={top_k_fusion} rrf_k={rrf_k}")
+
+    df = pd.DataFrame(rows)
+    if not df.empty:
+        df["Pareto"] = pareto_front(df)
+    return df
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Barrido de parámetros de recuperación (latencia vs Hit Rate / MRR).")
+    parser.add_argument("--top-k-fusion", type=int, nargs="+", default=SWEEP_GRID["top_k_fusion"])
+    parser.add_argument("--rrf-k", type=int, nargs="+", default=SWEEP_GRID["rrf_k"])
+    parser.add_argument("--rerank-top-k", type=int, nargs="+", default=SWEEP_GRID["rerank_top_k"])
+    parser.add_argument("--reranker", nargs="+", default=SWEEP_GRID["reranker"],
+                        help='Modelos CrossEncoder a comparar ("none" = sin rerank)')
+    parser.add_argument("--dataset", default="data/golden_dataset.json")
+    parser.add_argument("--output", default="sweep_metrics.csv")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    grid = {"top_k_fusion": args.top_k_fusion, "rrf_k": args.rrf_k, "rerank_top_k": args.rerank_top_k, "reranker": args.reranker}
+    total = len(list(itertools.product(*grid.values())))
+    print(f"📋 Barrido de recuperación: {total} configuraciones...")
+
+    BASE_DIR = os.getcwd()
+    CHROMA_PATH = os.path.join(BASE_DIR, "chroma_db")
+    COLLECTION_NAME = "rag_multimodal"
+
+    engine = RetrievalEngine(CHROMA_PATH, COLLECTION_NAME)
+    dataset = load_dataset(args.dataset)
+
+    df = run_sweep(engine, dataset, grid)
+    if df.empty:
+        print("⚠️ Ninguna configuración evaluada (¿rerankers no disponibles?).")
+        return
+
+    print("\n\n📊 FRONTERA DE PARETO (latencia p50 vs MRR):")
+    print("="*60)
+    print(df[df["Pareto"]].sort_values("p50 (ms)").to_string(index=False))
+    print("="*60)
+
+    df.to_csv(args.output, index=False)
+    print(f"💾 {len(df)} configuraciones guardadas en '{args.output}' (gráfico: python src/evaluation/generate_plots.py)")
+
+if __name__ == "__main__":
+    main()
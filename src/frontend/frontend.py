@@ -199,30 +199,46 @@ with st.sidebar:
 
     st.divider()
     st.header("📂 Ingesta")
-    uploaded_file = st.file_uploader("Sube PDF", type=["pdf"])
+    uploaded_files = st.file_uploader("Sube PDF", type=["pdf"], accept_multiple_files=True)
     
-    if uploaded_file is not None:
+    if uploaded_files:
         if st.button("Procesar e Ingestar"):
-            with st.spinner("Subiendo y procesando..."):
-                try:
-                    files = {"file": (uploaded_file.name, uploaded_file, "application/pdf")}
-                    response = requests.post(f"{API_URL}/ingest", files=files)
+            try:
+                files = [("files", (f.name, f, "application/pdf")) for f in uploaded_files]
+                response = requests.post(f"{API_URL}/ingest", files=files)
+                
+                if response.status_code == 200 and response.json().get("job_id"):
+                    job_id = response.json()["job_id"]
+                    progress_bar = st.progress(0.0, text="En cola...")
+                    # La ingesta corre en segundo plano: consultar su estado hasta que termine
+                    while True:
+                        job = requests.get(f"{API_URL}/ingest/{job_id}").json()
+                        current = next((f for f in job["files"] if f["status"] == "running"), None)
+                        done_ratio = job["files_done"] / max(job["files_total"], 1)
+                        text = f"{job['files_done']}/{job['files_total']} documentos"
+                        if current:
+                            if current["chunks_total"]:
+                                done_ratio += current["chunks_embedded"] / current["chunks_total"] / job["files_total"]
+                            text += f" | {current['filename']}: {current['pages_parsed']} páginas, {current['chunks_embedded']}/{current['chunks_total']} chunks"
+                        progress_bar.progress(min(done_ratio, 1.0), text=text)
+                        if job["status"] in ("done", "error"):
+                            break
+                        time.sleep(1)
                     
-                    if response.status_code == 200:
-                        resp_json = response.json()
-                        status = resp_json.get("status")
-                        msg = resp_json.get("message")
-                        
-                        if status == "success":
+                    for f in job["files"]:
+                        msg = f.get("message", f["filename"])
+                        if f["status"] in ("new", "legacy", "updated", "renamed"):
                             st.success(f"✅ {msg}")
-                        elif status == "warning":
+                        elif f["status"] in ("unchanged", "duplicate", "empty"):
                             st.warning(f"⚠️ {msg}")
                         else:
                             st.error(f"❌ {msg}")
-                    else:
-                        st.error(f"❌ Error: {response.text}")
-                except Exception as e:
-                    st.error(f"❌ Error de conexión: {e}")
+                elif response.status_code == 200:
+                    st.error(f"❌ {response.json().get('message')}")
+                else:
+                    st.error(f"❌ Error: {response.text}")
+            except Exception as e:
+                st.error(f"❌ Error de conexión: {e}")
 
 tab_chat, tab_admin = st.tabs(["💬 Chat", "🗂️ Gestión Documental"])
 
@@ -244,8 +260,9 @@ with tab_chat:
             st.markdown(msg["content"])
             if "images" in msg and msg["images"]:
                 for img_path in msg["images"]:
-                    full_url = f"{API_URL}/{img_path}"
-                    st.image(full_url, caption="Evidencia Visual Recuperada", width=400)
+                    # Miniatura precalculada en la API (el original completo sigue en /static)
+                    thumb_url = f"{API_URL}/thumbnails/{img_path}"
+                    st.image(thumb_url, caption="Evidencia Visual Recuperada", width=400)
                     
     query_image_b64 = None
     with st.expander("📷 Adjuntar imagen a tu pregunta (Opcional)", expanded=False):
@@ -334,8 +351,8 @@ with tab_chat:
             # --- SHOW IMAGES POST-STREAM ---
             if found_images:
                 for img_path in found_images:
-                    full_url = f"{API_URL}/{img_path}"
-                    st.image(full_url, caption="Evidencia Visual / Relacionada", width=400)
+                    thumb_url = f"{API_URL}/thumbnails/{img_path}"
+                    st.image(thumb_url, caption="Evidencia Visual / Relacionada", width=400)
             
             asst_msg = {
                 "role": "assistant", 
@@ -0,0 +1,188 @@
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+
+# Chunks por escritura en Chroma (se acota además al máximo que admite el cliente)
+WRITE_BATCH_SIZE = 1000
+# Reintentos de un chunk suelto antes de darlo por fallido (los lotes se parten antes)
+MAX_WRITE_RETRIES = 2
+# Espera base entre reintentos (se duplica en cada uno)
+RETRY_BACKOFF_SECONDS = 0.5
+
+
+def resolve_batch_size(client, batch_size: int = WRITE_BATCH_SIZE) -> int:
+    """Lote de escritura dentro del límite de variables de SQLite que expone Chroma."""
+    try:
+        return max(1, min(batch_size, client.get_max_batch_size()))
+    except Exception:
+        return max(1, batch_size)
+
+
+class ChromaBulkWriter:
+    """Escritura por lotes en Chroma solapando embeddings y escritura.
+
+    El hilo que llama calcula los embeddings del lote N+1 mientras un hilo
+    escritor hace el `upsert` del lote N (con los vectores ya calculados,
+    así Chroma no vuelve a embeber). Solo hay un lote en vuelo: si la
+    escritura va por detrás, `add` espera (memoria acotada).
+
+    Si un lote falla se parte por la mitad y se reintenta cada mitad; un
+    chunk suelto se reintenta MAX_WRITE_RETRIES veces y, si sigue fallando,
+    se anota en `failed_ids` sin detener el resto.
+
+    `add(..., on_committed=fn)` llama a `fn(ok)` cuando todos los chunks de
+    esa llamada están escritos (ok=False si alguno falló) y `progress(written)`
+    tras cada lote; ambos se ejecutan siempre en el hilo que llama.
+    """
+
+    def __init__(self, collection, client=None, embedding_function=None, batch_size: int = WRITE_BATCH_SIZE,
+                 max_retries: int = MAX_WRITE_RETRIES, progress=None):
+        self.collection = collection
+        self.embedding_function = embedding_function or getattr(collection, "_embedding_function", None)
+        self.batch_size = resolve_batch_size(client or getattr(collection, "_client", None), batch_size)
+        self.max_retries = max_retries
+        self.progress = progress
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="chroma-writer")
+        self._in_flight = None # (future, seq_final del lote)
+        self._buffer = {"documents": [], "metadatas": [], "ids": [], "embeddings": []}
+        self._received = 0
+        self._tickets = deque() # (seq_final, callback) por llamada a `add`
+        self._failed_seqs = set()
+        self.failed_ids = []
+        self.written = 0
+        self.stats = {"batches": 0, "retries": 0, "embed_seconds": 0.0, "write_seconds": 0.0, "wait_seconds": 0.0}
+        self._started = time.perf_counter()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def add(self, documents: List[str], metadatas: List[dict], ids: List[str], embeddings: list = None, on_committed=None):
+        """Encola chunks; se envían en lotes de `batch_size` (los embeddings que falten se calculan aquí)."""
+        self._buffer["documents"].extend(documents)
+        self._buffer["metadatas"].extend(metadatas)
+        self._buffer["ids"].extend(ids)
+        self._buffer["embeddings"].extend(embeddings if embeddings is not None else [None] * len(ids))
+        self._received += len(ids)
+        self._tickets.append((self._received, on_committed))
+        while len(self._buffer["ids"]) >= self.batch_size:
+            self._submit(self.batch_size)
+        self._collect(wait=False)
+
+    def flush(self):
+        """Envía lo pendiente y espera a que todo esté escrito."""
+        if self._buffer["ids"]:
+            self._submit(len(self._buffer["ids"]))
+        self._collect(wait=True)
+        # Llamadas sin chunks (p. ej. una ventana vacía) también se confirman
+        self._run_tickets(self._received)
+
+    def close(self) -> dict:
+        self.flush()
+        self._executor.shutdown(wait=True)
+        return self.summary()
+
+    def summary(self) -> dict:
+        elapsed = time.perf_counter() - self._started
+        return {
+            **self.stats,
+            "written": self.written,
+            "failed": len(self.failed_ids),
+            "batch_size": self.batch_size,
+            "seconds": round(elapsed, 2),
+            "chunks_per_second": round(self.written / elapsed, 1) if elapsed else 0.0
+        }
+
+    def report(self, label: str = "Chroma"):
+        s = self.summary()
+        print(f"📥 {label}: {s['written']} chunks en {s['seconds']:.1f}s ({s['chunks_per_second']:.1f} chunks/s) | "
+              f"lotes={s['batches']}x{s['batch_size']} embeddings={s['embed_seconds']:.1f}s "
+              f"escritura={s['write_seconds']:.1f}s espera={s['wait_seconds']:.1f}s "
+              f"reintentos={s['retries']} fallidos={s['failed']}")
+        if self.failed_ids:
+            print(f"   ❌ IDs no escritos: {self.failed_ids[:5]}{'...' if len(self.failed_ids) > 5 else ''}")
+
+    def _submit(self, size: int):
+        batch = {key: values[:size] for key, values in self._buffer.items()}
+        for values in self._buffer.values():
+            del values[:size]
+        first_seq = self._received - len(self._buffer["ids"]) - size
+
+        # Embeddings del lote en este hilo, mientras el escritor termina el anterior
+        missing = [i for i, vector in enumerate(batch["embeddings"]) if vector is None]
+        if missing and self.embedding_function is not None:
+            started = time.perf_counter()
+            vectors = self.embedding_function([batch["documents"][i] for i in missing])
+            for i, vector in zip(missing, vectors):
+                batch["embeddings"][i] = vector.tolist() if hasattr(vector, "tolist") else list(vector)
+            self.stats["embed_seconds"] += time.perf_counter() - started
+        if any(vector is None for vector in batch["embeddings"]):
+            # Sin función de embeddings propia: Chroma embebe dentro del upsert
+            batch["embeddings"] = None
+
+        self._collect(wait=True)
+        self._in_flight = (self._executor.submit(self._write, batch, first_seq), first_seq + size)
+
+    def _collect(self, wait: bool):
+        """Recoge el lote en vuelo (si terminó o si `wait`) y dispara los callbacks confirmados."""
+        if self._in_flight is None:
+            return
+        future, last_seq = self._in_flight
+        if not wait and not future.done():
+            return
+        started = time.perf_counter()
+        written, failed = future.result()
+        self.stats["wait_seconds"] += time.perf_counter() - started
+        self._in_flight = None
+        self.written += written
+        for seq, chunk_id in failed:
+            self._failed_seqs.add(seq)
+            self.failed_ids.append(chunk_id)
+        self._run_tickets(last_seq)
+        if self.progress:
+            self.progress(self.written)
+
+    def _run_tickets(self, committed_seq: int):
+        while self._tickets and self._tickets[0][0] <= committed_seq:
+            end_seq, callback = self._tickets.popleft()
+            ok = not any(seq < end_seq for seq in self._failed_seqs)
+            # Los fallos de llamadas ya confirmadas no afectan a las siguientes
+            self._failed_seqs = {seq for seq in self._failed_seqs if seq >= end_seq}
+            if callback:
+                callback(ok)
+
+    def _write(self, batch: dict, first_seq: int):
+        """Hilo escritor: upsert con partición por mitades ante errores. Devuelve (escritos, [(seq, id) fallidos])."""
+        started = time.perf_counter()
+        written, failed = 0, []
+        stack = [(0, len(batch["ids"]))]
+        while stack:
+            start, end = stack.pop()
+            for attempt in range(self.max_retries + 1 if end - start == 1 else 1):
+                try:
+                    self.collection.upsert(
+                        documents=batch["documents"][start:end],
+                        metadatas=batch["metadatas"][start:end],
+                        ids=batch["ids"][start:end],
+                        embeddings=batch["embeddings"][start:end] if batch["embeddings"] else None
+                    )
+                    written += end - start
+                    break
+                except Exception as e:
+                    self.stats["retries"] += 1
+                    if end - start > 1:
+                        # Lote partido: se reintenta cada mitad (primero la de delante)
+                        middle = (start + end) // 2
+                        stack.extend([(middle, end), (start, middle)])
+                        break
+                    if attempt < self.max_retries:
+                        time.sleep(RETRY_BACKOFF_SECONDS * (2 ** attempt))
+                    else:
+                        print(f"   ❌ No se pudo escribir {batch['ids'][start]}: {e}")
+                        failed.append((first_seq + start, batch["ids"][start]))
+        self.stats["batches"] += 1
+        self.stats["write_seconds"] += time.perf_counter() - started
+        return written, failed
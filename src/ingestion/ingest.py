@@ -2,10 +2,17 @@ import os
 import fitz
 import chromadb
 from chromadb.utils import embedding_functions
-import uuid
+import sys
+import hashlib
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from typing import List
 
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(BASE_DIR)
+from src.ingestion.bulk_writer import ChromaBulkWriter
+from src.ingestion.manifest import text_hash
 DOCS_DIR = os.path.join(BASE_DIR, "docs")
 STATIC_DIR = os.path.join(BASE_DIR, "static")
 IMAGES_DIR = os.path.join(STATIC_DIR, "images")
@@ -19,6 +26,8 @@ os.makedirs(CHROMA_PATH, exist_ok=True)
 MIN_IMAGE_WIDTH = 100
 MIN_IMAGE_HEIGHT = 100
 MIN_IMAGE_SIZE_BYTES = 2048
+# Hilos de escritura de imágenes al disco
+IMAGE_WRITE_WORKERS = 4
 
 def get_chroma_collection():
     client = chromadb.PersistentClient(path=CHROMA_PATH)
@@ -27,31 +36,90 @@ def get_chroma_collection():
     )
     return client.get_or_create_collection(name=COLLECTION_NAME, embedding_function=ef)
 
-def extract_images_from_page(page, doc, doc_id, page_num) -> List[str]:
+class ImageStore:
+    """Almacén de imágenes direccionado por contenido: static/images/<sha256>.<ext>.
+
+    Cada imagen distinta se escribe una sola vez (entre páginas, documentos y
+    re-ejecuciones); las repeticiones (logos, sellos del BOE en cada página)
+    solo devuelven la ruta ya existente. Las escrituras van a un pool de hilos
+    y `wait` espera a que terminen.
+    """
+
+    def __init__(self, images_dir: str = IMAGES_DIR, max_workers: int = IMAGE_WRITE_WORKERS):
+        self.images_dir = images_dir
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="image-writer")
+        self.futures = []
+        self.known = set() # hashes escritos (o en cola) en esta ejecución
+        self.stats = defaultdict(int)
+
+    def put(self, image_bytes: bytes, ext: str) -> str:
+        digest = hashlib.sha256(image_bytes).hexdigest()
+        filename = f"{digest}.{ext}"
+        path = os.path.join(self.images_dir, filename)
+        self.stats["occurrences"] += 1
+        if digest in self.known or os.path.exists(path):
+            self.stats["deduplicated"] += 1
+            self.stats["bytes_saved"] += len(image_bytes)
+        else:
+            self.known.add(digest)
+            self.stats["written"] += 1
+            self.stats["bytes_written"] += len(image_bytes)
+            self.futures.append(self.executor.submit(self._write, path, image_bytes))
+        return f"static/images/{filename}"
+
+    @staticmethod
+    def _write(path: str, data: bytes):
+        # Escritura atómica: un fichero a medias nunca queda con su nombre definitivo
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def wait(self):
+        for future in self.futures:
+            future.result()
+        self.futures.clear()
+
+    def report(self):
+        s = self.stats
+        print(f"🖼️ Imágenes: {s['occurrences']} apariciones -> {s['written']} ficheros nuevos "
+              f"({s['bytes_written'] / 1e6:.1f} MB escritos), {s['deduplicated']} repetidas, "
+              f"{s['bytes_saved'] / 1e6:.1f} MB ahorrados ({s['xref_hits']} por xref)")
+
+def extract_images_from_page(page, doc, store: ImageStore, xref_cache: dict) -> List[str]:
+    """Rutas (únicas) de las imágenes válidas de la página.
+
+    `xref_cache` ({xref: (ruta | None, bytes)}) es por documento: una imagen
+    que el PDF reutiliza en varias páginas se extrae y se hashea una sola vez.
+    """
     valid_images = []
     image_list = page.get_images(full=True)
     
-    for img_idx, img in enumerate(image_list):
+    for img in image_list:
         xref = img[0]
-        base_image = doc.extract_image(xref)
-        image_bytes = base_image["image"]
-        width = base_image["width"]
-        height = base_image["height"]
-        ext = base_image["ext"]
-        
-        if len(image_bytes) < MIN_IMAGE_SIZE_BYTES:
-            continue
-        if width < MIN_IMAGE_WIDTH or height < MIN_IMAGE_HEIGHT:
-            continue
+        if xref in xref_cache:
+            path, size = xref_cache[xref]
+            if path:
+                store.stats["occurrences"] += 1
+                store.stats["xref_hits"] += 1
+                store.stats["deduplicated"] += 1
+                store.stats["bytes_saved"] += size
+        else:
+            base_image = doc.extract_image(xref)
+            image_bytes = base_image["image"]
+            width = base_image["width"]
+            height = base_image["height"]
             
-        filename = f"{doc_id}_p{page_num}_{img_idx}.{ext}"
-        filepath = os.path.join(IMAGES_DIR, filename)
+            path = None
+            if len(image_bytes) >= MIN_IMAGE_SIZE_BYTES and width >= MIN_IMAGE_WIDTH and height >= MIN_IMAGE_HEIGHT:
+                written_before = store.stats["written"]
+                path = store.put(image_bytes, base_image["ext"])
+                if store.stats["written"] > written_before:
+                    print(f"   [IMG] Guardada: {os.path.basename(path)} ({width}x{height}px)")
+            xref_cache[xref] = (path, len(image_bytes))
         
-        with open(filepath, "wb") as f:
-            f.write(image_bytes)
-            
-        print(f"   [IMG] Guardada: {filename} ({width}x{height}px)")
-        valid_images.append(f"static/images/{filename}")
+        if path and path not in valid_images:
+            valid_images.append(path)
         
     return valid_images
 
@@ -66,19 +134,24 @@ def text_splitter(text: str, chunk_size: int = 1000, chunk_overlap: int = 100) -
         start += (chunk_size - chunk_overlap)
     return chunks
 
-def process_file(filepath: str):
+def process_file(filepath: str, store: ImageStore = None):
     filename = os.path.basename(filepath)
     print(f"\nProcesando: {filename}")
     
+    own_store = store is None
+    store = store or ImageStore()
     doc = fitz.open(filepath)
     collection = get_chroma_collection()
-    doc_id = str(uuid.uuid4())[:8]
+    # Id estable por nombre: re-ejecutar la ingesta sobrescribe los mismos chunks
+    doc_id = text_hash(filename)[:8]
+    writer = ChromaBulkWriter(collection)
+    xref_cache = {}
     
     total_chunks = 0
     total_images = 0
     
     for i, page in enumerate(doc):
-        images_on_page = extract_images_from_page(page, doc, doc_id, i)
+        images_on_page = extract_images_from_page(page, doc, store, xref_cache)
         total_images += len(images_on_page)
         
         text = page.get_text()
@@ -87,26 +160,28 @@ def process_file(filepath: str):
             continue
             
         chunks = text_splitter(text)
+        img_metadata_val = ",".join(images_on_page) if images_on_page else "None"
         
-        for j, chunk_text in enumerate(chunks):
-            img_metadata_val = ",".join(images_on_page) if images_on_page else "None"
-            
-            metadata = {
+        metadatas = [
+            {
                 "source": filename,
                 "page": i,
                 "chunk_index": j,
                 "image_path_list": img_metadata_val
             }
+            for j in range(len(chunks))
+        ]
+        chunk_ids = [f"{doc_id}_p{i}_c{j}" for j in range(len(chunks))]
+        
+        # Se acumulan entre páginas y se escriben por lotes (embeddings solapados con la escritura)
+        writer.add(chunks, metadatas, chunk_ids)
+        total_chunks += len(chunks)
             
-            chunk_id = f"{doc_id}_p{i}_c{j}"
-            
-            collection.add(
-                documents=[chunk_text],
-                metadatas=[metadata],
-                ids=[chunk_id]
-            )
-            total_chunks += 1
-            
+    writer.close()
+    writer.report(filename)
+    store.wait()
+    if own_store:
+        store.report()
     print(f"✅ Finalizado {filename}: {total_chunks} chunks, {total_images} imagénes válidas.")
 
 def main():
@@ -123,8 +198,10 @@ def main():
         return
         
     print(f"Encontrados {len(files)} documentos.")
+    store = ImageStore()
     for f in files:
-        process_file(os.path.join(DOCS_DIR, f))
+        process_file(os.path.join(DOCS_DIR, f), store)
+    store.report()
 
 if __name__ == "__main__":
     main()
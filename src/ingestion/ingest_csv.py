@@ -1,4 +1,6 @@
 import os
+import json
+import argparse
 import pandas as pd
 import chromadb
 from chromadb.utils import embedding_functions
@@ -8,6 +10,8 @@ import torch
 import sys
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 sys.path.append(BASE_DIR)
+from src.ingestion.bulk_writer import ChromaBulkWriter, WRITE_BATCH_SIZE
+from src.ingestion.manifest import RowHashManifest, text_hash
 DATA_DIR = os.path.join(BASE_DIR, "data")
 CHROMA_PATH = os.path.join(BASE_DIR, "chroma_db")
 COLLECTION_NAME = "rag_multimodal" # Misma coleccion que los PDFs
@@ -18,6 +22,10 @@ FILES = {
     "vacations": os.path.join(DATA_DIR, "Tabla Dinámica de VACACIONES.csv"),
     "sick_leave": os.path.join(DATA_DIR, "Tabla de Bajas Médicas.csv")
 }
+# Prefijo de los IDs de cada fuente (metadata "source") que genera esta ingesta
+SOURCE_ID_PREFIXES = {"vacaciones_rrhh": "vac_", "bajas_rrhh": "sick_", "employees_rrhh": "emp_card_"}
+CSV_SOURCES = list(SOURCE_ID_PREFIXES)
+EMPLOYEE_COLUMNS = ["id", "name", "role", "vacation_days_left", "last_pay_raise"]
 
 def get_chroma_collection():
     client = chromadb.PersistentClient(path=CHROMA_PATH)
@@ -28,198 +36,175 @@ def get_chroma_collection():
     )
     return client.get_or_create_collection(name=COLLECTION_NAME, embedding_function=ef)
 
-def ingest_csvs():
+def _str(series: pd.Series) -> pd.Series:
+    return series.astype(str)
+
+def _stable_ids(prefix: str, key: pd.Series) -> pd.Series:
+    """IDs a partir de claves de negocio; claves repetidas reciben sufijo _2, _3... (en orden de aparición)."""
+    ids = prefix + key
+    dup_rank = ids.groupby(ids).cumcount()
+    return ids.where(dup_rank == 0, ids + "_" + (dup_rank + 1).astype(str))
+
+def load_employees() -> pd.DataFrame:
+    """Fichas base de empleados (id como texto); vacío si falta el CSV."""
+    if not os.path.exists(FILES["employees"]):
+        return pd.DataFrame(columns=EMPLOYEE_COLUMNS)
+    df = pd.read_csv(FILES["employees"])
+    df["id"] = _str(df["id"])
+    return df.drop_duplicates("id", keep="last")
+
+def _employee_header(employees: pd.DataFrame, with_vacations: bool) -> pd.Series:
+    """Bloque 'EMPLEADO/Puesto[/Vacaciones]' por id de empleado, para anteponer a cada fila."""
+    header = "EMPLEADO: " + _str(employees["name"]) + " (ID: " + employees["id"] + ")\nPuesto: " + _str(employees["role"])
+    if with_vacations:
+        header = header + "\nVacaciones disponibles: " + _str(employees["vacation_days_left"]) + " días"
+    return pd.Series((header + "\n\n").values, index=employees["id"].values)
+
+def build_vacation_chunks(df: pd.DataFrame, employees: pd.DataFrame) -> pd.DataFrame:
+    """1 chunk por solicitud; id estable = empleado + fechas (no depende de la posición de la fila)."""
+    emp_id = _str(df["ID_Empleado"])
+    base_info = emp_id.map(_employee_header(employees, with_vacations=True)).fillna("")
+    documents = (
+        base_info
+        + "SOLICITUD DE VACACIONES:\nEmpleado: " + _str(df["Nombre_Empleado"]) + " (ID: " + emp_id + ")"
+        + "\nDepartamento: " + _str(df["Departamento"])
+        + "\nTipo de contrato: " + _str(df["Tipo_Contrato"])
+        + "\nPeriodo: " + _str(df["Fecha_Inicio"]) + " a " + _str(df["Fecha_Fin"])
+        + "\nDías solicitados: " + _str(df["Días_Solicitados"])
+        + "\nEstado: " + _str(df["Estado"])
+    )
+    metadatas = pd.DataFrame({
+        "source": "vacaciones_rrhh",
+        "type": "vacation_request",
+        "employee_id": emp_id,
+        "employee_name": df["Nombre_Empleado"].fillna(""),
+        "status": df["Estado"].fillna("")
+    }).to_dict("records")
+    ids = _stable_ids("vac_", emp_id + "_" + _str(df["Fecha_Inicio"]) + "_" + _str(df["Fecha_Fin"]))
+    return pd.DataFrame({"id": ids.values, "document": documents.values, "metadata": metadatas})
+
+def build_sick_leave_chunks(df: pd.DataFrame, employees: pd.DataFrame) -> pd.DataFrame:
+    """1 chunk por baja; id estable = ID_Baja."""
+    emp_id = _str(df["ID_Empleado"])
+    base_info = emp_id.map(_employee_header(employees, with_vacations=False)).fillna("")
+    documents = (
+        base_info
+        + "BAJA MÉDICA:\nEmpleado: " + _str(df["Nombre_Empleado"]) + " (ID: " + emp_id + ")"
+        + "\nID Baja: " + _str(df["ID_Baja"])
+        + "\nTipo: " + _str(df["Tipo_Baja"])
+        + "\nMotivo: " + _str(df["Motivo_Detallado"])
+        + "\nPeriodo: " + _str(df["Fecha_Inicio"]) + " a " + _str(df["Fecha_Alta"])
+        + "\nDías totales: " + _str(df["Dias_Totales"])
+        + "\nCoste estimado: " + _str(df["Coste_Empresa_Est"])
+    )
+    metadatas = pd.DataFrame({
+        "source": "bajas_rrhh",
+        "type": "sick_leave",
+        "employee_id": emp_id,
+        "employee_name": df["Nombre_Empleado"].fillna(""),
+        "sick_type": df["Tipo_Baja"].fillna("")
+    }).to_dict("records")
+    ids = _stable_ids("sick_", _str(df["ID_Baja"]))
+    return pd.DataFrame({"id": ids.values, "document": documents.values, "metadata": metadatas})
+
+def build_employee_cards(employees: pd.DataFrame) -> pd.DataFrame:
+    documents = (
+        "EMPLEADO: " + _str(employees["name"]) + " (ID: " + employees["id"] + ")"
+        + "\nPuesto: " + _str(employees["role"])
+        + "\nVacaciones disponibles: " + _str(employees["vacation_days_left"]) + " días"
+        + "\nÚltima subida salarial: " + _str(employees["last_pay_raise"])
+    )
+    metadatas = pd.DataFrame({
+        "source": "employees_rrhh",
+        "type": "employee_card",
+        "employee_id": employees["id"],
+        "employee_name": employees["name"].fillna("")
+    }).to_dict("records")
+    return pd.DataFrame({"id": ("emp_card_" + employees["id"]).values, "document": documents.values, "metadata": metadatas})
+
+def row_hash(document: str, metadata: dict) -> str:
+    return text_hash(document + "\x00" + json.dumps(metadata, sort_keys=True, ensure_ascii=False, default=str))
+
+def ingest_csvs(full: bool = False):
+    """Sincroniza los CSV de RR.HH. con Chroma (1 chunk por fila).
+
+    Solo las filas nuevas o modificadas se re-embeben (upsert) y las que ya
+    no están se borran, según el manifiesto de hashes por fila. `full`
+    ignora el manifiesto y re-escribe todas las filas.
+    """
     print("📊 Iniciando Ingesta CSV - MODO: 1 CHUNK POR FILA (con contexto completo)...")
     collection = get_chroma_collection()
-    
-    # Cargar datos base de empleados
-    employee_base = {}  # {emp_id: {name, role, vacation_days, etc}}
-    if os.path.exists(FILES["employees"]):
-        try:
-            df = pd.read_csv(FILES["employees"])
-            for _, row in df.iterrows():
-                emp_id = str(row['id'])
-                employee_base[emp_id] = {
-                    "name": row['name'],
-                    "role": row['role'],
-                    "vacation_days_left": row['vacation_days_left'],
-                    "last_pay_raise": row['last_pay_raise']
-                }
-        except Exception as e:
-            print(f"   ⚠️ Error leyendo employees.csv: {e}")
-    
-    documents = []
-    metadatas = []
-    ids = []
-    
-    # 1. VACACIONES: 1 chunk por solicitud
-    if os.path.exists(FILES["vacations"]):
-        try:
-            df = pd.read_csv(FILES["vacations"])
-            df['ID_Empleado'] = df['ID_Empleado'].astype(str)
-            
-            for idx, row in df.iterrows():
-                emp_id = row['ID_Empleado']
-                emp_name = row['Nombre_Empleado']
-                
-                # Construir chunk con TODA la info
-                # Incluir datos base si existen
-                base_info = ""
-                if emp_id in employee_base:
-                    base = employee_base[emp_id]
-                    base_info = f"""
-EMPLEADO: {base['name']} (ID: {emp_id})
-Puesto: {base['role']}
-Vacaciones disponibles: {base['vacation_days_left']} días
-"""
-                
-                chunk_text = f"""{base_info}
-SOLICITUD DE VACACIONES:
-Empleado: {emp_name} (ID: {emp_id})
-Departamento: {row['Departamento']}
-Tipo de contrato: {row['Tipo_Contrato']}
-Periodo: {row['Fecha_Inicio']} a {row['Fecha_Fin']}
-Días solicitados: {row['Días_Solicitados']}
-Estado: {row['Estado']}
-"""
-                
-                documents.append(chunk_text.strip())
-                metadatas.append({
-                    "source": "vacaciones_rrhh",
-                    "type": "vacation_request",
-                    "employee_id": emp_id,
-                    "employee_name": emp_name,
-                    "status": row['Estado']
-                })
-                ids.append(f"vac_{emp_id}_{idx}")
-                
-            print(f"   ✅ Indexadas {len(df)} solicitudes de vacaciones")
-        except Exception as e:
-            print(f"   ❌ Error en vacaciones: {e}")
-    
-    # 2. BAJAS: 1 chunk por baja
-    if os.path.exists(FILES["sick_leave"]):
+    manifest = RowHashManifest()
+
+    # Fuentes que no se pudieron leer: sus filas del manifiesto no se dan por borradas
+    failed_sources = []
+    try:
+        employees = load_employees()
+    except Exception as e:
+        print(f"   ⚠️ Error leyendo employees.csv: {e}")
+        employees = pd.DataFrame(columns=EMPLOYEE_COLUMNS)
+        failed_sources.append("employees_rrhh")
+    frames = []
+    for source, key, builder, label in [
+        ("vacaciones_rrhh", "vacations", build_vacation_chunks, "solicitudes de vacaciones"),
+        ("bajas_rrhh", "sick_leave", build_sick_leave_chunks, "bajas médicas"),
+    ]:
+        if not os.path.exists(FILES[key]):
+            continue
         try:
-            df = pd.read_csv(FILES["sick_leave"])
-            df['ID_Empleado'] = df['ID_Empleado'].astype(str)
-            
-            for idx, row in df.iterrows():
-                emp_id = row['ID_Empleado']
-                emp_name = row['Nombre_Empleado']
-                
-                base_info = ""
-                if emp_id in employee_base:
-                    base = employee_base[emp_id]
-                    base_info = f"""
-EMPLEADO: {base['name']} (ID: {emp_id})
-Puesto: {base['role']}
-"""
-                
-                chunk_text = f"""{base_info}
-BAJA MÉDICA:
-Empleado: {emp_name} (ID: {emp_id})
-ID Baja: {row['ID_Baja']}
-Tipo: {row['Tipo_Baja']}
-Motivo: {row['Motivo_Detallado']}
-Periodo: {row['Fecha_Inicio']} a {row['Fecha_Alta']}
-Días totales: {row['Dias_Totales']}
-Coste estimado: {row['Coste_Empresa_Est']}
-"""
-                
-                documents.append(chunk_text.strip())
-                metadatas.append({
-                    "source": "bajas_rrhh",
-                    "type": "sick_leave",
-                    "employee_id": emp_id,
-                    "employee_name": emp_name,
-                    "sick_type": row['Tipo_Baja']
-                })
-                ids.append(f"sick_{row['ID_Baja']}")
-                
-            print(f"   ✅ Indexadas {len(df)} bajas médicas")
+            chunks = builder(pd.read_csv(FILES[key]), employees)
+            frames.append(chunks)
+            print(f"   ✅ {len(chunks)} {label}")
         except Exception as e:
-            print(f"   ❌ Error en bajas: {e}")
-    
-    # 3. FICHAS BASE (solo empleados que NO tienen vacaciones ni bajas ya indexadas)
-    for emp_id, data in employee_base.items():
-        # Crear chunk de ficha base
-        chunk_text = f"""
-EMPLEADO: {data['name']} (ID: {emp_id})
-Puesto: {data['role']}
-Vacaciones disponibles: {data['vacation_days_left']} días
-Última subida salarial: {data['last_pay_raise']}
-"""
-        documents.append(chunk_text.strip())
-        metadatas.append({
-            "source": "employees_rrhh",
-            "type": "employee_card",
-            "employee_id": emp_id,
-            "employee_name": data['name']
-        })
-        ids.append(f"emp_card_{emp_id}")
-    
-    print(f"   ✅ Indexadas {len(employee_base)} fichas de empleados")
-    
-    # Indexar todo CON LOGGING DETALLADO
-    if documents:
-        print(f"\n📥 Intentando indexar {len(documents)} chunks...")
-        print(f"   - Vacaciones: {sum(1 for m in metadatas if m['source'] == 'vacaciones_rrhh')}")
-        print(f"   - Bajas: {sum(1 for m in metadatas if m['source'] == 'bajas_rrhh')}")
-        print(f"   - Fichas: {sum(1 for m in metadatas if m['source'] == 'employees_rrhh')}")
-        
-        # DETECCIÓN DE IDs DUPLICADOS
-        unique_ids = set(ids)
-        if len(unique_ids) != len(ids):
-            print(f"\n⚠️ ADVERTENCIA: Hay {len(ids) - len(unique_ids)} IDs duplicados!")
-            from collections import Counter
-            id_counts = Counter(ids)
-            duplicates = [id for id, count in id_counts.items() if count > 1]
-            print(f"   IDs duplicados: {duplicates[:5]}...")  # Mostrar primeros 5
-        
-        # Debug: mostrar primeros 3 IDs
-        print(f"\n   Primeros 3 IDs a indexar:")
-        for i in range(min(3, len(ids))):
-            print(f"     - {ids[i]} ({metadatas[i]['source']})")
-        
-        # VERIFICAR si ya existen en la DB antes de añadir
-        print(f"\n   Verificando IDs existentes en DB...")
-        existing = collection.get(ids=ids[:10])  # Probar con los primeros 10
-        if existing['ids']:
-            print(f"   ⚠️ {len(existing['ids'])} de los primeros 10 IDs YA EXISTEN en la DB")
+            failed_sources.append(source)
+            print(f"   ❌ Error en {label}: {e}")
+    frames.append(build_employee_cards(employees))
+    print(f"   ✅ {len(employees)} fichas de empleados")
+    chunks = pd.concat(frames, ignore_index=True)
+
+    # Delta por hash de fila
+    hashes = {chunk_id: row_hash(doc, meta) for chunk_id, doc, meta in zip(chunks["id"], chunks["document"], chunks["metadata"])}
+    if not manifest.rows:
+        # Primera sincronización con manifiesto: fuera los chunks con IDs posicionales antiguos (vac_EMP001_0...)
+        collection.delete(where={"source": {"$in": CSV_SOURCES}})
+    changed, removed = manifest.diff(hashes)
+    if full:
+        changed = list(hashes)
+    skip_prefixes = tuple(SOURCE_ID_PREFIXES[source] for source in failed_sources)
+    removed = [chunk_id for chunk_id in removed if not (skip_prefixes and chunk_id.startswith(skip_prefixes))]
+    print(f"\n🔄 Delta: {len(changed)} filas nuevas/modificadas, {len(removed)} eliminadas, "
+          f"{len(hashes) - len(changed)} sin cambios")
+
+    for i in range(0, len(removed), WRITE_BATCH_SIZE):
+        collection.delete(ids=removed[i:i + WRITE_BATCH_SIZE])
+
+    failed = set()
+    if changed:
+        # Lotes acotados con embeddings solapados; un lote que falla se parte hasta aislar los IDs problemáticos
+        rows = chunks.set_index("id").loc[changed]
+        writer = ChromaBulkWriter(collection)
+        writer.add(rows["document"].tolist(), rows["metadata"].tolist(), changed)
+        summary = writer.close()
+        writer.report("CSV")
+        failed = set(writer.failed_ids)
+        if summary["failed"]:
+            print(f"\n❌ {summary['failed']} chunks no se pudieron indexar (se reintentarán en la próxima ingesta)")
         else:
-           print(f"   ✅ IDs no existen previamente")
-        
-        try:
-            collection.add(documents=documents, metadatas=metadatas, ids=ids)
-            print(f"\n✅ TOTAL: {len(documents)} chunks indexados correctamente")
-            
-            # Verificación post-ingesta
-            vac_count = len(collection.get(where={"source": "vacaciones_rrhh"})['ids'])
-            sick_count = len(collection.get(where={"source": "bajas_rrhh"})['ids'])
-            emp_count = len(collection.get(where={"source": "employees_rrhh"})['ids'])
-            print(f"\n🔍 Verificación en ChromaDB:")
-            print(f"   - Vacaciones: {vac_count}")
-            print(f"   - Bajas: {sick_count}")
-            print(f"   - Fichas: {emp_count}")
-            
-        except Exception as e:
-            print(f"\n❌ ERROR CRÍTICO al indexar: {e}")
-            print(f"   Tipo de error: {type(e).__name__}")
-            import traceback
-            traceback.print_exc()
-            
-            # Intentar indexar en lotes pequeños para identificar el problema
-            print("\n🔧 Intentando indexar en lotes de 10...")
-            for i in range(0, len(documents), 10):
-                batch_docs = documents[i:i+10]
-                batch_meta = metadatas[i:i+10]
-                batch_ids = ids[i:i+10]
-                try:
-                    collection.add(documents=batch_docs, metadatas=batch_meta, ids=batch_ids)
-                    print(f"   ✅ Lote {i//10 + 1} OK ({len(batch_ids)} chunks)")
-                except Exception as batch_error:
-                    print(f"   ❌ Lote {i//10 + 1} FALLÓ: {batch_error}")
-                    print(f"      IDs problemáticos: {batch_ids}")
+            print(f"\n✅ TOTAL: {len(changed)} chunks indexados correctamente")
+
+    manifest.update({chunk_id: hashes[chunk_id] for chunk_id in changed if chunk_id not in failed}, removed)
+    manifest.save()
+
+    # Verificación post-ingesta
+    vac_count = len(collection.get(where={"source": "vacaciones_rrhh"}, include=[])['ids'])
+    sick_count = len(collection.get(where={"source": "bajas_rrhh"}, include=[])['ids'])
+    emp_count = len(collection.get(where={"source": "employees_rrhh"}, include=[])['ids'])
+    print(f"\n🔍 Verificación en ChromaDB:")
+    print(f"   - Vacaciones: {vac_count}")
+    print(f"   - Bajas: {sick_count}")
+    print(f"   - Fichas: {emp_count}")
 
 if __name__ == "__main__":
-    ingest_csvs()
+    parser = argparse.ArgumentParser(description="Sincroniza los CSV de RR.HH. con ChromaDB.")
+    parser.add_argument("--full", action="store_true", help="Re-escribir todas las filas (ignora el manifiesto).")
+    ingest_csvs(full=parser.parse_args().full)
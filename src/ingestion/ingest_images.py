@@ -1,20 +1,35 @@
 import os
 import json
+import time
 import chromadb
 import torch
 from chromadb.utils import embedding_functions
 import ollama
+from typing import List, Tuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 # --- CONFIGURACIÓN ---
 import sys
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 sys.path.append(BASE_DIR)
+from src.ingestion.bulk_writer import ChromaBulkWriter
+from src.utils.dedup import dhash, hamming, IMAGE_DEDUP_MAX_HAMMING
+from src.utils.image_derivatives import get_image_derivatives
 STATIC_DIR = os.path.join(BASE_DIR, "static")
 LABELED_IMAGES_DIR = os.path.join(STATIC_DIR, "labeled_images")
 CHROMA_PATH = os.path.join(BASE_DIR, "chroma_db")
 COLLECTION_NAME = "rag_images" # Nueva colección para imágenes
 EMBEDDING_MODEL_NAME = "all-MiniLM-L6-v2"
 VISION_MODEL = "llama3.2-vision"
+# Llamadas simultáneas al modelo de visión (Ollama las encola si no caben en la GPU)
+CAPTION_WORKERS = int(os.getenv("CAPTION_WORKERS", "2"))
+# Segundos máximos por descripción en total (cola, carga del modelo y generación).
+# Se usa también como timeout HTTP de lectura: una espera sin datos tampoco pasa de aquí
+CAPTION_TIMEOUT = 45.0
+# Checkpoints de descripciones generadas (JSONL append-only; se vuelca en labels.json al terminar)
+LABELS_JOURNAL_NAME = "labels.journal.jsonl"
+
+_vision_client = None
 
 def get_chroma_collection():
     client = chromadb.PersistentClient(path=CHROMA_PATH)
@@ -25,81 +40,112 @@ def get_chroma_collection():
     )
     return client.get_or_create_collection(name=COLLECTION_NAME, embedding_function=ef)
 
-def resize_image_if_needed(image_path, max_size=1024):
-    """Redimensiona la imagen si excede max_size para evitar que Ollama se bloquee."""
-    import io
-    try:
-        from PIL import Image
-        with Image.open(image_path) as img:
-            # Convertir a RGB si es necesario (ej. PNG con transparencia)
-            if img.mode in ('RGBA', 'P'):
-                img = img.convert('RGB')
-                
-            w, h = img.size
-            if w <= max_size and h <= max_size:
-                return image_path # No cambiar nada
-
-            # Calcular nuevo tamaño
-            ratio = min(max_size / w, max_size / h)
-            new_size = (int(w * ratio), int(h * ratio))
-            
-            print(f"   📉 Redimensionando imagen (Large): {w}x{h} -> {new_size}")
-            img = img.resize(new_size, Image.Resampling.LANCZOS)
-            
-            # Guardar en buffer de bytes
-            buf = io.BytesIO()
-            img.save(buf, format='JPEG', quality=85)
-            buf.seek(0)
-            return buf.getvalue() # Retornar bytes
-    except ImportError:
-        print("   ⚠️ PIL no instalado. Usando imagen original (puede ser lento).")
-        return image_path
-    except Exception as e:
-        print(f"   ⚠️ Error redimensionando: {e}. Usando original.")
-        return image_path
+def get_vision_client():
+    """Cliente de Ollama con timeout HTTP de lectura (válido en cualquier hilo, a diferencia de SIGALRM)."""
+    global _vision_client
+    if _vision_client is None:
+        _vision_client = ollama.Client(timeout=CAPTION_TIMEOUT)
+    return _vision_client
 
 def generate_auto_caption(image_path):
-    import signal
-    
-    def handler(signum, frame):
-        raise TimeoutError("⏳ Tiempo de espera agotado (60s)")
-    
-    # Registrar el manejador de la señal
-    signal.signal(signal.SIGALRM, handler)
-    
     print(f"   🧠 [IA] Generando descripción para: {os.path.basename(image_path)}...")
-    print("      (Esto puede tardar unos segundos...)")
     
+    deadline = time.monotonic() + CAPTION_TIMEOUT
     try:
-        # Pre-procesar imagen (resize)
-        image_input = resize_image_if_needed(image_path)
-        
-        # Iniciar cuenta atrás de 45 segundos
-        signal.alarm(45)
+        # JPEG reducido para el modelo de visión (caché de derivados por contenido)
+        image_input = get_image_derivatives().vision_b64(image_path)
         
-        res = ollama.chat(
+        # En streaming el plazo total se comprueba con cada fragmento: el timeout HTTP solo acota
+        # cada lectura y una generación lenta pero continua lo superaría
+        stream = get_vision_client().chat(
             model=VISION_MODEL,
             messages=[{
                 'role': 'user',
                 'content': 'Describe esta imagen en detalle para ser usada en un buscador semántico. Céntrate en el contenido visual, texto visible, tipo de gráfico y datos clave. Responde en español.',
                 'images': [image_input]
             }],
-            options={"num_ctx": 2048, "temperature": 0.2}
+            options={"num_ctx": 2048, "temperature": 0.2},
+            stream=True
         )
+        parts = []
+        try:
+            for chunk in stream:
+                parts.append(chunk['message']['content'])
+                if time.monotonic() > deadline:
+                    raise TimeoutError("plazo total de la descripción agotado")
+        finally:
+            # Cerrar la respuesta corta también la generación en Ollama
+            stream.close()
         
-        # Desactivar alarma si termina bien
-        signal.alarm(0)
-        
-        print("      ✅ Descripción generada con éxito.")
-        return res['message']['content'].strip()
+        print(f"      ✅ Descripción generada: {os.path.basename(image_path)}")
+        return "".join(parts).strip()
         
-    except TimeoutError as te:
-        print(f"      ⏭️  SALTANDO imagen por bloqueo: {te}")
-        return None # Saltamos esta imagen
     except Exception as e:
-        signal.alarm(0) # Asegurar apagar alarma
-        print(f"   ❌ Error generando caption: {e}")
+        if "timed out" in str(e).lower() or "timeout" in type(e).__name__.lower():
+            print(f"      ⏭️  SALTANDO {os.path.basename(image_path)} por bloqueo (> {CAPTION_TIMEOUT:.0f}s)")
+        else:
+            print(f"   ❌ Error generando caption: {e}")
+        return None
+
+def _warm_derivatives(derivatives, img_filename: str) -> str:
+    try:
+        derivatives.paths(os.path.join(LABELED_IMAGES_DIR, img_filename))
         return None
+    except Exception as e:
+        return str(e)
+
+def load_labels(labels_path: str, journal_path: str) -> Tuple[dict, dict]:
+    """Etiquetas de labels.json más las del journal -> (labels, dhashes conocidos)."""
+    labels, hashes = {}, {}
+    if os.path.exists(labels_path):
+        try:
+            with open(labels_path, "r", encoding="utf-8") as f:
+                labels = json.load(f)
+        except Exception as e:
+            print(f"⚠️ Error leyendo labels.json: {e}")
+    if os.path.exists(journal_path):
+        with open(journal_path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue # Última línea a medias tras una interrupción
+                labels[entry["filename"]] = entry["caption"]
+                if entry.get("dhash"):
+                    hashes[entry["filename"]] = entry["dhash"]
+    return labels, hashes
+
+def compact_labels(labels_path: str, journal_path: str, labels: dict):
+    """Vuelca el journal en labels.json (una escritura por ejecución) y lo vacía."""
+    tmp_path = f"{labels_path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(labels, f, indent=4, ensure_ascii=False)
+    os.replace(tmp_path, labels_path)
+    if os.path.exists(journal_path):
+        os.remove(journal_path)
+
+def group_near_duplicates(pending: List[str], hashes: dict, labeled: dict) -> Tuple[dict, dict]:
+    """Agrupa imágenes casi idénticas por dHash.
+
+    Devuelve (representante -> [copias], copia -> imagen ya etiquetada): solo
+    los representantes pasan por el modelo de visión; el resto hereda su
+    descripción.
+    """
+    groups, reuse = {}, {}
+    known = [(name, hashes[name]) for name in labeled if hashes.get(name)]
+    for name in pending:
+        signature = hashes.get(name)
+        if signature:
+            match = next((other for other, sig in known if hamming(signature, sig) <= IMAGE_DEDUP_MAX_HAMMING), None)
+            if match:
+                reuse[name] = match
+                continue
+            match = next((rep for rep in groups if hashes.get(rep) and hamming(signature, hashes[rep]) <= IMAGE_DEDUP_MAX_HAMMING), None)
+            if match:
+                groups[match].append(name)
+                continue
+        groups[name] = []
+    return groups, reuse
 
 def main():
     if not os.path.exists(LABELED_IMAGES_DIR):
@@ -108,17 +154,10 @@ def main():
         print("ℹ️ Coloca tus imágenes y el archivo labels.json aquí.")
         return
 
-    collection = get_chroma_collection()
-    
-    # Intenta cargar labels.json
+    # Etiquetas manuales (labels.json) + descripciones ya generadas (journal)
     labels_path = os.path.join(LABELED_IMAGES_DIR, "labels.json")
-    labels = {}
-    if os.path.exists(labels_path):
-        try:
-            with open(labels_path, "r", encoding="utf-8") as f:
-                labels = json.load(f)
-        except Exception as e:
-            print(f"⚠️ Error leyendo labels.json: {e}")
+    journal_path = os.path.join(LABELED_IMAGES_DIR, LABELS_JOURNAL_NAME)
+    labels, hashes = load_labels(labels_path, journal_path)
             
     # Listar imágenes
     valid_exts = {".png", ".jpg", ".jpeg", ".webp"}
@@ -144,52 +183,84 @@ def main():
     except Exception as e:
         print(f"ℹ️  Colección nueva o error leyendo IDs: {e}")
 
-    labels_updated = False
-    
-    for img_filename in images:
-        # 0. Chequeo de duplicados (Saltar si ya existe en DB)
-        if img_filename in existing_ids:
-            # Opcional: Descomentar para ver logs de saltos
-            # print(f"   ⏭️  Saltando (ya indexada): {img_filename}")
-            continue
-
-        img_path = os.path.join(LABELED_IMAGES_DIR, img_filename)
-        
-        # 1. Obtener o Generar Descripción
-        if img_filename in labels:
-            description = labels[img_filename]
-            source = "MANUAL"
-        else:
-            # AUTO-CAPTIONING
-            caption = generate_auto_caption(img_path)
-            if caption:
-                description = caption
-                labels[img_filename] = description
-                labels_updated = True
-                source = "AUTO-IA"
-                
-                # --- CHECKPOINT: GUARDADO INCREMENTAL ---
-                # Guardamos INMEDIATAMENTE para no perder el progreso si la siguiente imagen falla
-                try:
-                    with open(labels_path, "w", encoding="utf-8") as f:
-                        json.dump(labels, f, indent=4, ensure_ascii=False)
-                    print(f"      💾 Checkpoint guardado para: {img_filename}")
-                except Exception as e:
-                    print(f"      ⚠️ Error guardando checkpoint: {e}")
-                # ----------------------------------------
-            else:
-                description = img_filename # Fallback
-                source = "FILENAME"
-
-        # 2. Indexar
+    new_images = [name for name in images if name not in existing_ids]
+    to_caption = [name for name in new_images if name not in labels]
+    # Derivados (JPEG de visión, miniatura, base64) generados una vez por imagen nueva
+    derivatives = get_image_derivatives()
+    with ThreadPoolExecutor(max_workers=CAPTION_WORKERS * 2) as pool:
+        for img_filename, error in zip(new_images, pool.map(lambda name: _warm_derivatives(derivatives, name), new_images)):
+            if error:
+                print(f"   ⚠️ Sin derivados para {img_filename}: {error}")
+
+    # Las descripciones se acumulan y se escriben por lotes en rag_images
+    writer = ChromaBulkWriter(collection)
+
+    def index(img_filename, description, source):
         print(f"   [IMG] Indexando ({source}): {img_filename} -> '{description[:40]}...'")
-        
-        collection.add(
+        writer.add(
             documents=[description],
             metadatas=[{"filename": img_filename, "type": "image", "source": source}],
             ids=[img_filename]
         )
-        
+
+    # 1. Imágenes con descripción (manual o de una ejecución anterior)
+    for img_filename in new_images:
+        if img_filename in labels:
+            index(img_filename, labels[img_filename], "MANUAL")
+
+    if to_caption:
+        # 2. dHash de las pendientes y de las ya etiquetadas: las casi idénticas comparten descripción
+        with ThreadPoolExecutor(max_workers=CAPTION_WORKERS * 2) as pool:
+            missing = [name for name in images if name not in hashes and (name in labels or name in to_caption)]
+            for name, signature in zip(missing, pool.map(lambda name: dhash(os.path.join(LABELED_IMAGES_DIR, name)), missing)):
+                if signature:
+                    hashes[name] = signature
+        groups, reuse = group_near_duplicates(to_caption, hashes, labels)
+        print(f"🧠 {len(to_caption)} imágenes sin descripción -> {len(groups)} llamadas al modelo de visión "
+              f"({len(to_caption) - len(groups)} casi duplicadas), {CAPTION_WORKERS} en paralelo")
+
+        # --- CHECKPOINT: JOURNAL APPEND-ONLY ---
+        # Una línea por descripción: una interrupción no pierde lo ya generado
+        recorded = []
+        with open(journal_path, "a", encoding="utf-8") as journal:
+            def record(img_filename, caption, duplicate_of=None):
+                labels[img_filename] = caption
+                recorded.append(img_filename)
+                entry = {"filename": img_filename, "caption": caption, "dhash": hashes.get(img_filename)}
+                if duplicate_of:
+                    entry["duplicate_of"] = duplicate_of
+                journal.write(json.dumps(entry, ensure_ascii=False) + "\n")
+                journal.flush()
+
+            for img_filename, original in reuse.items():
+                record(img_filename, labels[original], duplicate_of=original)
+                index(img_filename, labels[original], "DUPLICADA")
+
+            # 3. Llamadas concurrentes acotadas al modelo de visión
+            with ThreadPoolExecutor(max_workers=CAPTION_WORKERS, thread_name_prefix="caption") as pool:
+                futures = {pool.submit(generate_auto_caption, os.path.join(LABELED_IMAGES_DIR, rep)): rep for rep in groups}
+                for future in as_completed(futures):
+                    rep = futures[future]
+                    caption = future.result()
+                    if caption:
+                        record(rep, caption)
+                        index(rep, caption, "AUTO-IA")
+                        for copy in groups[rep]:
+                            record(copy, caption, duplicate_of=rep)
+                            index(copy, caption, "DUPLICADA")
+                    else:
+                        for img_filename in [rep] + groups[rep]:
+                            index(img_filename, img_filename, "FILENAME") # Fallback
+
+        compact_labels(labels_path, journal_path, labels)
+        print(f"      💾 {len(recorded)} descripciones guardadas en labels.json")
+
+    writer.close()
+    writer.report("Imágenes")
+    # Derivados de imágenes que ya no están en static/ (borradas o reemplazadas)
+    pruned = derivatives.prune()
+    if pruned["removed"]:
+        print(f"🧹 {pruned['removed']} derivados huérfanos eliminados ({pruned['bytes'] / 1e6:.1f} MB)")
     print(f"✅ Ingesta completada. Total imágenes: {len(images)}")
 
 if __name__ == "__main__":
@@ -7,19 +7,46 @@ import shutil
 from typing import List, Tuple
 import re
 import numpy as np
-from sklearn.metrics.pairwise import cosine_similarity
 from tqdm import tqdm
 import multiprocessing
+import itertools
+import copy
+import queue
+import threading
+import argparse
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
 import time
 import torch
 
 import sys
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 sys.path.append(BASE_DIR)
+from src.utils.parent_store import ParentStore
+from src.utils.dedup import simhash
+from src.ingestion.manifest import IngestManifest, file_sha256, source_lock, text_hash
+from src.ingestion.bulk_writer import ChromaBulkWriter, WRITE_BATCH_SIZE
 DOCS_DIR = os.path.join(BASE_DIR, "docs")
 CHROMA_PATH = os.path.join(BASE_DIR, "chroma_db")
 COLLECTION_NAME = "rag_multimodal"
 EMBEDDING_MODEL_NAME = "all-MiniLM-L6-v2"
+# Procesos de parseo (CPU); los embeddings se calculan en un único consumidor
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", max(1, (os.cpu_count() or 2) - 1)))
+# PDFs parseados en espera de la etapa de embeddings (back-pressure)
+PARSED_QUEUE_SIZE = 8
+# Vector de cada chunk: "reembed" (Chroma embebe el chunk con su cabecera) o
+# "sentence_mean" (media de los embeddings de frase del split, sin re-embeber)
+CHUNK_EMBEDDING_MODE = os.getenv("CHUNK_EMBEDDING_MODE", "reembed")
+# Páginas por ventana de parseo: acota la memoria y marca la granularidad de los checkpoints
+PAGE_WINDOW_SIZE = int(os.getenv("PAGE_WINDOW_SIZE", "50"))
+# Documentos con cerrojo a la vez en la ingesta por lotes (un descriptor cada uno); al llegar al
+# límite se vacía el escritor para confirmar y soltar los terminados
+MAX_LOCKED_DOCUMENTS = 64
+# Unidades de cada etapa para el informe de throughput
+STAGE_UNITS = {"parse": "páginas", "split": "chunks", "embed": "chunks", "write": "chunks"}
+
+# Inicio de sección dentro de una página: encabezado markdown o "**Artículo N.**"
+SECTION_HEADING_RE = re.compile(r'^(?:#{1,6}\s+\S.*|\*\*Art[íi]culo\s+[^*]+\*\*.*)$', re.MULTILINE)
 
 _embedding_func = None
 
@@ -39,127 +66,454 @@ def split_into_sentences(text: str) -> List[str]:
     sentences = re.split(r'(?<=[.?!])\s+', text)
     return [s.strip() for s in sentences if s.strip()]
 
-def semantic_text_splitter(text: str, threshold_percentile=80, max_chunk_size=1500) -> List[str]:
-    sentences = split_into_sentences(text)
-    if not sentences:
-        return []
+def _normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    return matrix / np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+
+def _split_sentences(text: str, sentences: List[str], embeddings: np.ndarray, threshold_percentile: int,
+                     max_chunk_size: int) -> Tuple[List[str], List[np.ndarray]]:
+    """Agrupa frases consecutivas en chunks. `embeddings` (normalizados) son los de `sentences`.
+
+    Devuelve los chunks y, para cada uno, el vector medio (normalizado) de sus frases.
+    """
     if len(sentences) < 3:
-        return [text]
+        return [text], [_normalize_rows(embeddings.mean(axis=0, keepdims=True))[0]]
 
-    emb_fn = get_embedding_func()
-    embeddings = emb_fn(sentences)
-    embeddings = np.array(embeddings)
-    
-    dists = []
-    for i in range(len(embeddings) - 1):
-        sim = cosine_similarity([embeddings[i]], [embeddings[i+1]])[0][0]
-        dists.append(sim)
-    
-    if not dists:
-        return [text]
-        
-    threshold = np.percentile(dists, 100 - threshold_percentile)
+    # Similitud coseno de cada par de frases adyacentes en una sola operación
+    sims = np.einsum("ij,ij->i", embeddings[:-1], embeddings[1:])
+    threshold = np.percentile(sims, 100 - threshold_percentile)
     
-    chunks = []
-    current_chunk = [sentences[0]]
+    chunks, vectors = [], []
+    chunk_start = 0
     current_len = len(sentences[0])
     
-    for i in range(len(dists)):
-        sim = dists[i]
+    for i in range(len(sims)):
         next_sentence = sentences[i+1]
         
-        if sim < threshold or (current_len + len(next_sentence) > max_chunk_size):
-            chunks.append(" ".join(current_chunk))
-            current_chunk = [next_sentence]
+        if sims[i] < threshold or (current_len + len(next_sentence) > max_chunk_size):
+            chunks.append(" ".join(sentences[chunk_start:i+1]))
+            vectors.append(embeddings[chunk_start:i+1].mean(axis=0))
+            chunk_start = i + 1
             current_len = len(next_sentence)
         else:
-            current_chunk.append(next_sentence)
             current_len += len(next_sentence)
             
-    if current_chunk:
-        chunks.append(" ".join(current_chunk))
-        
-    return chunks
+    chunks.append(" ".join(sentences[chunk_start:]))
+    vectors.append(embeddings[chunk_start:].mean(axis=0))
+    return chunks, list(_normalize_rows(np.vstack(vectors)))
+
+def semantic_split_many(texts: List[str], threshold_percentile=80, max_chunk_size=1500) -> List[Tuple[List[str], List[np.ndarray]]]:
+    """Split semántico de varios textos (p. ej. todas las secciones de un PDF) con un único lote de embeddings.
+
+    Devuelve, por texto, (chunks, vectores de chunk derivados de los embeddings de sus frases).
+    """
+    sentences_per_text = [split_into_sentences(text) for text in texts]
+    all_sentences = [s for sentences in sentences_per_text for s in sentences]
+    if not all_sentences:
+        return [([], []) for _ in texts]
+
+    embeddings = _normalize_rows(np.asarray(get_embedding_func()(all_sentences), dtype=np.float32))
+
+    results = []
+    offset = 0
+    for text, sentences in zip(texts, sentences_per_text):
+        if not sentences:
+            results.append(([], []))
+            continue
+        text_embeddings = embeddings[offset:offset + len(sentences)]
+        offset += len(sentences)
+        results.append(_split_sentences(text, sentences, text_embeddings, threshold_percentile, max_chunk_size))
+    return results
+
+def semantic_text_splitter(text: str, threshold_percentile=80, max_chunk_size=1500) -> List[str]:
+    return semantic_split_many([text], threshold_percentile, max_chunk_size)[0][0]
 
 
 
-def fallback_extract_pdf(filepath: str) -> List[dict]:
+def split_into_sections(text: str) -> List[str]:
+    """Divide el texto de una página por encabezados/artículos (texto previo incluido como primera sección)."""
+    starts = [m.start() for m in SECTION_HEADING_RE.finditer(text)]
+    if not starts or starts[0] != 0:
+        starts = [0] + starts
+    bounds = starts + [len(text)]
+    sections = [text[bounds[i]:bounds[i + 1]].strip() for i in range(len(starts))]
+    return [sec for sec in sections if sec]
+
+def fallback_extract_pdf(filepath: str, pages: List[int] = None) -> List[dict]:
+    """Texto plano por página con el formato de `pymupdf4llm.to_markdown(page_chunks=True)` (páginas desde 1)."""
     doc = fitz.open(filepath)
     data = []
     for i, page in enumerate(doc):
+        if pages is not None and i not in pages:
+            continue
         text = page.get_text()
         if text.strip():
-            data.append({"text": text, "metadata": {"page": i}})
+            data.append({"text": text, "metadata": {"page": i + 1}})
     return data
 
-def process_file_worker(filepath: str) -> Tuple[str, List[dict], List[dict], List[str]]:
-    filename_ext = os.path.basename(filepath)
-    filename_base = os.path.splitext(filename_ext)[0]
-    
+def compute_page_hashes(filepath: str) -> dict:
+    """Hash del texto de cada página ({página: hash}), barato comparado con el parseo a markdown."""
+    with fitz.open(filepath) as doc:
+        return {i: text_hash(page.get_text()) for i, page in enumerate(doc)}
+
+def get_category(filepath: str) -> str:
     rel_path = os.path.relpath(filepath, DOCS_DIR)
     raw_cat = os.path.dirname(rel_path)
-    category = raw_cat.replace(os.sep, " > ") if raw_cat else "General"
+    return raw_cat.replace(os.sep, " > ") if raw_cat else "General"
 
-    documents = []
-    metadatas = []
-    ids = []
+def plan_file(filepath: str, previous_hashes: dict = None, window_size: int = None) -> Tuple[dict, List[List[int]], List[int]]:
+    """Hash de páginas y ventanas de páginas a (re)procesar.
+
+    Devuelve (hashes de todas las páginas, ventanas de páginas cambiadas,
+    páginas que ya no existen). Sin `previous_hashes` se procesan todas.
+    """
+    window_size = window_size or PAGE_WINDOW_SIZE
+    page_hashes = compute_page_hashes(filepath)
+    if previous_hashes is None:
+        changed_pages = sorted(page_hashes)
+    else:
+        changed_pages = [page for page, page_hash in sorted(page_hashes.items()) if previous_hashes.get(page) != page_hash]
+    removed_pages = [page for page in (previous_hashes or {}) if page not in page_hashes]
+    windows = [changed_pages[i:i + window_size] for i in range(0, len(changed_pages), window_size)]
+    return page_hashes, windows, removed_pages
+
+def parse_file_worker(filepath: str, pages: List[int] = None) -> Tuple[str, List[dict], dict, dict]:
+    """Etapa CPU (proceso del pool): PDF -> unidades de texto (sección por página) + textos padre.
+
+    No usa el modelo de embeddings, así que puede ejecutarse en paralelo en
+    varios procesos sin competir por la GPU. `pages` limita el parseo a una
+    ventana de páginas (None = documento completo).
+    """
+    started = time.perf_counter()
+    filename_ext = os.path.basename(filepath)
+    filename_base = os.path.splitext(filename_ext)[0]
+    category = get_category(filepath)
+
+    units = []
+    parents = {} # {parent_id: texto de la página/sección} -> ParentStore
+    page_parent_ids = defaultdict(list) # página -> ids de sus padres (para borrarlos si cambia)
+
+    if pages is None:
+        try:
+            with fitz.open(filepath) as doc:
+                pages = list(range(doc.page_count))
+        except Exception as e:
+            return filepath, [], {}, {"error": f"No se pudo abrir el PDF: {e}"}
 
     # Signal removed for Windows compatibility
     data = []
     used_strategy = "pymupdf4llm_semantic"
     
-    try:
-        data = pymupdf4llm.to_markdown(filepath, page_chunks=True)
-    except Exception:
-        used_strategy = "fallback_standard"
+    if pages:
         try:
-            data = fallback_extract_pdf(filepath)
-        except:
-            pass
-            
-    if not data:
-        return filepath, [], [], []
+            data = pymupdf4llm.to_markdown(filepath, pages=pages, page_chunks=True)
+        except Exception:
+            used_strategy = "fallback_standard"
+            try:
+                data = fallback_extract_pdf(filepath, pages=pages)
+            except:
+                pass
 
-    chunk_counter = 0
-    for page_data in data:
-        page_num = page_data['metadata']['page']
+    for page_data in data or []:
+        # pymupdf4llm numera desde 1; internamente (ventanas, hashes, ids) las páginas van desde 0
+        page_num = page_data['metadata']['page'] - 1
         content = page_data['text']
         if not content.strip():
             continue
             
-        chunks = semantic_text_splitter(content)
-        for chunk_text in chunks:
-            rich_chunk_text = f"CONTEXTO: Categoría '{category}' | Documento '{filename_base}'\nPÁGINA {page_num+1}:\n{chunk_text}"
+        header = f"CONTEXTO: Categoría '{category}' | Documento '{filename_base}'\nPÁGINA {page_num+1}:\n"
+        page_parent_id = f"{filename_base}_p{page_num}"
+        parents[page_parent_id] = header + content.strip()
+        page_parent_ids[page_num].append(page_parent_id)
+        
+        # Padres a nivel de sección si la página tiene varios encabezados/artículos
+        sections = split_into_sections(content)
+        for sec_idx, section_text in enumerate(sections):
+            parent_id = page_parent_id
+            if len(sections) > 1:
+                parent_id = f"{page_parent_id}_s{sec_idx}"
+                parents[parent_id] = header + section_text
+                page_parent_ids[page_num].append(parent_id)
+            units.append({
+                "text": section_text,
+                "header": header,
+                "page": page_num,
+                "parent_id": parent_id,
+                "page_parent_id": page_parent_id
+            })
+
+    info = {
+        "source": filename_ext,
+        "base": filename_base,
+        "category": category,
+        "strategy": used_strategy,
+        "pages": len(pages),
+        "changed_pages": list(pages),
+        "page_parent_ids": dict(page_parent_ids),
+        "parse_seconds": time.perf_counter() - started
+    }
+    return filepath, units, parents, info
+
+def build_chunks(units: List[dict], info: dict) -> Tuple[List[str], List[dict], List[str], list]:
+    """Etapa de embeddings: split semántico de todas las unidades -> (documentos, metadatas, ids, embeddings).
+
+    `embeddings` es None con CHUNK_EMBEDDING_MODE="reembed" (Chroma embebe el
+    texto completo del chunk); con "sentence_mean" son las medias de los
+    embeddings de frase ya calculados para el split, sin segunda pasada.
+    Los ids se numeran por página, así re-procesar una página no cambia los
+    ids de las demás.
+    """
+    documents = []
+    metadatas = []
+    ids = []
+    embeddings = []
+    chunk_counters = defaultdict(int)
+    splits = semantic_split_many([unit["text"] for unit in units])
+    for unit, (chunks, vectors) in zip(units, splits):
+        for chunk_text, vector in zip(chunks, vectors):
+            rich_chunk_text = f"{unit['header']}{chunk_text}"
             meta = {
-                "source": filename_ext,
-                "page": page_num + 1,
-                "strategy": used_strategy,
-                "category": category
+                "source": info["source"],
+                "page": unit["page"] + 1,
+                "strategy": info["strategy"],
+                "category": info["category"],
+                "parent_id": unit["parent_id"],
+                "page_parent_id": unit["page_parent_id"],
+                "simhash": simhash(chunk_text) # sin cabecera: igual entre PDFs que republican el texto
             }
-            chunk_id = f"{filename_base}_p{page_num}_c{chunk_counter}"
+            chunk_id = f"{info['base']}_p{unit['page']}_c{chunk_counters[unit['page']]}"
             
             documents.append(rich_chunk_text)
             metadatas.append(meta)
             ids.append(chunk_id)
-            chunk_counter += 1
-            
-    return filepath, documents, metadatas, ids
+            embeddings.append(vector.tolist())
+            chunk_counters[unit["page"]] += 1
+    if CHUNK_EMBEDDING_MODE != "sentence_mean":
+        embeddings = None
+    return documents, metadatas, ids, embeddings
+
+def process_file_worker(filepath: str) -> Tuple[str, List[dict], List[dict], List[str], dict]:
+    _, units, parents, info = parse_file_worker(filepath)
+    if not units:
+        return filepath, [], [], [], {}
+    documents, metadatas, ids, _ = build_chunks(units, info)
+    return filepath, documents, metadatas, ids, parents
+
+def classify_file(filepath: str, manifest: IngestManifest, legacy_sources: set = ()) -> Tuple[str, str, str]:
+    """Decide qué hacer con un PDF comparando su hash con el manifiesto.
+
+    Devuelve (estado, sha256, fuente relacionada):
+    - "unchanged": mismo nombre y mismo contenido -> se salta.
+    - "renamed": contenido ya ingestado con otro nombre cuyo fichero ya no existe.
+    - "duplicate": copia idéntica de otro documento que sigue existiendo.
+    - "legacy": ingestado antes del manifiesto -> se re-ingesta completo una vez.
+    - "updated" / "new": se parsean las páginas cambiadas / todas.
+    """
+    source = os.path.basename(filepath)
+    sha = file_sha256(filepath)
+    entry = manifest.get(source)
+    if entry and entry.get("sha256") == sha:
+        return "unchanged", sha, None
+    if not entry:
+        other = manifest.find_by_sha(sha, exclude=source)
+        if other:
+            other_path = manifest.get(other).get("path")
+            if other_path and not os.path.exists(other_path) and not manifest.get(other).get("alias_of"):
+                return "renamed", sha, other
+            return "duplicate", sha, manifest.get(other).get("alias_of") or other
+        if source in legacy_sources:
+            return "legacy", sha, None
+    return ("updated" if entry else "new"), sha, None
+
+def _batched(items: list, size: int = WRITE_BATCH_SIZE):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+def rename_source(collection, parent_store: ParentStore, manifest: IngestManifest, old_source: str, filepath: str):
+    """Renombrado sin re-embeber: se actualiza la metadata de los chunks existentes."""
+    new_source = os.path.basename(filepath)
+    data = collection.get(where={"source": old_source}, include=["metadatas"])
+    category = get_category(filepath)
+    for ids, metas in zip(_batched(data["ids"]), _batched(data["metadatas"])):
+        collection.update(ids=ids, metadatas=[{**meta, "source": new_source, "category": category} for meta in metas])
+    parent_store.rename_source(old_source, new_source)
+    manifest.rename(old_source, new_source, os.path.abspath(filepath))
 
-def process_pdf(filepath: str) -> bool:
+def delete_stale_pages(collection, parent_store: ParentStore, manifest: IngestManifest, source: str, pages: List[int]):
+    """Borra chunks y padres registrados en el manifiesto para estas páginas."""
+    stale = manifest.page_entries(source, pages)
+    stale_ids = [chunk_id for entry in stale.values() for chunk_id in entry.get("chunk_ids", [])]
+    for ids in _batched(stale_ids):
+        collection.delete(ids=ids)
+    parent_store.delete_many(parent_id for entry in stale.values() for parent_id in entry.get("parent_ids", []))
+    return len(stale_ids)
+
+def page_outputs(info: dict, metas: List[dict], chunk_ids: List[str], page_hashes: dict) -> dict:
+    """{página: {"hash", "chunk_ids", "parent_ids"}} de las páginas procesadas, para el checkpoint del manifiesto."""
+    outputs = {
+        page: {"hash": page_hashes.get(page), "chunk_ids": [], "parent_ids": info["page_parent_ids"].get(page, [])}
+        for page in info["changed_pages"]
+    }
+    for meta, chunk_id in zip(metas, chunk_ids):
+        outputs[meta["page"] - 1]["chunk_ids"].append(chunk_id)
+    return outputs
+
+def process_pdf(filepath: str, progress=None) -> str:
+    """Ingesta incremental de un PDF.
+
+    Devuelve el estado de `classify_file`, "empty" si no generó contenido o "error".
+    `progress(**campos)` (opcional) recibe pages_total/pages_parsed tras el
+    parseo, chunks_total/chunks_embedded tras cada lote escrito y, en un
+    renombrado, renamed_from con el nombre antiguo.
+    Se ejecuta con el cerrojo del documento: si la API y el watcher lo piden
+    a la vez, el segundo espera y lo encuentra "unchanged".
+    """
+    with source_lock(os.path.basename(filepath)):
+        return _process_pdf_locked(filepath, progress)
+
+def _process_pdf_locked(filepath: str, progress=None) -> str:
+    progress = progress or (lambda **fields: None)
     try:
-        _, docs, metas, ids = process_file_worker(filepath)
-        if docs:
-            client = chromadb.PersistentClient(path=CHROMA_PATH)
-            emb_fn = get_embedding_func()
-            collection = client.get_or_create_collection(name=COLLECTION_NAME, embedding_function=emb_fn)
-            collection.add(documents=docs, metadatas=metas, ids=ids)
-            return True
-        return False
+        client = chromadb.PersistentClient(path=CHROMA_PATH)
+        emb_fn = get_embedding_func()
+        collection = client.get_or_create_collection(name=COLLECTION_NAME, embedding_function=emb_fn)
+        parent_store = ParentStore()
+        manifest = IngestManifest()
+        source = os.path.basename(filepath)
+
+        legacy = {source} if not manifest.get(source) and collection.get(where={"source": source}, limit=1)["ids"] else set()
+        status, sha, other = classify_file(filepath, manifest, legacy)
+        if status == "unchanged":
+            return status
+        if status == "renamed":
+            rename_source(collection, parent_store, manifest, other, filepath)
+            manifest.save()
+            # El nombre antiguo deja de existir: quien mantenga índices en memoria debe quitarlo
+            progress(renamed_from=other)
+            return status
+        if status == "duplicate":
+            manifest.add_alias(source, sha, os.path.abspath(filepath), other)
+            manifest.save()
+            return status
+        if status == "legacy":
+            collection.delete(where={"source": source})
+            parent_store.delete_source(source)
+
+        previous = manifest.page_hashes(source) if status == "updated" else None
+        page_hashes, windows, removed_pages = plan_file(filepath, previous)
+        pending_pages = sum(len(window) for window in windows)
+        progress(pages_total=len(page_hashes), pages_parsed=len(page_hashes) - pending_pages)
+        total_chunks = 0
+        failed_windows = []
+
+        def checkpoint(outputs: dict):
+            # Checkpoint: una ingesta interrumpida retoma desde la primera página no confirmada
+            def on_committed(ok: bool):
+                if not ok:
+                    failed_windows.append(sorted(outputs))
+                    return
+                manifest.checkpoint_pages(source, os.path.abspath(filepath), outputs)
+                manifest.save()
+            return on_committed
+
+        # Ventanas de páginas: parsear -> embeber -> escribir -> checkpoint (memoria acotada);
+        # la escritura de una ventana se solapa con los embeddings de la siguiente
+        writer = ChromaBulkWriter(collection, client=client, embedding_function=emb_fn,
+                                  progress=lambda written: progress(chunks_embedded=written))
+        try:
+            for window in windows:
+                _, units, parents, info = parse_file_worker(filepath, window)
+                if info.get("error"):
+                    print(f"Error en process_pdf single: {info['error']}")
+                    return "error"
+                docs, metas, ids, embeddings = build_chunks(units, info)
+                progress(pages_parsed=len(page_hashes) - pending_pages + len(window), chunks_total=total_chunks + len(ids))
+                delete_stale_pages(collection, parent_store, manifest, source, window)
+                parent_store.put_many(parents, source=source)
+                writer.add(docs, metas, ids, embeddings, on_committed=checkpoint(page_outputs(info, metas, ids, page_hashes)))
+                total_chunks += len(ids)
+                pending_pages -= len(window)
+        finally:
+            writer.close()
+        if total_chunks:
+            writer.report(source)
+        if failed_windows:
+            print(f"❌ {source}: no se pudieron escribir las páginas {failed_windows} (se reintentarán en la próxima ingesta)")
+            return "error"
+
+        delete_stale_pages(collection, parent_store, manifest, source, removed_pages)
+        manifest.update_file(source, sha, os.path.abspath(filepath), page_hashes, {})
+        manifest.save()
+        if not total_chunks and status != "updated":
+            return "empty"
+        return status
     except Exception as e:
         print(f"Error en process_pdf single: {e}")
-        return False
+        return "error"
+
+def remove_document(source: str) -> List[str]:
+    """Borra un documento de Chroma, del parent store y del manifiesto.
 
-def main():
+    Devuelve las rutas de sus copias idénticas (alias), que se quedan sin
+    chunks y deben volver a ingestarse.
+    """
+    with source_lock(source):
+        client = chromadb.PersistentClient(path=CHROMA_PATH)
+        collection = client.get_or_create_collection(name=COLLECTION_NAME, embedding_function=get_embedding_func())
+        collection.delete(where={"source": source})
+        ParentStore().delete_source(source)
+        manifest = IngestManifest()
+        aliases = [entry["path"] for entry in manifest.files.values() if entry.get("alias_of") == source]
+        manifest.remove(source)
+        manifest.save()
+    return [path for path in aliases if path and os.path.exists(path)]
+
+class StageStats:
+    """Contadores de throughput por etapa del pipeline de ingesta."""
+
+    def __init__(self):
+        self.counts = defaultdict(int)
+        self.seconds = defaultdict(float)
+
+    def add(self, stage: str, items: int, seconds: float):
+        self.counts[stage] += items
+        self.seconds[stage] += seconds
+
+    def report(self, wall_seconds: float):
+        print("\n📈 Throughput por etapa:")
+        for stage, unit in STAGE_UNITS.items():
+            busy = self.seconds[stage]
+            rate = self.counts[stage] / busy if busy else 0.0
+            print(f"   {stage:<8} {self.counts[stage]:>7} {unit:<7} | {busy:8.1f}s ocupada | {rate:8.1f} {unit}/s")
+        print(f"   {'espera':<8} {self.seconds['wait']:8.1f}s con la etapa de embeddings esperando al parseo")
+        print(f"   Total: {wall_seconds:.1f}s")
+
+def _parse_producer(tasks: List[Tuple[str, List[int]]], num_workers: int, parsed_queue: queue.Queue):
+    """Reparte las ventanas de páginas (fichero, páginas) al pool y deja los resultados en una cola acotada.
+
+    Solo hay `num_workers * 2` ventanas en vuelo: si la etapa de embeddings
+    va por detrás, la cola se llena, `put` bloquea y no se parsean más
+    páginas (back-pressure) en lugar de acumularlas en memoria.
+    """
+    ctx = multiprocessing.get_context("spawn")
+    try:
+        with ProcessPoolExecutor(max_workers=num_workers, mp_context=ctx) as pool:
+            pending_tasks = iter(tasks)
+            in_flight = {pool.submit(parse_file_worker, *task): task[0] for task in itertools.islice(pending_tasks, num_workers * 2)}
+            while in_flight:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    filepath = in_flight.pop(future)
+                    try:
+                        parsed_queue.put(future.result())
+                    except Exception as e:
+                        parsed_queue.put((filepath, [], {}, {"error": str(e)}))
+                    next_task = next(pending_tasks, None)
+                    if next_task:
+                        in_flight[pool.submit(parse_file_worker, *next_task)] = next_task[0]
+    finally:
+        parsed_queue.put(None) # Fin de la cola
+
+def main(num_workers: int = INGEST_WORKERS, queue_size: int = PARSED_QUEUE_SIZE):
     if not os.path.exists(DOCS_DIR):
         print(f"⚠️ {DOCS_DIR} no encontrado.")
         return
@@ -169,17 +523,18 @@ def main():
     client = chromadb.PersistentClient(path=CHROMA_PATH)
     emb_fn = get_embedding_func() 
     collection = client.get_or_create_collection(name=COLLECTION_NAME, embedding_function=emb_fn)
+    parent_store = ParentStore()
+    manifest = IngestManifest()
 
-    # 1. Recuperar fuentes existentes para RESUME
-    existing_completed = set()
+    # 1. Fuentes ya indexadas antes de existir el manifiesto (se re-ingestan una vez)
+    legacy_sources = set()
     try:
-        print("🔍 Verificando historial para RESUMIR ingesta...")
+        print("🔍 Verificando historial de ingesta (manifiesto de hashes)...")
         # Get only metadatas to be faster
         all_data = collection.get(include=["metadatas"])
         for meta in all_data["metadatas"]:
-            if meta and "source" in meta:
-                existing_completed.add(meta["source"])
-        print(f"🔄 Modo RESUME: Se encontraron {len(existing_completed)} documentos ya indexados (se saltarán).")
+            if meta and "source" in meta and not manifest.get(meta["source"]):
+                legacy_sources.add(meta["source"])
     except Exception as e:
         print(f"⚠️ No se pudo verificar historial: {e}")
 
@@ -187,8 +542,6 @@ def main():
     for root, dirs, files in os.walk(DOCS_DIR):
         for file in files:
             if file.lower().endswith(".pdf"):
-                if file in existing_completed:
-                    continue
                 pdf_files.append(os.path.join(root, file))
     
     if not pdf_files:
@@ -196,42 +549,204 @@ def main():
         return
         
     pdf_files.sort()
-    total_files = len(pdf_files)
-    print(f"📚 Encontrados {total_files} documentos. Iniciando procesamiento PARALELO...")
-    num_workers = 2 # Reduced for GPU VRAM safety
-    print(f"🚀 Usando {num_workers} procesos (Optimizado para GPU).")
 
-    # Sequential execution for Windows/CUDA stability
-    print("⚡ Procesando en modo SECUENCIAL (Mejor para GPU/Windows)...")
-    
-    with tqdm(total=total_files, desc="⚡ Procesando Archivos", unit="doc") as pbar:
-        for filepath in pdf_files:
-            # Process directly
+    # Cerrojo por documento, solo mientras se trabaja en él: al planificarlo y, si hay que parsearlo, desde su
+    # primera ventana hasta que se confirma (pocos descriptores abiertos a la vez aunque el lote sea grande).
+    # Los que la API o watch_docs están ingestando ahora se omiten en esta pasada
+    held_locks = {}
+    finished = [] # ficheros terminados: su cerrojo se suelta cuando el manifiesto con su estado está guardado
+
+    def take_lock(filepath: str) -> bool:
+        if filepath in held_locks:
+            return True
+        lock = source_lock(os.path.basename(filepath))
+        if not lock.acquire(blocking=False):
+            return False
+        held_locks[filepath] = lock
+        return True
+
+    def release_lock(filepath: str):
+        lock = held_locks.pop(filepath, None)
+        if lock:
+            lock.release()
+
+    def save_manifest():
+        manifest.save()
+        while finished:
+            release_lock(finished.pop())
+
+    # 2. Delta por hash: sin cambios / renombrados / copias se resuelven sin parsear
+    tasks = [] # (fichero, ventana de páginas)
+    plans = {} # fichero -> estado, sha, hashes de página, páginas eliminadas, ventanas pendientes
+    counts = defaultdict(int)
+    planned_shas = {} # sha -> fuente que se ingesta en esta pasada (el manifiesto solo la ve al terminar)
+
+    def finalize(filepath: str):
+        """Todas las ventanas del fichero confirmadas: fuera las páginas eliminadas y se fija su sha."""
+        plan = plans[filepath]
+        source = os.path.basename(filepath)
+        delete_stale_pages(collection, parent_store, manifest, source, plan["removed_pages"])
+        manifest.update_file(source, plan["sha"], os.path.abspath(filepath), plan["page_hashes"], {})
+        if not plan["chunks"] and plan["status"] != "updated":
+            tqdm.write(f"⚠️ {source} no generó contenido (ni Fallback).")
+        finished.append(filepath)
+
+    def plan_source(filepath: str):
+        source = os.path.basename(filepath)
+        try:
+            status, sha, other = classify_file(filepath, manifest, legacy_sources)
+        except OSError as e:
+            print(f"❌ No se pudo leer {filepath}: {e}")
+            return
+        if status in ("new", "legacy") and planned_shas.get(sha, source) != source:
+            # Copia idéntica de otro PDF de este mismo lote (sus chunks previos al manifiesto, si los tenía, sobran)
+            if status == "legacy":
+                collection.delete(where={"source": source})
+                parent_store.delete_source(source)
+            status, other = "duplicate", planned_shas[sha]
+        counts[status] += 1
+        if status == "unchanged":
+            return
+        if status == "renamed":
+            print(f"🔀 {other} -> {source} (mismo contenido, sin re-embeber)")
+            rename_source(collection, parent_store, manifest, other, filepath)
+            return
+        if status == "duplicate":
+            print(f"♻️ {source} es idéntico a {other} (se omite)")
+            manifest.add_alias(source, sha, os.path.abspath(filepath), other)
+            return
+        if status == "legacy":
+            collection.delete(where={"source": source})
+            parent_store.delete_source(source)
+        try:
+            page_hashes, windows, removed_pages = plan_file(filepath, manifest.page_hashes(source) if status == "updated" else None)
+        except Exception as e:
+            print(f"❌ No se pudo abrir {filepath}: {e}")
+            return
+        planned_shas.setdefault(sha, source)
+        plans[filepath] = {
+            "status": status, "sha": sha, "page_hashes": page_hashes, "removed_pages": removed_pages,
+            "windows_left": len(windows), "chunks": 0, "skipped": False,
+            # Entrada del manifiesto al planificar: si otro proceso la cambia antes de parsear, el plan ya no vale
+            "entry": copy.deepcopy(manifest.get(source))
+        }
+        tasks.extend((filepath, window) for window in windows)
+        if not windows:
+            finalize(filepath)
+
+    for filepath in pdf_files:
+        if not take_lock(filepath):
+            print(f"⏭️ {os.path.basename(filepath)} se está ingestando en otro proceso (se omite)")
+            continue
+        try:
+            # Con el cerrojo tomado, el manifiesto refleja lo que otros procesos hayan terminado
+            manifest.reload()
+            plan_source(filepath)
+            if manifest.dirty:
+                manifest.save()
+        finally:
+            finished.clear()
+            release_lock(filepath)
+    print("🔄 Manifiesto: " + ", ".join(f"{status}={n}" for status, n in sorted(counts.items())))
+
+    if not tasks:
+        print("✅ Nada que actualizar.")
+        return
+
+    total_pages = sum(len(window) for _, window in tasks)
+    num_workers = max(1, min(num_workers, len(tasks)))
+    print(f"📚 {sum(1 for plan in plans.values() if plan['windows_left'])} documentos nuevos o modificados "
+          f"({total_pages} páginas en {len(tasks)} ventanas). Iniciando procesamiento en PIPELINE...")
+    # Parseo (CPU) en N procesos; embeddings + escritura en un único consumidor (GPU)
+    print(f"🚀 {num_workers} procesos de parseo -> cola({queue_size}) -> 1 etapa de embeddings/escritura.")
+
+    stats = StageStats()
+    parsed_queue = queue.Queue(maxsize=queue_size)
+    producer = threading.Thread(target=_parse_producer, args=(tasks, num_workers, parsed_queue), daemon=True)
+    wall_start = time.perf_counter()
+    producer.start()
+
+    # Lotes acotados entre ventanas/ficheros; embeddings del lote N+1 mientras se escribe el N.
+    # Cada ventana se confirma en el manifiesto cuando todos sus chunks están escritos.
+    def checkpoint(filepath: str, outputs: dict):
+        def on_committed(ok: bool):
+            if not ok:
+                tqdm.write(f"❌ {os.path.basename(filepath)}: páginas {sorted(outputs)} sin escribir (se reintentarán)")
+                return
+            manifest.checkpoint_pages(os.path.basename(filepath), os.path.abspath(filepath), outputs)
+            plans[filepath]["windows_left"] -= 1
+            if plans[filepath]["windows_left"] == 0:
+                finalize(filepath)
+        return on_committed
+
+    def claim(filepath: str) -> bool:
+        """Primera ventana del fichero: toma su cerrojo y comprueba que nadie lo ha ingestado desde la planificación."""
+        source = os.path.basename(filepath)
+        if len(held_locks) >= MAX_LOCKED_DOCUMENTS:
+            # Se confirma lo pendiente: los documentos terminados sueltan su cerrojo
+            writer.flush()
+            save_manifest()
+        if not take_lock(filepath):
+            tqdm.write(f"⏭️ {source} se está ingestando en otro proceso (se omite)")
+            return False
+        manifest.reload()
+        if manifest.get(source) != plans[filepath]["entry"]:
+            release_lock(filepath)
+            tqdm.write(f"⏭️ {source} ha cambiado en el manifiesto desde la planificación (lo ingestó otro proceso; se omite)")
+            return False
+        return True
+
+    # El manifiesto se guarda una vez por lote escrito (y entonces se sueltan los cerrojos de los ficheros terminados)
+    writer = ChromaBulkWriter(collection, client=client, embedding_function=emb_fn,
+                              progress=lambda written: save_manifest())
+
+    with tqdm(total=total_pages, desc="⚡ Procesando Páginas", unit="pág") as pbar:
+        while True:
+            started = time.perf_counter()
+            item = parsed_queue.get()
+            stats.seconds["wait"] += time.perf_counter() - started
+            if item is None:
+                break
+
+            filepath, units, parents, info = item
+            filename = os.path.basename(filepath)
+            plan = plans[filepath]
+            if plan["skipped"] or (filepath not in held_locks and not claim(filepath)):
+                plan["skipped"] = True
+                pbar.update(info.get("pages", 0))
+                continue
             try:
-                _, docs, metas, chunk_ids = process_file_worker(filepath)
-                filename = os.path.basename(filepath)
-                
-                if docs:
-                    try:
-                        # Batch insertion to avoid ChromaDB/SQLite limit (max ~5461 vars)
-                        BATCH_SIZE = 1000
-                        total_chunks = len(docs)
-                        for i in range(0, total_chunks, BATCH_SIZE):
-                            end = min(i + BATCH_SIZE, total_chunks)
-                            collection.add(
-                                documents=docs[i:end],
-                                metadatas=metas[i:end],
-                                ids=chunk_ids[i:end]
-                            )
-                    except Exception as e:
-                        tqdm.write(f"❌ Error insertando {filename}: {e}")
+                if info.get("error"):
+                    tqdm.write(f"❌ Error fatal procesando {filepath}: {info['error']}")
                 else:
-                    tqdm.write(f"⚠️ {filename} no generó contenido (ni Fallback).")
+                    stats.add("parse", info["pages"], info["parse_seconds"])
+                    started = time.perf_counter()
+                    docs, metas, chunk_ids, embeddings = build_chunks(units, info)
+                    stats.add("split", len(docs), time.perf_counter() - started)
+
+                    # Páginas de la ventana: fuera sus chunks/padres antiguos antes de añadir los nuevos
+                    removed = delete_stale_pages(collection, parent_store, manifest, filename, info["changed_pages"])
+                    if removed:
+                        tqdm.write(f"♻️ {filename}: {len(info['changed_pages'])} páginas re-procesadas, {removed} chunks antiguos eliminados")
+                    parent_store.put_many(parents, source=filename)
+                    plans[filepath]["chunks"] += len(chunk_ids)
+                    outputs = page_outputs(info, metas, chunk_ids, plans[filepath]["page_hashes"])
+                    writer.add(docs, metas, chunk_ids, embeddings, on_committed=checkpoint(filepath, outputs))
             except Exception as e:
                 tqdm.write(f"❌ Error fatal procesando {filepath}: {e}")
             
-            pbar.update(1)
-                
+            pbar.update(info.get("pages", 0))
+        writer.close()
+        save_manifest()
+    for filepath in list(held_locks):
+        release_lock(filepath)
+
+    producer.join()
+    summary = writer.summary()
+    stats.add("embed", summary["written"], summary["embed_seconds"])
+    stats.add("write", summary["written"], summary["write_seconds"])
+    stats.report(time.perf_counter() - wall_start)
+    writer.report("PDFs")
     print("\n✅ Ingesta PDF Completada.")
     
     # 2. Ingesta de Datos CSV (Nuevo)
@@ -243,4 +758,8 @@ def main():
 
 if __name__ == "__main__":
     multiprocessing.set_start_method('spawn', force=True)
-    main()
+    parser = argparse.ArgumentParser(description="Ingesta de PDFs de docs/ en ChromaDB.")
+    parser.add_argument("--workers", type=int, default=INGEST_WORKERS, help="Procesos de parseo de PDFs.")
+    parser.add_argument("--queue-size", type=int, default=PARSED_QUEUE_SIZE, help="PDFs parseados en espera de embeddings.")
+    args = parser.parse_args()
+    main(num_workers=args.workers, queue_size=args.queue_size)
@@ -0,0 +1,298 @@
+import os
+import json
+import errno
+import time
+import hashlib
+import threading
+
+try:
+    import fcntl
+except ImportError: # Windows
+    fcntl = None
+    import msvcrt
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+MANIFEST_PATH = os.path.join(BASE_DIR, "chroma_db", "ingest_manifest.json")
+CSV_MANIFEST_PATH = os.path.join(BASE_DIR, "chroma_db", "csv_manifest.json")
+# Cerrojos de ingesta por documento (compartidos por la API, el daemon watch_docs y la ingesta por lotes)
+LOCKS_DIR = os.path.join(BASE_DIR, "chroma_db", "locks")
+
+# Lectura de ficheros por bloques para el hash
+HASH_BLOCK_SIZE = 1 << 20
+# Espera entre intentos al pedir un cerrojo ocupado en Windows (msvcrt no bloquea)
+LOCK_POLL_SECONDS = 0.05
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class FileLock:
+    """Cerrojo exclusivo entre procesos (y entre hilos) sobre un fichero: flock en POSIX, msvcrt en Windows.
+
+    Cada `acquire` abre su propio descriptor, así dos hilos del mismo proceso
+    también se excluyen. Se libera al cerrar el descriptor (o si el proceso muere).
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._fd = None
+
+    def _open(self):
+        """Descriptor del fichero de cerrojo; None si el proceso no tiene descriptores libres (EMFILE/ENFILE)."""
+        try:
+            return os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        except OSError as e:
+            if e.errno in (errno.EMFILE, errno.ENFILE):
+                return None
+            raise
+
+    def acquire(self, blocking: bool = True) -> bool:
+        """Toma el cerrojo. Sin descriptores libres se comporta como si estuviera ocupado (espera o devuelve False)."""
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        fd = None
+        while True:
+            if fd is None:
+                fd = self._open()
+            if fd is not None:
+                try:
+                    if fcntl:
+                        fcntl.flock(fd, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    else:
+                        msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+                    self._fd = fd
+                    return True
+                except OSError:
+                    pass
+            if not blocking:
+                if fd is not None:
+                    os.close(fd)
+                return False
+            time.sleep(LOCK_POLL_SECONDS)
+
+    def locked(self) -> bool:
+        """True si otro (proceso o hilo) tiene el cerrojo ahora mismo."""
+        if not self.acquire(blocking=False):
+            return True
+        self.release()
+        return False
+
+    def release(self):
+        if self._fd is None:
+            return
+        fd, self._fd = self._fd, None
+        try:
+            if fcntl:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+            else:
+                os.lseek(fd, 0, os.SEEK_SET)
+                msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+        finally:
+            os.close(fd)
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
+
+
+def source_lock(source: str, locks_dir: str = None) -> FileLock:
+    """Cerrojo de ingesta de un documento: un único proceso lo parsea/escribe a la vez."""
+    name = hashlib.sha1(source.encode("utf-8")).hexdigest()[:16]
+    return FileLock(os.path.join(locks_dir or LOCKS_DIR, f"{name}.lock"))
+
+
+class IngestManifest:
+    """Manifiesto de ingesta: hash por fichero y por página -> chunks y padres generados.
+
+    Estructura (JSON):
+        {"files": {source: {"sha256": ..., "path": ...,
+                            "pages": {"<n>": {"hash": ..., "chunk_ids": [...], "parent_ids": [...]}}}}}
+
+    Permite saltar ficheros sin cambios, re-procesar solo las páginas que
+    cambian (borrando sus chunks antiguos) y detectar copias o renombrados
+    por contenido.
+
+    Varios procesos (API, watch_docs, ingesta por lotes) comparten el
+    fichero: `save` lo relee bajo un cerrojo de fichero y solo sobrescribe
+    las fuentes que esta instancia ha cambiado, así no se pisan entradas.
+    """
+
+    def __init__(self, path: str = MANIFEST_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._changed = set() # fuentes modificadas/borradas desde el último save
+        self._disk_stamp = None # (mtime, tamaño, inodo) en la última lectura: reload no relee si no ha cambiado
+        self.files = self._read()
+
+    def _stamp(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return stat.st_mtime_ns, stat.st_size, stat.st_ino
+
+    def _read(self) -> dict:
+        self._disk_stamp = self._stamp()
+        if self._disk_stamp is None:
+            return {}
+        with open(self.path, "r", encoding="utf-8") as f:
+            return json.load(f).get("files", {})
+
+    def _merge_from_disk(self):
+        """Estado del disco + los cambios locales aún sin guardar."""
+        files = self._read()
+        for source in self._changed:
+            if source in self.files:
+                files[source] = self.files[source]
+            else:
+                files.pop(source, None)
+        self.files = files
+
+    def reload(self):
+        """Recoge lo que otros procesos han guardado (conserva los cambios locales pendientes)."""
+        with self._lock, FileLock(f"{self.path}.lock"):
+            if self._stamp() != self._disk_stamp:
+                self._merge_from_disk()
+
+    @property
+    def dirty(self) -> bool:
+        """True si hay cambios locales sin guardar."""
+        return bool(self._changed)
+
+    def get(self, source: str) -> dict:
+        return self.files.get(source)
+
+    def find_by_sha(self, sha: str, exclude: str = None) -> str:
+        """Fuente ya ingestada con el mismo contenido (copia o renombrado)."""
+        for source, entry in self.files.items():
+            if source != exclude and entry.get("sha256") == sha:
+                return source
+        return None
+
+    def page_hashes(self, source: str) -> dict:
+        entry = self.files.get(source) or {}
+        return {int(page): info["hash"] for page, info in entry.get("pages", {}).items()}
+
+    def page_entries(self, source: str, pages) -> dict:
+        entry = self.files.get(source) or {}
+        stored = entry.get("pages", {})
+        return {page: stored[str(page)] for page in pages if str(page) in stored}
+
+    def update_file(self, source: str, sha: str, path: str, page_hashes: dict, page_outputs: dict):
+        """Registra el estado de un fichero.
+
+        `page_hashes` tiene todas las páginas actuales; `page_outputs` solo las
+        re-procesadas ({page: {"chunk_ids": [...], "parent_ids": [...]}}). Las
+        páginas no re-procesadas conservan sus chunks y las que ya no existen
+        desaparecen.
+        """
+        with self._lock:
+            old_pages = (self.files.get(source) or {}).get("pages", {})
+            pages = {}
+            for page, page_hash in page_hashes.items():
+                key = str(page)
+                if page in page_outputs:
+                    pages[key] = {"hash": page_hash, **page_outputs[page]}
+                elif key in old_pages:
+                    pages[key] = old_pages[key]
+            self.files[source] = {"sha256": sha, "path": path, "pages": pages}
+            self._changed.add(source)
+
+    def checkpoint_pages(self, source: str, path: str, pages: dict):
+        """Confirma páginas ya escritas ({page: {"hash", "chunk_ids", "parent_ids"}}).
+
+        El sha del fichero solo se fija al terminar (`update_file`), así que
+        un fichero a medias se ve como modificado y al retomarlo solo se
+        procesan las páginas aún no confirmadas.
+        """
+        with self._lock:
+            entry = self.files.setdefault(source, {"sha256": None, "path": path, "pages": {}})
+            entry.pop("alias_of", None)
+            entry["path"] = path
+            for page, page_entry in pages.items():
+                entry["pages"][str(page)] = page_entry
+            self._changed.add(source)
+
+    def add_alias(self, source: str, sha: str, path: str, alias_of: str):
+        """Fichero idéntico a otro ya ingestado: se registra sin chunks propios."""
+        with self._lock:
+            self.files[source] = {"sha256": sha, "path": path, "alias_of": alias_of, "pages": {}}
+            self._changed.add(source)
+
+    def rename(self, old_source: str, new_source: str, path: str):
+        with self._lock:
+            entry = self.files.pop(old_source)
+            entry["path"] = path
+            self.files[new_source] = entry
+            self._changed.update((old_source, new_source))
+            # Copias que apuntaban al nombre antiguo
+            for name, other in self.files.items():
+                if other.get("alias_of") == old_source:
+                    other["alias_of"] = new_source
+                    self._changed.add(name)
+
+    def remove(self, source: str):
+        """Olvida un documento; sus copias idénticas se volverán a ingestar como nuevas."""
+        with self._lock:
+            self.files.pop(source, None)
+            self._changed.add(source)
+            for alias in [name for name, entry in self.files.items() if entry.get("alias_of") == source]:
+                del self.files[alias]
+                self._changed.add(alias)
+
+    def save(self):
+        """Relee-fusiona-escribe bajo cerrojo: las entradas que otro proceso guardó entretanto se conservan."""
+        with self._lock, FileLock(f"{self.path}.lock"):
+            self._merge_from_disk()
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            tmp_path = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"files": self.files}, f, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+            self._disk_stamp = self._stamp()
+            self._changed.clear()
+
+
+class RowHashManifest:
+    """Manifiesto de filas de los CSV de RR.HH.: {chunk_id: hash del chunk (texto + metadata)}.
+
+    `diff` compara las filas actuales con las ya indexadas y devuelve solo
+    las nuevas/modificadas y las eliminadas, para que una re-ingesta toque
+    Chroma únicamente donde hay cambios.
+    """
+
+    def __init__(self, path: str = CSV_MANIFEST_PATH):
+        self.path = path
+        self.rows = {}
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                self.rows = json.load(f).get("rows", {})
+
+    def diff(self, current: dict) -> tuple:
+        """`current` = {chunk_id: hash} -> (ids nuevos o cambiados, ids eliminados)."""
+        changed = [chunk_id for chunk_id, row_hash in current.items() if self.rows.get(chunk_id) != row_hash]
+        removed = [chunk_id for chunk_id in self.rows if chunk_id not in current]
+        return changed, removed
+
+    def update(self, rows: dict, removed=()):
+        self.rows.update(rows)
+        for chunk_id in removed:
+            self.rows.pop(chunk_id, None)
+
+    def save(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"rows": self.rows}, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,200 @@
+import os
+import sys
+import json
+import time
+import argparse
+import requests
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(BASE_DIR)
+DOCS_DIR = os.path.join(BASE_DIR, "docs")
+WATCH_STATUS_PATH = os.path.join(BASE_DIR, "chroma_db", "watch_status.json")
+API_URL = os.getenv("API_URL", "http://localhost:8000")
+
+# Segundos entre escaneos de docs/
+POLL_INTERVAL = 2.0
+# Un fichero se procesa cuando lleva este tiempo sin cambiar (copias a medias, ráfagas)
+DEBOUNCE_SECONDS = 5.0
+# Máximo de ficheros por lote antes de notificar a la API
+MAX_BATCH_FILES = 20
+
+
+def scan_docs(docs_dir: str = DOCS_DIR) -> dict:
+    """{ruta: (mtime_ns, tamaño)} de todos los PDFs de docs/ (subcarpetas de categoría incluidas)."""
+    snapshot = {}
+    for root, _, files in os.walk(docs_dir):
+        for file in files:
+            if file.lower().endswith(".pdf"):
+                path = os.path.join(root, file)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                snapshot[path] = (stat.st_mtime_ns, stat.st_size)
+    return snapshot
+
+
+def read_watch_status(path: str = WATCH_STATUS_PATH) -> dict:
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+class DocsWatcher:
+    """Daemon de ingesta: vigila docs/ por sondeo y aplica los cambios de forma incremental.
+
+    Cada cambio (alta, modificación, borrado) entra en una cola con debounce;
+    cuando un fichero lleva DEBOUNCE_SECONDS estable se pasa por la ruta
+    incremental (`process_pdf` / `remove_document`) y se avisa a la API para
+    que actualice BM25 y el resto de índices solo para esos documentos.
+    """
+
+    def __init__(self, docs_dir: str = DOCS_DIR, api_url: str = API_URL, poll_interval: float = POLL_INTERVAL,
+                 debounce: float = DEBOUNCE_SECONDS, status_path: str = WATCH_STATUS_PATH):
+        self.docs_dir = docs_dir
+        self.api_url = api_url
+        self.poll_interval = poll_interval
+        self.debounce = debounce
+        self.status_path = status_path
+        self.snapshot = {}
+        self.pending = {} # ruta -> {"first_seen": t, "last_change": t}
+        self.totals = {"processed": 0, "removed": 0, "errors": 0, "notify_errors": 0}
+        self.last_batch = None
+
+    def poll(self, now: float = None):
+        """Compara docs/ con el último escaneo y encola lo que ha cambiado."""
+        now = now if now is not None else time.time()
+        current = scan_docs(self.docs_dir)
+        changed = {path for path in current.keys() | self.snapshot.keys() if current.get(path) != self.snapshot.get(path)}
+        for path in changed:
+            entry = self.pending.setdefault(path, {"first_seen": now})
+            entry["last_change"] = now
+        self.snapshot = current
+        return changed
+
+    def ready(self, now: float = None) -> list:
+        now = now if now is not None else time.time()
+        stable = [path for path, entry in self.pending.items() if now - entry["last_change"] >= self.debounce]
+        return sorted(stable, key=lambda path: self.pending[path]["first_seen"])[:MAX_BATCH_FILES]
+
+    def process(self, paths: list):
+        from src.ingestion.ingest_multimodal import process_pdf, remove_document
+        from src.ingestion.manifest import source_lock
+
+        started = time.time()
+        # Documentos que otro proceso está ingestando (p. ej. una subida por /ingest): siguen en cola
+        busy = [path for path in paths if source_lock(os.path.basename(path)).locked()]
+        for path in busy:
+            self.pending[path]["last_change"] = started
+        paths = [path for path in paths if path not in busy]
+        if not paths:
+            return
+        upserted, removed, statuses = [], [], {}
+        # Altas/modificaciones antes que borrados: un renombrado se detecta mientras el original aún figura
+        existing = [path for path in paths if os.path.exists(path)]
+        missing = [path for path in paths if not os.path.exists(path)]
+        for path in existing:
+            details = {}
+            status = process_pdf(path, progress=lambda **fields: details.update(fields))
+            statuses[path] = status
+            if status in ("new", "updated", "legacy", "renamed"):
+                upserted.append(os.path.basename(path))
+            if status == "renamed" and details.get("renamed_from"):
+                # El original puede haberse movido fuera de docs/ o antes de arrancar el daemon
+                removed.append(details["renamed_from"])
+            if status == "error":
+                self.totals["errors"] += 1
+        # Tras un renombrado el nombre antiguo ya no tiene chunks: su borrado no toca nada
+        for path in missing:
+            source = os.path.basename(path)
+            for alias_path in remove_document(source):
+                # Copias idénticas del documento borrado: pasan a ingestarse con su propio nombre
+                if process_pdf(alias_path) in ("new", "updated"):
+                    upserted.append(os.path.basename(alias_path))
+            removed.append(source)
+            statuses[path] = "removed"
+            self.totals["removed"] += 1
+
+        for path in paths:
+            self.pending.pop(path, None)
+        self.totals["processed"] += len(existing)
+        if upserted or removed:
+            self.notify(upserted, list(dict.fromkeys(removed)))
+        self.last_batch = {
+            "files": len(paths),
+            "busy": len(busy),
+            "statuses": {os.path.relpath(path, self.docs_dir): status for path, status in statuses.items()},
+            "seconds": round(time.time() - started, 2),
+            "finished_at": time.time()
+        }
+        for path, status in statuses.items():
+            print(f"   {'🗑️' if status == 'removed' else '📄'} {os.path.relpath(path, self.docs_dir)}: {status}")
+
+    def notify(self, upserted: list, removed: list):
+        """Pide a la API una actualización incremental de sus índices."""
+        try:
+            res = requests.post(f"{self.api_url}/index/refresh",
+                                json={"upserted": upserted, "removed": removed}, timeout=120)
+            res.raise_for_status()
+        except Exception as e:
+            # La API puede no estar levantada: al arrancar construye los índices desde Chroma
+            self.totals["notify_errors"] += 1
+            print(f"⚠️ No se pudo notificar a la API ({self.api_url}): {e}")
+
+    def status(self, now: float = None) -> dict:
+        now = now if now is not None else time.time()
+        oldest = min((entry["first_seen"] for entry in self.pending.values()), default=None)
+        return {
+            "queue_depth": len(self.pending),
+            "lag_seconds": round(now - oldest, 2) if oldest is not None else 0.0,
+            "watched_files": len(self.snapshot),
+            "totals": self.totals,
+            "last_batch": self.last_batch,
+            "updated_at": now
+        }
+
+    def write_status(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.status_path)), exist_ok=True)
+        tmp_path = f"{self.status_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.status(), f, ensure_ascii=False)
+        os.replace(tmp_path, self.status_path)
+
+    def run(self, initial_sync: bool = True):
+        print(f"👀 Vigilando {self.docs_dir} (cada {self.poll_interval}s, debounce {self.debounce}s)...")
+        self.poll()
+        if not initial_sync:
+            # Solo cambios a partir de ahora
+            self.pending.clear()
+        else:
+            # Documentos borrados mientras el daemon estaba parado
+            from src.ingestion.manifest import IngestManifest
+            now = time.time()
+            for entry in IngestManifest().files.values():
+                path = entry.get("path")
+                if path and not os.path.exists(path):
+                    self.pending.setdefault(path, {"first_seen": now, "last_change": now})
+        while True:
+            self.poll()
+            batch = self.ready()
+            if batch:
+                print(f"⚡ Procesando {len(batch)} cambios ({len(self.pending) - len(batch)} en espera)...")
+                self.process(batch)
+            self.write_status()
+            time.sleep(self.poll_interval)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Daemon de ingesta incremental de docs/.")
+    parser.add_argument("--interval", type=float, default=POLL_INTERVAL, help="Segundos entre escaneos.")
+    parser.add_argument("--debounce", type=float, default=DEBOUNCE_SECONDS, help="Segundos de estabilidad antes de procesar.")
+    parser.add_argument("--api-url", default=API_URL, help="API a notificar tras cada lote.")
+    parser.add_argument("--no-initial-sync", action="store_true", help="No sincronizar los PDFs ya presentes al arrancar.")
+    args = parser.parse_args()
+    try:
+        DocsWatcher(api_url=args.api_url, poll_interval=args.interval, debounce=args.debounce).run(
+            initial_sync=not args.no_initial_sync
+        )
+    except KeyboardInterrupt:
+        print("\n👋 Watcher detenido.")
@@ -0,0 +1,104 @@
+import re
+import hashlib
+import unicodedata
+import numpy as np
+
+# Bits del fingerprint SimHash
+SIMHASH_BITS = 64
+# Palabras por shingle
+SHINGLE_SIZE = 3
+# Distancia de Hamming máxima para considerar dos chunks casi duplicados
+DEDUP_MAX_HAMMING = 3
+# Lado del dHash de imágenes (lado x lado bits) y distancia para considerarlas casi idénticas
+DHASH_SIZE = 8
+IMAGE_DEDUP_MAX_HAMMING = 4
+
+# Cabecera que la ingesta antepone a cada chunk (distinta en cada PDF aunque el texto sea igual)
+CHUNK_HEADER_RE = re.compile(r"^CONTEXTO:[^\n]*\n(?:PÁGINA \d+:\n)?")
+WORD_RE = re.compile(r"\w+")
+
+_BIT_WEIGHTS = 1 << np.arange(SIMHASH_BITS, dtype=np.uint64)
+# Firma de un chunk sin palabras (vacío, solo puntuación...): no se compara con nada.
+# Las ingestas anteriores guardaban ceros en ese caso
+EMPTY_SIGNATURE = ""
+LEGACY_EMPTY_SIGNATURE = "0" * (SIMHASH_BITS // 4)
+
+
+def strip_chunk_header(text: str) -> str:
+    return CHUNK_HEADER_RE.sub("", text or "", count=1)
+
+
+def _tokens(text: str) -> list:
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return WORD_RE.findall(text)
+
+
+def simhash(text: str) -> str:
+    """Fingerprint SimHash de 64 bits (hex) sobre shingles de palabras del cuerpo del chunk; "" si no hay palabras."""
+    tokens = _tokens(strip_chunk_header(text))
+    if not tokens:
+        return EMPTY_SIGNATURE
+    shingles = {" ".join(tokens[i:i + SHINGLE_SIZE]) for i in range(max(len(tokens) - SHINGLE_SIZE + 1, 1))}
+    hashes = np.array(
+        [int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=8).digest(), "little") for s in shingles],
+        dtype=np.uint64
+    )
+    # Votos por bit: +1 si el bit está a 1 en el hash del shingle, -1 si no
+    bits = (hashes[:, None] & _BIT_WEIGHTS) != 0
+    votes = bits.sum(axis=0) * 2 - len(hashes)
+    fingerprint = int(_BIT_WEIGHTS[votes > 0].sum())
+    return f"{fingerprint:016x}"
+
+
+def dhash(image_path: str, size: int = DHASH_SIZE) -> str:
+    """Hash perceptual (dHash) de una imagen en hex; None si no se puede leer o falta PIL.
+
+    Compara el brillo de píxeles vecinos de la miniatura en grises: sobrevive
+    a recompresiones, cambios de escala y pequeños retoques.
+    """
+    try:
+        from PIL import Image
+        with Image.open(image_path) as img:
+            img.draft("L", (size * 4, size * 4)) # JPEG: decodifica ya reducida
+            pixels = np.asarray(img.convert("L").resize((size + 1, size), Image.Resampling.LANCZOS), dtype=np.int16)
+    except Exception:
+        return None
+    bits = (pixels[:, 1:] > pixels[:, :-1]).flatten()
+    fingerprint = int("".join("1" if bit else "0" for bit in bits), 2)
+    return f"{fingerprint:0{size * size // 4}x}"
+
+
+def hamming(a: str, b: str) -> int:
+    return bin(int(a, 16) ^ int(b, 16)).count("1")
+
+
+def collapse_near_duplicates(candidates: list, max_distance: int = DEDUP_MAX_HAMMING) -> list:
+    """Colapsa candidatos casi duplicados conservando el de mejor posición.
+
+    Cada superviviente recibe `sources` (todas las fuentes que lo contienen)
+    y `duplicate_ids`. Usa el `simhash` de la metadata si la ingesta lo
+    guardó; si no, lo calcula al vuelo. Los candidatos sin firma (sin
+    palabras) se conservan siempre: no hay texto con el que compararlos.
+    """
+    kept, signatures = [], []
+    for item in candidates:
+        meta = item.get("metadata") or {}
+        signature = meta.get("simhash") or simhash(item.get("document", ""))
+        if signature == LEGACY_EMPTY_SIGNATURE:
+            signature = EMPTY_SIGNATURE
+        survivor = None
+        if signature:
+            survivor = next((k for k, sig in zip(kept, signatures) if sig and hamming(signature, sig) <= max_distance), None)
+        if survivor is not None:
+            source = meta.get("source")
+            if source and source not in survivor["sources"]:
+                survivor["sources"].append(source)
+            survivor["duplicate_ids"].append(item["id"])
+        else:
+            source = meta.get("source")
+            item["sources"] = [source] if source else []
+            item["duplicate_ids"] = []
+            kept.append(item)
+            signatures.append(signature)
+    return kept
@@ -0,0 +1,143 @@
+import re
+import time
+import difflib
+import threading
+from collections import defaultdict
+
+from src.utils.hr_analytics import fold, get_hr_analytics
+
+TOKEN_RE = re.compile(r"[^\W\d_]+(?:\.)?", re.UNICODE)
+
+# Similitud mínima (difflib) para aceptar un nombre mal escrito
+FUZZY_CUTOFF = 0.84
+# Longitud mínima de una palabra para intentar el emparejamiento aproximado
+FUZZY_MIN_LEN = 4
+
+# Palabras que pueden ir en mayúscula en una pregunta y no son nombres
+NON_NAME_WORDS = {
+    "que", "cual", "cuales", "cuantos", "cuantas", "como", "cuando", "donde", "quien", "quienes", "dame", "dime",
+    "muestra", "lista", "busca", "hola", "boe", "rrhh", "empleado", "empleada", "vacaciones", "baja", "bajas",
+    "permiso", "articulo", "ley", "real", "decreto", "estatuto", "convenio", "tiene", "tengo", "puede", "hay"
+}
+
+# Reglas de tipo de consulta (mismo vocabulario que usaba el extractor LLM); las pistas casan a principio de palabra
+QUERY_TYPE_RULES = [
+    ("sick_leave", ("baja", "enferm", "incapacidad", "medic", "accidente", "mutua")),
+    ("vacation", ("vacacion", "permiso", "dias libres", "asuntos propios", "ausencia", "festivo")),
+    ("role", ("puesto", "cargo", "rol", "trabaja como", "salario", "sueldo", "subida", "nomina"))
+]
+QUERY_TYPE_PATTERNS = [(name, re.compile(r"\b(?:" + "|".join(map(re.escape, cues)) + ")")) for name, cues in QUERY_TYPE_RULES]
+
+
+def query_type(question: str) -> str:
+    q = fold(question)
+    for name, pattern in QUERY_TYPE_PATTERNS:
+        if pattern.search(q):
+            return name
+    return "general"
+
+
+class EntityExtractor:
+    """Extractor de empleados por diccionario (gazetteer) construido con los datos de RR.HH.
+
+    Un único regex con todos los alias (nombre completo, nombre de pila,
+    IDs) busca en la pregunta sin tildes en una sola pasada; los nombres de
+    pila solo cuentan si van en mayúscula. Las palabras en mayúscula que no
+    casan se comparan con difflib para tolerar erratas ("Adrain Garcia").
+    El diccionario se reconstruye si cambian los CSV.
+    """
+
+    def __init__(self, analytics=None):
+        self.analytics = analytics or get_hr_analytics()
+        self._lock = threading.Lock()
+        self._signature = None
+        self.employees = {} # nombre canónico -> {"name", "ids"}
+        self.aliases = {} # alias sin tildes -> (tipo, [nombres canónicos])
+        self.pattern = None
+
+    def _build(self):
+        employees = defaultdict(set)
+        for emp_id, name in self.analytics.employee_directory():
+            if name:
+                employees[name].add(str(emp_id))
+        first_names = defaultdict(list)
+        aliases = {}
+        for name, ids in employees.items():
+            aliases[fold(name)] = ("name", [name])
+            for emp_id in ids:
+                aliases[fold(emp_id)] = ("id", [name])
+            first = fold(name.split()[0])
+            if len(first) >= 3 and not first.endswith(".") and first not in NON_NAME_WORDS:
+                first_names[first].append(name)
+        for first, names in first_names.items():
+            aliases.setdefault(first, ("first_name", names))
+        # Alias más largos primero: "lola flores" gana a "lola"
+        alternation = "|".join(re.escape(alias) for alias in sorted(aliases, key=len, reverse=True))
+        self.pattern = re.compile(rf"(?<![\w.])(?:{alternation})(?![\w])") if aliases else None
+        self.employees = {name: {"name": name, "ids": sorted(ids)} for name, ids in employees.items()}
+        self.aliases = aliases
+
+    def ensure_built(self):
+        self.analytics.ensure_loaded()
+        with self._lock:
+            if self._signature != self.analytics._signature:
+                self._build()
+                self._signature = self.analytics._signature
+
+    def _entity(self, name: str, matched: str, method: str, score: float = 1.0) -> dict:
+        employee = self.employees[name]
+        return {"name": name, "ids": employee["ids"], "matched": matched, "method": method, "score": round(score, 3)}
+
+    def extract(self, question: str) -> dict:
+        """{"employees": [...], "type": vacation|sick_leave|role|general, "elapsed_us"}."""
+        started = time.perf_counter()
+        self.ensure_built()
+        folded = fold(question)
+        # fold() conserva la longitud en textos en español (NFKD + quitar tildes), así los offsets sirven para el original
+        same_offsets = len(folded) == len(question)
+        found, covered = {}, []
+        for match in self.pattern.finditer(folded) if self.pattern else []:
+            method, names = self.aliases[match.group(0)]
+            surface = question[match.start():match.end()] if same_offsets else match.group(0)
+            if method == "first_name" and same_offsets and not surface[:1].isupper():
+                continue
+            covered.append((match.start(), match.end()))
+            for name in names:
+                found.setdefault(name, self._entity(name, surface, method if len(names) == 1 else "first_name_ambiguous"))
+
+        # Erratas: palabras en mayúscula (o pares de palabras) sin casar, contra nombres completos y de pila
+        if same_offsets:
+            tokens = [m for m in TOKEN_RE.finditer(question)
+                      if not any(start <= m.start() < end for start, end in covered)]
+            vocabulary = [alias for alias, (method, _) in self.aliases.items() if method != "id"]
+            for i, token in enumerate(tokens):
+                word = fold(token.group(0))
+                if not token.group(0)[:1].isupper() or len(word) < FUZZY_MIN_LEN or word in NON_NAME_WORDS:
+                    continue
+                candidates = [word]
+                if i + 1 < len(tokens):
+                    candidates.insert(0, f"{word} {fold(tokens[i + 1].group(0))}")
+                for candidate in candidates:
+                    close = difflib.get_close_matches(candidate, vocabulary, n=1, cutoff=FUZZY_CUTOFF)
+                    if close:
+                        score = difflib.SequenceMatcher(None, candidate, close[0]).ratio()
+                        _, names = self.aliases[close[0]]
+                        for name in names:
+                            found.setdefault(name, self._entity(name, candidate, "fuzzy", score))
+                        break
+
+        return {
+            "employees": list(found.values()),
+            "type": query_type(question),
+            "elapsed_us": round((time.perf_counter() - started) * 1e6, 1)
+        }
+
+
+_extractor = None
+
+
+def get_entity_extractor() -> EntityExtractor:
+    global _extractor
+    if _extractor is None:
+        _extractor = EntityExtractor()
+    return _extractor
@@ -0,0 +1,452 @@
+import os
+import re
+import time
+import sqlite3
+import threading
+import unicodedata
+import pandas as pd
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+FILE_VACATIONS = os.path.join(BASE_DIR, "data", "Tabla Dinámica de VACACIONES.csv")
+FILE_SICK_LEAVE = os.path.join(BASE_DIR, "data", "Tabla de Bajas Médicas.csv")
+FILE_EMPLOYEES = os.path.join(BASE_DIR, "data", "employees.csv")
+
+# Filas máximas que se devuelven al generador (los agregados se calculan sobre todas)
+MAX_RESULT_ROWS = 50
+
+MONTHS = {
+    "enero": 1, "febrero": 2, "marzo": 3, "abril": 4, "mayo": 5, "junio": 6, "julio": 7,
+    "agosto": 8, "septiembre": 9, "setiembre": 9, "octubre": 10, "noviembre": 11, "diciembre": 12
+}
+COST_RE = re.compile(r"-?\d[\d.,]*")
+COST_NOTE_RE = re.compile(r"\(([^)]*)\)")
+YEAR_RE = re.compile(r"\b(20\d{2})\b")
+
+# Tablas en SQL: columnas tipadas (fechas ISO, días enteros, coste en euros)
+SCHEMA = """
+CREATE TABLE vacaciones (
+    id_empleado TEXT, nombre_empleado TEXT, departamento TEXT, tipo_contrato TEXT, tipo_permiso TEXT,
+    fecha_inicio DATE, fecha_fin DATE, dias_solicitados INTEGER, estado TEXT
+);
+CREATE TABLE bajas (
+    id_baja TEXT PRIMARY KEY, id_empleado TEXT, nombre_empleado TEXT, tipo_baja TEXT, motivo TEXT,
+    fecha_inicio DATE, fecha_alta DATE, dias_totales INTEGER, coste_eur REAL, coste_nota TEXT
+);
+CREATE TABLE empleados (
+    id TEXT PRIMARY KEY, nombre TEXT, puesto TEXT, vacaciones_restantes INTEGER, dias_baja INTEGER, ultima_subida DATE
+);
+-- Departamento de cada empleado (solo figura en vacaciones): permite agrupar bajas por departamento
+CREATE VIEW departamentos AS
+    SELECT id_empleado, MAX(departamento) AS departamento FROM vacaciones GROUP BY id_empleado;
+CREATE INDEX idx_vac_fecha ON vacaciones(fecha_inicio);
+CREATE INDEX idx_bajas_fecha ON bajas(fecha_inicio);
+"""
+
+# Plantillas de consulta por tabla. Todo el SQL sale de estos fragmentos fijos;
+# los valores de la pregunta (fechas, tipo, departamento...) van siempre como parámetros.
+QUERY_TEMPLATES = {
+    "bajas": {
+        "from": "bajas b LEFT JOIN departamentos d ON d.id_empleado = b.id_empleado",
+        "date": "b.fecha_inicio",
+        "metrics": {
+            "count": ("COUNT(*)", "nº de bajas"),
+            "days": ("SUM(b.dias_totales)", "días de baja"),
+            "avg_days": ("ROUND(AVG(b.dias_totales), 1)", "media de días por baja"),
+            "cost": ("ROUND(SUM(b.coste_eur), 2)", "coste estimado (€)"),
+            "avg_cost": ("ROUND(AVG(b.coste_eur), 2)", "coste medio por baja (€)")
+        },
+        "groups": {
+            "departamento": "COALESCE(d.departamento, 'Sin departamento')",
+            "tipo": "b.tipo_baja",
+            "mes": "strftime('%Y-%m', b.fecha_inicio)",
+            "empleado": "b.nombre_empleado"
+        },
+        "filters": {
+            "tipo": "b.tipo_baja = :tipo",
+            "departamento": "(d.departamento = :departamento OR d.departamento LIKE :departamento || ' - %')",
+            "empleado": "(b.id_empleado = :empleado OR b.nombre_empleado = :empleado)"
+        }
+    },
+    "vacaciones": {
+        "from": "vacaciones v",
+        "date": "v.fecha_inicio",
+        "metrics": {
+            "count": ("COUNT(*)", "nº de solicitudes"),
+            "days": ("SUM(v.dias_solicitados)", "días solicitados"),
+            "avg_days": ("ROUND(AVG(v.dias_solicitados), 1)", "media de días por solicitud")
+        },
+        "groups": {
+            "departamento": "v.departamento",
+            "tipo": "v.tipo_permiso",
+            "estado": "v.estado",
+            "contrato": "v.tipo_contrato",
+            "mes": "strftime('%Y-%m', v.fecha_inicio)",
+            "empleado": "v.nombre_empleado"
+        },
+        "filters": {
+            "tipo": "v.tipo_permiso = :tipo",
+            "estado": "v.estado = :estado",
+            "departamento": "(v.departamento = :departamento OR v.departamento LIKE :departamento || ' - %')",
+            "empleado": "(v.id_empleado = :empleado OR v.nombre_empleado = :empleado)"
+        }
+    }
+}
+
+# Pistas de la pregunta -> tabla, métrica y agrupación (las de tabla casan a principio de palabra: "baja" no casa con "trabajadores")
+TABLE_CUES = {"bajas": ("baja",), "vacaciones": ("vacacion", "permiso", "solicitud", "ausencia")}
+TABLE_PATTERNS = {table: re.compile(r"\b(?:" + "|".join(map(re.escape, cues)) + ")") for table, cues in TABLE_CUES.items()}
+# Preguntas que piden razonar, comparar o normativa ("¿cuántos días de permiso por matrimonio establece el Estatuto?"):
+# no son agregados de los registros ni fichas de empleado, siempre van al LLM
+REASONING_CUES = ("por que", "explica", "compara", "deberia", "podria", "puede", "ley", "convenio", "estatuto",
+                  "derecho", "normativa", "articulo", "boe", "y si", "recomienda", "establece", "corresponde",
+                  "reconoce", "regula", "legal", "real decreto", "permite", "preve")
+REASONING_PATTERN = re.compile(r"\b(?:" + "|".join(map(re.escape, REASONING_CUES)) + ")")
+# Terminaciones de género y número que se toleran al buscar un valor ("aprobadas" -> "Aprobado")
+VALUE_SUFFIX_RE = re.compile(r"(?:os|as|es|o|a|e|s)$")
+AGGREGATE_CUES = ("cuantos", "cuantas", "total", "suma", "numero de", "cantidad", "media", "medio", "promedio", "coste", "cuesta", "gasto")
+AVERAGE_RE = re.compile(r"\b(?:media|medio|promedio)\b")
+# Palabras sin contenido propio en una pregunta agregada (interrogativos, artículos, verbos de relleno, métricas,
+# agrupaciones). Cualquier otra palabra tiene que casar con un filtro, una fecha o un empleado: si no
+# ("por gripe", "en verano", "de más de 10 días", "están de baja"), el SQL no la aplica y la pregunta va al LLM
+NEUTRAL_WORDS = {
+    "que", "cual", "cuales", "cuanto", "cuanta", "cuantos", "cuantas", "como", "el", "la", "los", "las", "lo", "un", "una",
+    "unos", "unas", "de", "del", "a", "al", "en", "por", "para", "con", "y", "e", "o", "se", "le", "les", "su", "sus",
+    "hay", "hubo", "ha", "han", "habido", "fue", "fueron", "es", "son", "tiene", "tienen", "tuvo", "tuvieron",
+    "dame", "dime", "muestra", "muestrame", "calcula", "indica", "lista", "quiero", "saber", "me", "nos",
+    "total", "totales", "suma", "numero", "cantidad", "media", "medio", "promedio", "coste", "costes", "costo",
+    "cuesta", "cuestan", "costaron", "gasto", "gastos", "estimado", "euros", "dia", "dias", "registro", "registros",
+    "medica", "medicas", "medico", "medicos", "solicitado", "solicitados", "solicitada", "solicitadas", "pedido",
+    "pedidos", "empleado", "empleados", "empleada", "empleadas", "trabajador", "trabajadores", "plantilla", "empresa",
+    "cada", "area", "areas", "departamento", "departamentos", "tipo", "tipos", "motivo", "estado", "estados",
+    "contrato", "contratos", "mes", "meses", "mensual", "ano", "persona", "personas", "desglose"
+}
+# Consultas de saldo de un empleado (no son agregados del histórico)
+BALANCE_CUES = ("quedan", "restantes", "disponibles", "le sobran")
+GROUP_CUES = {
+    "departamento": ("por departamento", "cada departamento", "por area"),
+    "tipo": ("por tipo", "cada tipo", "por motivo"),
+    "estado": ("por estado",),
+    "contrato": ("por contrato", "por tipo de contrato"),
+    "mes": ("por mes", "cada mes", "mensual"),
+    "empleado": ("por empleado", "cada empleado", "por persona")
+}
+
+
+def fold(text: str) -> str:
+    """Minúsculas sin tildes (para comparar la pregunta con los valores de las tablas)."""
+    text = unicodedata.normalize("NFKD", str(text).lower())
+    return "".join(c for c in text if not unicodedata.combining(c))
+
+
+def parse_cost(value) -> tuple:
+    """'0.00 (Mutua)' -> (0.0, 'Mutua'); '1.234,50' -> (1234.5, None); vacío -> (None, None)."""
+    if value is None or (isinstance(value, float) and pd.isna(value)):
+        return None, None
+    text = str(value)
+    note = COST_NOTE_RE.search(text)
+    number = COST_RE.search(text)
+    if not number:
+        return None, note.group(1).strip() if note else None
+    raw = number.group(0)
+    if "," in raw and "." in raw:
+        # El último separador es el decimal
+        raw = raw.replace(".", "").replace(",", ".") if raw.rfind(",") > raw.rfind(".") else raw.replace(",", "")
+    elif "," in raw:
+        raw = raw.replace(",", ".")
+    try:
+        amount = float(raw)
+    except ValueError:
+        amount = None
+    return amount, note.group(1).strip() if note else None
+
+
+def _iso_dates(series: pd.Series) -> pd.Series:
+    return pd.to_datetime(series, errors="coerce").dt.strftime("%Y-%m-%d")
+
+
+class HRAnalytics:
+    """Motor SQL en memoria (SQLite) sobre los CSV de RR.HH.
+
+    `match(pregunta)` traduce preguntas agregadas ("¿cuántos días de baja
+    profesional hubo en febrero?", "coste de bajas por departamento") a una
+    plantilla de QUERY_TEMPLATES con sus parámetros; `run(plan)` la ejecuta.
+    Las tablas se recargan solas si cambia algún CSV.
+    """
+
+    def __init__(self, files: dict = None):
+        self.files = files or {"vacaciones": FILE_VACATIONS, "bajas": FILE_SICK_LEAVE, "empleados": FILE_EMPLOYEES}
+        self._lock = threading.Lock()
+        self._conn = None
+        self._signature = None
+        self.values = {} # valores distintos por (tabla, columna), para reconocerlos en la pregunta
+
+    def _file_signature(self):
+        return tuple(os.path.getmtime(path) if os.path.exists(path) else None for path in self.files.values())
+
+    def _load(self):
+        conn = sqlite3.connect(":memory:", check_same_thread=False)
+        conn.executescript(SCHEMA)
+        if os.path.exists(self.files["vacaciones"]):
+            df = pd.read_csv(self.files["vacaciones"])
+            pd.DataFrame({
+                "id_empleado": df["ID_Empleado"].astype(str), "nombre_empleado": df["Nombre_Empleado"],
+                "departamento": df["Departamento"], "tipo_contrato": df["Tipo_Contrato"], "tipo_permiso": df["Tipo_Permiso"],
+                "fecha_inicio": _iso_dates(df["Fecha_Inicio"]), "fecha_fin": _iso_dates(df["Fecha_Fin"]),
+                "dias_solicitados": pd.to_numeric(df["Días_Solicitados"], errors="coerce"), "estado": df["Estado"]
+            }).to_sql("vacaciones", conn, if_exists="append", index=False)
+        if os.path.exists(self.files["bajas"]):
+            df = pd.read_csv(self.files["bajas"], dtype={"Coste_Empresa_Est": str})
+            costs = [parse_cost(value) for value in df["Coste_Empresa_Est"]]
+            pd.DataFrame({
+                "id_baja": df["ID_Baja"].astype(str), "id_empleado": df["ID_Empleado"].astype(str),
+                "nombre_empleado": df["Nombre_Empleado"], "tipo_baja": df["Tipo_Baja"], "motivo": df["Motivo_Detallado"],
+                "fecha_inicio": _iso_dates(df["Fecha_Inicio"]), "fecha_alta": _iso_dates(df["Fecha_Alta"]),
+                "dias_totales": pd.to_numeric(df["Dias_Totales"], errors="coerce"),
+                "coste_eur": [amount for amount, _ in costs], "coste_nota": [note for _, note in costs]
+            }).drop_duplicates("id_baja", keep="last").to_sql("bajas", conn, if_exists="append", index=False)
+        if os.path.exists(self.files["empleados"]):
+            df = pd.read_csv(self.files["empleados"])
+            pd.DataFrame({
+                "id": df["id"].astype(str), "nombre": df["name"], "puesto": df["role"],
+                "vacaciones_restantes": pd.to_numeric(df["vacation_days_left"], errors="coerce"),
+                "dias_baja": pd.to_numeric(df["sick_leave_days"], errors="coerce"),
+                "ultima_subida": _iso_dates(df["last_pay_raise"])
+            }).drop_duplicates("id", keep="last").to_sql("empleados", conn, if_exists="append", index=False)
+
+        values = {}
+        for table, column in [("bajas", "tipo_baja"), ("vacaciones", "tipo_permiso"), ("vacaciones", "estado"),
+                              ("vacaciones", "departamento"), ("vacaciones", "id_empleado"), ("vacaciones", "nombre_empleado"),
+                              ("bajas", "id_empleado"), ("bajas", "nombre_empleado")]:
+            values[(table, column)] = [row[0] for row in conn.execute(f"SELECT DISTINCT {column} FROM {table} WHERE {column} IS NOT NULL")]
+        return conn, values
+
+    def ensure_loaded(self):
+        signature = self._file_signature()
+        with self._lock:
+            if self._conn is None or signature != self._signature:
+                conn, values = self._load()
+                if self._conn is not None:
+                    self._conn.close()
+                self._conn, self.values, self._signature = conn, values, signature
+
+    # --- Pregunta -> plantilla ---
+
+    @staticmethod
+    def _value_regex(value: str) -> str:
+        """Regex de un valor tolerando género y número en cada palabra ("Aprobado" casa con "aprobadas")."""
+        words = []
+        for word in fold(value).split():
+            stem = VALUE_SUFFIX_RE.sub("", word) if len(word) > 4 else word
+            words.append(re.escape(stem) + r"(?:o|a|os|as|e|es|s)?")
+        return r"\b" + r"\s+".join(words) + r"\b"
+
+    def _find_value(self, folded_question: str, candidates: list, min_part: int = 6) -> str:
+        """Valor de la tabla citado en la pregunta: nombre completo o una parte distintiva ("Sonómetros").
+
+        Un área compartida por varios valores ("IT" en "IT - Datos", "IT - Tráfico"...)
+        se devuelve tal cual y el filtro SQL la trata como prefijo.
+        """
+        for value in sorted(candidates, key=lambda v: -len(str(v))):
+            if re.search(self._value_regex(value), folded_question):
+                return value
+        for value in candidates:
+            parts = re.split(r"\s+-\s+|/", str(value))
+            for i, part in enumerate(parts):
+                # El área ("IT - ...") vale aunque sea corta; el resto de partes solo si son distintivas
+                area = i == 0 and " - " in str(value)
+                if (area or len(part) >= min_part) and re.search(self._value_regex(part), folded_question):
+                    if area and sum(str(other).startswith(f"{part} - ") for other in candidates) > 1:
+                        return part
+                    return value
+        return None
+
+    def _leftover_words(self, question: str, filters: dict, employees: list) -> list:
+        """Palabras de la pregunta que ninguna pista, filtro, fecha o empleado explica.
+
+        Responder el total global a "¿cuántas bajas por gripe hubo?" sería un
+        dato falso: `match` solo acepta la pregunta si esta lista queda vacía.
+        """
+        q = fold(question)
+        consumed = []
+        for name in ("tipo", "estado", "departamento"):
+            if name in filters:
+                # El valor completo o la parte citada ("Sonómetros" de "IT - Sonómetros")
+                for part in [filters[name], *re.split(r"\s+-\s+|/", str(filters[name]))]:
+                    consumed += [m.span() for m in re.finditer(self._value_regex(part), q)]
+        for employee in employees:
+            for alias in [employee["matched"], employee["name"], *employee["ids"]]:
+                consumed += [m.span() for m in re.finditer(r"\b" + re.escape(fold(alias)) + r"\b", q)]
+        table_stems = tuple(cue for cues in TABLE_CUES.values() for cue in cues)
+        leftover = []
+        for match in re.finditer(r"[^\W_]+", q):
+            word = match.group(0)
+            if any(start <= match.start() < end for start, end in consumed):
+                continue
+            if word in NEUTRAL_WORDS or word in MONTHS or word.startswith(table_stems) or word == filters.get("anio"):
+                continue
+            leftover.append(word)
+        return leftover
+
+    def match(self, question: str) -> dict:
+        """Plan de consulta o None si la pregunta no es un agregado o el plan no la cubre entera."""
+        plan = self.plan(question)
+        return plan if plan and not plan["leftover"] else None
+
+    def plan(self, question: str) -> dict:
+        """Plan {"table", "metric", "group", "filters", "leftover"} o None si la pregunta no es un agregado.
+
+        `leftover` son las palabras que el plan no aplica ("gripe", "verano",
+        "más de 10 días"...); con alguna, la cifra no responde la pregunta.
+        """
+        q = fold(question)
+        if any(cue in q for cue in BALANCE_CUES) or REASONING_PATTERN.search(q):
+            return None
+        tables = [table for table, pattern in TABLE_PATTERNS.items() if pattern.search(q)]
+        if len(tables) != 1:
+            return None
+        table = tables[0]
+        template = QUERY_TEMPLATES[table]
+
+        group = next((name for name, cues in GROUP_CUES.items() if name in template["groups"] and any(cue in q for cue in cues)), None)
+        if not group and not any(cue in q for cue in AGGREGATE_CUES):
+            return None
+
+        average = bool(AVERAGE_RE.search(q))
+        if any(cue in q for cue in ("coste", "cuesta", "gasto")) and "cost" in template["metrics"]:
+            metric = "avg_cost" if average else "cost"
+        elif "dias" in q:
+            metric = "avg_days" if average else "days"
+        else:
+            metric = "count"
+
+        self.ensure_loaded()
+        filters = {}
+        month = next((number for name, number in MONTHS.items() if re.search(rf"\b{name}\b", q)), None)
+        if month:
+            filters["mes"] = f"{month:02d}"
+        year = YEAR_RE.search(q)
+        if year:
+            filters["anio"] = year.group(1)
+        tipo_column = "tipo_baja" if table == "bajas" else "tipo_permiso"
+        tipo = self._find_value(q, self.values.get((table, tipo_column), []), min_part=4)
+        if tipo and fold(tipo) not in ("vacaciones",) and group != "tipo":
+            filters["tipo"] = tipo
+        if table == "vacaciones":
+            estado = self._find_value(q, self.values.get(("vacaciones", "estado"), []))
+            if estado and group != "estado":
+                filters["estado"] = estado
+        departamento = self._find_value(q, self.values.get(("vacaciones", "departamento"), []))
+        if departamento and group != "departamento":
+            filters["departamento"] = departamento
+        # Empleado: extractor compartido (IDs, nombres, nombres de pila y erratas)
+        from src.utils.entity_extractor import get_entity_extractor
+        employees = get_entity_extractor().extract(question)["employees"]
+        if len({employee["name"] for employee in employees}) > 1:
+            # Varios empleados (o un nombre de pila compartido): un solo filtro no los representa
+            return None
+        if employees:
+            filters["empleado"] = employees[0]["name"]
+        return {"table": table, "metric": metric, "group": group, "filters": filters,
+                "leftover": self._leftover_words(question, filters, employees)}
+
+    def build_sql(self, plan: dict) -> tuple:
+        """Plan -> (sql, parámetros) a partir de los fragmentos de QUERY_TEMPLATES."""
+        template = QUERY_TEMPLATES[plan["table"]]
+        metric_sql, _ = template["metrics"][plan["metric"]]
+        group_sql = template["groups"][plan["group"]] if plan.get("group") else None
+        where, params = [], {}
+        for name, value in plan["filters"].items():
+            if name == "mes":
+                where.append(f"strftime('%m', {template['date']}) = :mes")
+            elif name == "anio":
+                where.append(f"strftime('%Y', {template['date']}) = :anio")
+            else:
+                where.append(template["filters"][name])
+            params[name] = value
+        sql = f"SELECT {group_sql + ' AS grupo, ' if group_sql else ''}{metric_sql} AS valor FROM {template['from']}"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        if group_sql:
+            sql += f" GROUP BY grupo ORDER BY {'grupo' if plan['group'] == 'mes' else 'valor DESC'}"
+        return sql, params
+
+    def run(self, plan: dict) -> dict:
+        self.ensure_loaded()
+        sql, params = self.build_sql(plan)
+        started = time.perf_counter()
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        label = QUERY_TEMPLATES[plan["table"]]["metrics"][plan["metric"]][1]
+        result = {
+            **plan,
+            "label": label,
+            "sql": sql,
+            "params": params,
+            "rows": [list(row) for row in rows[:MAX_RESULT_ROWS]],
+            "truncated": len(rows) > MAX_RESULT_ROWS,
+            "elapsed_ms": round(elapsed_ms, 2)
+        }
+        result["text"] = format_result(result)
+        return result
+
+    def employee_directory(self) -> list:
+        """[(id, nombre)] de empleados en las tres tablas (para el extractor de entidades)."""
+        self.ensure_loaded()
+        with self._lock:
+            return self._conn.execute(
+                "SELECT id_empleado, nombre_empleado FROM vacaciones UNION "
+                "SELECT id_empleado, nombre_empleado FROM bajas UNION SELECT id, nombre FROM empleados"
+            ).fetchall()
+
+    def employee_record(self, name: str) -> dict:
+        """Ficha de employees.csv del empleado (nombre canónico o ID) o None."""
+        self.ensure_loaded()
+        with self._lock:
+            cursor = self._conn.execute("SELECT * FROM empleados WHERE nombre = ? OR id = ? LIMIT 1", (name, name))
+            row = cursor.fetchone()
+            columns = [column[0] for column in cursor.description]
+        return dict(zip(columns, row)) if row else None
+
+    def answer(self, question: str, partial: bool = False) -> dict:
+        """Resultado del plan de la pregunta; con `partial` también si no la cubre entera (lleva `leftover`)."""
+        plan = self.plan(question) if partial else self.match(question)
+        return self.run(plan) if plan else None
+
+
+def _fmt(value) -> str:
+    if value is None:
+        return "0"
+    if isinstance(value, float):
+        return f"{value:,.2f}".replace(",", "X").replace(".", ",").replace("X", ".")
+    return str(value)
+
+
+def format_result(result: dict) -> str:
+    """Texto para el contexto del generador: cifra(s) exactas + filtros aplicados."""
+    filters = ", ".join(f"{name}={value}" for name, value in result["filters"].items()) or "sin filtros"
+    date_note = " (por fecha de inicio)" if "mes" in result["filters"] or "anio" in result["filters"] or result.get("group") == "mes" else ""
+    header = f"📊 {result['label'].upper()} [{result['table']}; {filters}]{date_note}"
+    note = ""
+    if result.get("leftover"):
+        note = (f"\n⚠️ Cálculo parcial: la pregunta menciona «{' '.join(result['leftover'])}», "
+                "que no se ha aplicado como filtro; la cifra no incluye ese criterio.")
+    if not result.get("group"):
+        return f"{header}: {_fmt(result['rows'][0][0] if result['rows'] else None)}{note}"
+    lines = [f"{header} POR {result['group'].upper()}:"]
+    lines += [f"   - {group}: {_fmt(value)}" for group, value in result["rows"]]
+    if result["truncated"]:
+        lines.append(f"   (mostrando {MAX_RESULT_ROWS} grupos)")
+    if not result["rows"]:
+        lines.append("   (sin registros)")
+    return "\n".join(lines) + note
+
+
+_analytics = None
+
+
+def get_hr_analytics() -> HRAnalytics:
+    global _analytics
+    if _analytics is None:
+        _analytics = HRAnalytics()
+    return _analytics
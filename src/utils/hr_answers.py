@@ -0,0 +1,175 @@
+import re
+import time
+
+from src.utils.hr_analytics import BALANCE_CUES, MAX_RESULT_ROWS, REASONING_PATTERN, _fmt, fold, get_hr_analytics
+
+# Intenciones con respuesta directa desde la ficha del empleado: pistas de la pregunta
+INTENT_CUES = {
+    "vacation_balance": BALANCE_CUES + ("pendientes", "le faltan por disfrutar"),
+    "role": ("puesto", "cargo", "rol", "trabaja como", "a que se dedica"),
+    "pay_raise": ("subida", "aumento de sueldo", "aumento salarial", "revision salarial")
+}
+# Las pistas casan a principio de palabra ("rol" no casa con "control"); las de razonamiento/normativa
+# (REASONING_PATTERN) son las mismas que excluyen una pregunta del motor SQL
+INTENT_PATTERNS = {intent: re.compile(r"\b(?:" + "|".join(map(re.escape, cues)) + ")") for intent, cues in INTENT_CUES.items()}
+
+# Plantillas por estilo (mismos estilos que el prompt del generador); "Formal" es la de reserva
+TEMPLATES = {
+    "vacation_balance": {
+        "Formal": "Según el registro de RR.HH., a {nombre} (ID {id}) le quedan {vacaciones_restantes} días de vacaciones disponibles.",
+        "Cercano": "¡Buenas noticias! A {nombre} todavía le quedan {vacaciones_restantes} días de vacaciones por disfrutar. 🏖️",
+        "Directo": "- {nombre} ({id}): {vacaciones_restantes} días de vacaciones restantes.",
+        "Didáctico": "Los días restantes son los que {nombre} aún no ha disfrutado este periodo: según su ficha de RR.HH. (ID {id}), son {vacaciones_restantes} días.",
+        "Legal": "Conforme a los datos obrantes en el registro de personal, el/la empleado/a {nombre} (ID {id}) dispone de un saldo de {vacaciones_restantes} días de vacaciones pendientes de disfrute."
+    },
+    "role": {
+        "Formal": "{nombre} (ID {id}) ocupa el puesto de {puesto}.",
+        "Cercano": "{nombre} trabaja como {puesto}. 😊",
+        "Directo": "- {nombre} ({id}): {puesto}.",
+        "Didáctico": "El puesto es la función que una persona desempeña en la empresa: en el caso de {nombre} (ID {id}), es {puesto}.",
+        "Legal": "Según el registro de personal, el/la empleado/a {nombre} (ID {id}) tiene asignado el puesto de {puesto}."
+    },
+    "pay_raise": {
+        "Formal": "La última subida salarial de {nombre} (ID {id}) se registró el {ultima_subida}.",
+        "Cercano": "A {nombre} le subieron el sueldo por última vez el {ultima_subida}. 💶",
+        "Directo": "- {nombre} ({id}): última subida salarial el {ultima_subida}.",
+        "Didáctico": "La fecha de la última subida salarial indica cuándo se revisó el sueldo por última vez: para {nombre} (ID {id}) fue el {ultima_subida}.",
+        "Legal": "Consta en el registro de personal que la última revisión salarial del/de la empleado/a {nombre} (ID {id}) tuvo efectos el {ultima_subida}."
+    },
+    "aggregate": {
+        "Formal": "Según los registros de RR.HH. ({filtros}) — {etiqueta}: {valor}.",
+        "Cercano": "He mirado los registros de RR.HH. ({filtros}) y este es el dato 👍 {etiqueta}: {valor}.",
+        "Directo": "- {etiqueta_mayus} ({filtros}): {valor}.",
+        "Didáctico": "He calculado el dato sobre todos los registros de RR.HH. que cumplen las condiciones ({filtros}) — {etiqueta}: {valor}.",
+        "Legal": "De conformidad con los registros de personal ({filtros}), resulta lo siguiente — {etiqueta}: {valor}."
+    },
+    "aggregate_grouped": {
+        "Formal": "Según los registros de RR.HH. ({filtros}) — {etiqueta} por {grupo}:",
+        "Cercano": "Aquí tienes el desglose por {grupo} ({filtros}) — {etiqueta}:",
+        "Directo": "{etiqueta_mayus} por {grupo} ({filtros}):",
+        "Didáctico": "He agrupado los registros de RR.HH. por {grupo} ({filtros}); para cada grupo — {etiqueta}:",
+        "Legal": "De conformidad con los registros de personal ({filtros}), desglose por {grupo} — {etiqueta}:"
+    }
+}
+
+
+def _date(value) -> str:
+    """'2023-12-01' -> '01/12/2023'."""
+    if not value:
+        return "(sin fecha)"
+    parts = str(value).split("-")
+    return "/".join(reversed(parts)) if len(parts) == 3 else str(value)
+
+
+def needs_reasoning(question: str) -> bool:
+    """True si la pregunta pide razonar, comparar o normativa: ni ficha ni agregado se responden por plantilla."""
+    return bool(REASONING_PATTERN.search(fold(question)))
+
+
+def uncovered_words(structured: dict) -> list:
+    """Palabras de la pregunta que el resultado estructurado no aplica (solo los agregados SQL pueden ser parciales)."""
+    if structured.get("intent") == "aggregate":
+        return list(structured["result"].get("leftover") or [])
+    return []
+
+
+def use_template(structured: dict, question: str) -> bool:
+    """True si el resultado responde la pregunta entera y sin razonamiento: solo entonces se redacta sin LLM."""
+    return bool(structured) and not needs_reasoning(question) and not uncovered_words(structured)
+
+
+def match_intent(question: str) -> str:
+    """Intención de ficha de empleado (vacation_balance, role, pay_raise) o None si no es inequívoca."""
+    if needs_reasoning(question):
+        return None
+    q = fold(question)
+    intents = [intent for intent, pattern in INTENT_PATTERNS.items() if pattern.search(q)]
+    return intents[0] if len(intents) == 1 else None
+
+
+class HRAnswers:
+    """Respuestas sin LLM para consultas de RR.HH. con resultado estructurado.
+
+    `match` decide si la pregunta es una consulta de ficha de un único
+    empleado (saldo de vacaciones, puesto, última subida) con intención
+    inequívoca; `lookup` devuelve el resultado estructurado y `render` lo
+    redacta con la plantilla del estilo pedido. Los agregados del motor SQL
+    (`HRAnalytics.run`) se redactan igual. Todo lo demás va al generador.
+    """
+
+    def __init__(self, analytics=None, extractor=None):
+        self.analytics = analytics or get_hr_analytics()
+        self._extractor = extractor
+
+    @property
+    def extractor(self):
+        if self._extractor is None:
+            from src.utils.entity_extractor import get_entity_extractor
+            self._extractor = get_entity_extractor()
+        return self._extractor
+
+    def match(self, question: str) -> dict:
+        """{"intent", "employee"} si la pregunta tiene respuesta directa, si no None."""
+        intent = match_intent(question)
+        if not intent:
+            return None
+        employees = self.extractor.extract(question)["employees"]
+        if len(employees) != 1 or employees[0]["method"] == "first_name_ambiguous":
+            return None
+        return {"intent": intent, "employee": employees[0]["name"]}
+
+    def lookup(self, plan: dict) -> dict:
+        """Resultado estructurado {"intent", "record", "elapsed_ms"} o None si el empleado no tiene ficha."""
+        started = time.perf_counter()
+        record = self.analytics.employee_record(plan["employee"])
+        if not record:
+            return None
+        return {"intent": plan["intent"], "record": record, "elapsed_ms": round((time.perf_counter() - started) * 1000, 2)}
+
+    def answer(self, question: str) -> dict:
+        plan = self.match(question)
+        return self.lookup(plan) if plan else None
+
+
+def _aggregate_fields(result: dict) -> dict:
+    filters = ", ".join(f"{name}: {value}" for name, value in result["filters"].items()) or "todos los registros"
+    label = result["label"]
+    return {"filtros": filters, "etiqueta": label, "etiqueta_mayus": label[:1].upper() + label[1:], "grupo": result.get("group")}
+
+
+def render(structured: dict, style: str = "Formal") -> str:
+    """Texto final a partir de un resultado estructurado (ficha o agregado SQL).
+
+    None si no hay plantilla o si el agregado es parcial: una cifra que no
+    aplica todos los criterios de la pregunta no se presenta como respuesta.
+    """
+    if uncovered_words(structured):
+        return None
+    if structured.get("intent") == "aggregate":
+        result = structured["result"]
+        fields = _aggregate_fields(result)
+        if not result.get("group"):
+            value = result["rows"][0][0] if result["rows"] else None
+            return TEMPLATES["aggregate"].get(style, TEMPLATES["aggregate"]["Formal"]).format(valor=_fmt(value), **fields)
+        lines = [TEMPLATES["aggregate_grouped"].get(style, TEMPLATES["aggregate_grouped"]["Formal"]).format(**fields)]
+        lines += [f"- {group}: {_fmt(value)}" for group, value in result["rows"]] or ["- (sin registros)"]
+        if result.get("truncated"):
+            lines.append(f"(mostrando los {MAX_RESULT_ROWS} primeros grupos)")
+        return "\n".join(lines)
+
+    templates = TEMPLATES.get(structured.get("intent"))
+    if not templates:
+        return None
+    record = {key: ("(sin dato)" if value is None else value) for key, value in structured["record"].items()}
+    record["ultima_subida"] = _date(structured["record"].get("ultima_subida"))
+    return templates.get(style, templates["Formal"]).format(**record)
+
+
+_answers = None
+
+
+def get_hr_answers() -> HRAnswers:
+    global _answers
+    if _answers is None:
+        _answers = HRAnswers()
+    return _answers
@@ -0,0 +1,159 @@
+import io
+import os
+import base64
+import time
+import hashlib
+import threading
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+STATIC_DIR = os.path.join(BASE_DIR, "static")
+DERIVATIVES_DIR = os.path.join(STATIC_DIR, "derivatives")
+
+# Lado máximo de la imagen que se envía al modelo de visión
+VISION_MAX_SIDE = 1024
+VISION_JPEG_QUALITY = 85
+# Lado máximo de la miniatura de la UI (Streamlit la muestra a 400px de ancho)
+THUMBNAIL_MAX_SIDE = 400
+THUMBNAIL_JPEG_QUALITY = 80
+# Derivados de cada imagen: sufijo del fichero en la caché
+DERIVATIVE_KINDS = {"vision": "vision.jpg", "thumbnail": "thumb.jpg", "vision_b64": "vision.b64"}
+# Extensiones de las imágenes originales (static/images, static/labeled_images...)
+IMAGE_EXTENSIONS = {".png", ".jpg", ".jpeg", ".webp"}
+# Al podar, los derivados más recientes se conservan (pueden ser de una imagen que se está añadiendo ahora)
+PRUNE_MIN_AGE_SECONDS = 3600
+
+
+def _content_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _jpeg(img, max_side: int, quality: int) -> bytes:
+    from PIL import Image
+    if img.mode not in ("RGB", "L"):
+        img = img.convert("RGB")
+    w, h = img.size
+    if max(w, h) > max_side:
+        ratio = max_side / max(w, h)
+        img = img.resize((max(1, int(w * ratio)), max(1, int(h * ratio))), Image.Resampling.LANCZOS)
+    buf = io.BytesIO()
+    img.save(buf, format="JPEG", quality=quality)
+    return buf.getvalue()
+
+
+def _write_atomic(path: str, data: bytes):
+    tmp_path = f"{path}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+class ImageDerivatives:
+    """Caché de derivados de imagen direccionada por contenido.
+
+    Por cada imagen (clave: sha256 de sus bytes) se generan una sola vez un
+    JPEG del tamaño del modelo de visión, una miniatura para la UI y el
+    base64 del JPEG de visión. Ingesta, `visual_filter` y la UI los
+    comparten. Si el fichero original cambia (mtime/tamaño) se vuelve a
+    hashear y, si el contenido es otro, se generan derivados nuevos.
+    Sin PIL se usa la imagen original.
+    """
+
+    def __init__(self, cache_dir: str = DERIVATIVES_DIR):
+        self.cache_dir = cache_dir
+        self._hashes = {} # ruta -> (mtime_ns, tamaño, sha256)
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def content_hash(self, image_path: str) -> str:
+        path = os.path.abspath(image_path)
+        stat = os.stat(path)
+        cached = self._hashes.get(path)
+        if cached and cached[:2] == (stat.st_mtime_ns, stat.st_size):
+            return cached[2]
+        sha = _content_sha256(path)
+        self._hashes[path] = (stat.st_mtime_ns, stat.st_size, sha)
+        return sha
+
+    def paths(self, image_path: str) -> dict:
+        """{tipo: ruta} de los derivados de la imagen, generándolos si faltan."""
+        sha = self.content_hash(image_path)
+        paths = {kind: os.path.join(self.cache_dir, f"{sha}_{suffix}") for kind, suffix in DERIVATIVE_KINDS.items()}
+        if not all(os.path.exists(path) for path in paths.values()):
+            # Escrituras atómicas: dos hilos generando la misma imagen no se pisan
+            self._generate(image_path, paths)
+        return paths
+
+    def _generate(self, image_path: str, paths: dict):
+        try:
+            from PIL import Image
+            with Image.open(image_path) as img:
+                img.load()
+                vision = _jpeg(img, VISION_MAX_SIDE, VISION_JPEG_QUALITY)
+                thumbnail = _jpeg(img, THUMBNAIL_MAX_SIDE, THUMBNAIL_JPEG_QUALITY)
+        except ImportError:
+            # Sin PIL: los "derivados" son el original
+            with open(image_path, "rb") as f:
+                vision = thumbnail = f.read()
+        _write_atomic(paths["vision"], vision)
+        _write_atomic(paths["thumbnail"], thumbnail)
+        _write_atomic(paths["vision_b64"], base64.b64encode(vision))
+
+    def prune(self, root: str = STATIC_DIR, min_age: float = PRUNE_MIN_AGE_SECONDS) -> dict:
+        """Borra los derivados cuya imagen original ya no existe bajo `root`.
+
+        Los derivados se direccionan por contenido y nunca se sobrescriben:
+        al borrar o cambiar una imagen los suyos quedan huérfanos. Se hashean
+        las imágenes que hay ahora (con la caché de mtime/tamaño) y se
+        eliminan los derivados de cualquier otro hash con más de `min_age`
+        segundos. Devuelve {"removed": n, "bytes": b}.
+        """
+        cache_dir = os.path.abspath(self.cache_dir)
+        referenced = set()
+        for dirpath, dirnames, filenames in os.walk(root):
+            dirnames[:] = [d for d in dirnames if os.path.abspath(os.path.join(dirpath, d)) != cache_dir]
+            for filename in filenames:
+                if os.path.splitext(filename)[1].lower() in IMAGE_EXTENSIONS:
+                    try:
+                        referenced.add(self.content_hash(os.path.join(dirpath, filename)))
+                    except OSError:
+                        continue # Borrada mientras se recorría
+        # Las rutas que ya no existen no tienen por qué seguir en la caché de hashes
+        self._hashes = {path: cached for path, cached in self._hashes.items() if os.path.exists(path)}
+
+        stats = {"removed": 0, "bytes": 0}
+        cutoff = time.time() - min_age
+        for filename in os.listdir(self.cache_dir):
+            sha = filename.split("_", 1)[0]
+            if sha in referenced:
+                continue
+            path = os.path.join(self.cache_dir, filename)
+            try:
+                stat = os.stat(path)
+                if stat.st_mtime > cutoff:
+                    continue
+                os.remove(path)
+            except OSError:
+                continue
+            stats["removed"] += 1
+            stats["bytes"] += stat.st_size
+        return stats
+
+    def vision_b64(self, image_path: str) -> str:
+        with open(self.paths(image_path)["vision_b64"], "r", encoding="ascii") as f:
+            return f.read()
+
+    def thumbnail_path(self, image_path: str) -> str:
+        return self.paths(image_path)["thumbnail"]
+
+
+_derivatives = None
+
+
+def get_image_derivatives() -> ImageDerivatives:
+    global _derivatives
+    if _derivatives is None:
+        _derivatives = ImageDerivatives()
+    return _derivatives
@@ -0,0 +1,67 @@
+import os
+import sqlite3
+import threading
+import zlib
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+PARENT_STORE_PATH = os.path.join(BASE_DIR, "chroma_db", "parent_store.sqlite")
+
+# Máximo de parámetros por sentencia (límite de variables de SQLite)
+SQLITE_MAX_VARS = 900
+
+
+class ParentStore:
+    """Almacén clave-valor en disco (SQLite + zlib) para los textos padre de los chunks.
+
+    Los chunks solo guardan `parent_id` en su metadata; el texto padre
+    (sección o página completa) se lee bajo demanda para el top-k final,
+    así las consultas a Chroma no arrastran textos grandes.
+    """
+
+    def __init__(self, path: str = PARENT_STORE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS parents (id TEXT PRIMARY KEY, source TEXT, data BLOB)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_parents_source ON parents(source)")
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def put_many(self, parents: dict, source: str = None):
+        """Guarda (o reemplaza) {parent_id: texto}."""
+        if not parents:
+            return
+        rows = [(pid, source, zlib.compress(text.encode("utf-8"))) for pid, text in parents.items()]
+        with self._lock, self._connect() as conn:
+            conn.executemany("INSERT OR REPLACE INTO parents (id, source, data) VALUES (?, ?, ?)", rows)
+
+    def get_many(self, parent_ids) -> dict:
+        """Devuelve {parent_id: texto} de los ids que existan."""
+        parent_ids = list(dict.fromkeys(pid for pid in parent_ids if pid))
+        found = {}
+        with self._connect() as conn:
+            for i in range(0, len(parent_ids), SQLITE_MAX_VARS):
+                batch = parent_ids[i:i + SQLITE_MAX_VARS]
+                placeholders = ",".join("?" * len(batch))
+                for pid, data in conn.execute(f"SELECT id, data FROM parents WHERE id IN ({placeholders})", batch):
+                    found[pid] = zlib.decompress(data).decode("utf-8")
+        return found
+
+    def delete_many(self, parent_ids):
+        parent_ids = list(parent_ids)
+        with self._lock, self._connect() as conn:
+            for i in range(0, len(parent_ids), SQLITE_MAX_VARS):
+                batch = parent_ids[i:i + SQLITE_MAX_VARS]
+                conn.execute(f"DELETE FROM parents WHERE id IN ({','.join('?' * len(batch))})", batch)
+
+    def delete_source(self, source: str):
+        with self._lock, self._connect() as conn:
+            conn.execute("DELETE FROM parents WHERE source = ?", (source,))
+
+    def rename_source(self, old_source: str, new_source: str):
+        with self._lock, self._connect() as conn:
+            conn.execute("UPDATE parents SET source = ? WHERE source = ?", (new_source, old_source))
@@ -0,0 +1,90 @@
+import os
+import sys
+import hashlib
+
+import numpy as np
+import pytest
+from chromadb.api.types import EmbeddingFunction
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+
+class HashEmbeddingFunction(EmbeddingFunction):
+    """Embeddings deterministas (bolsa de palabras con hash) para no cargar modelos en los tests."""
+
+    dim = 64
+
+    def __init__(self):
+        pass
+
+    @staticmethod
+    def name() -> str:
+        return "hash-test"
+
+    def get_config(self) -> dict:
+        return {}
+
+    @staticmethod
+    def build_from_config(config: dict) -> "HashEmbeddingFunction":
+        return HashEmbeddingFunction()
+
+    def __call__(self, input):
+        vectors = []
+        for text in input:
+            vector = np.zeros(self.dim, dtype=np.float32)
+            for word in text.lower().split():
+                vector[int(hashlib.md5(word.encode("utf-8")).hexdigest(), 16) % self.dim] += 1
+            vectors.append(vector / (np.linalg.norm(vector) or 1.0))
+        return vectors
+
+
+@pytest.fixture
+def hash_embeddings():
+    return HashEmbeddingFunction()
+
+
+ENGINE_CHUNKS = {
+    f"ley_p{i}_c0": (f"Articulo {i}. " + " ".join(words), {"source": "ley.pdf" if i < 6 else "convenio.pdf", "page": i + 1})
+    for i, words in enumerate([
+        ("vacaciones", "anuales", "retribuidas"), ("permiso", "por", "matrimonio"), ("baja", "por", "enfermedad", "comun"),
+        ("despido", "objetivo", "indemnizacion"), ("jornada", "maxima", "semanal"), ("horas", "extraordinarias", "pago"),
+        ("lactancia", "del", "menor"), ("excedencia", "voluntaria"), ("teletrabajo", "acuerdo", "escrito"),
+        ("seguridad", "privada", "vigilantes"), ("salario", "minimo", "interprofesional"), ("nocturnidad", "plus")
+    ])
+}
+ENGINE_COLLECTION = "test_chunks"
+
+
+@pytest.fixture
+def make_engine(tmp_path, monkeypatch, hash_embeddings):
+    """RetrievalEngine sobre una colección temporal, con embeddings deterministas y sin reranker."""
+    import chromadb
+    import src.api.retrieval_engine as retrieval_engine
+    chroma_path = str(tmp_path / "chroma_db")
+    collection = chromadb.PersistentClient(path=chroma_path).get_or_create_collection(ENGINE_COLLECTION, embedding_function=hash_embeddings)
+    collection.add(ids=list(ENGINE_CHUNKS), documents=[text for text, _ in ENGINE_CHUNKS.values()], metadatas=[meta for _, meta in ENGINE_CHUNKS.values()])
+
+    def no_reranker(*args, **kwargs):
+        raise RuntimeError("sin reranker en los tests")
+    monkeypatch.setattr(retrieval_engine.embedding_functions, "SentenceTransformerEmbeddingFunction", lambda **kwargs: hash_embeddings)
+    monkeypatch.setattr(retrieval_engine, "CrossEncoder", no_reranker)
+    monkeypatch.setattr(retrieval_engine.RetrievalEngine, "_instance", None)
+
+    def make(**settings):
+        for name, value in settings.items():
+            monkeypatch.setattr(retrieval_engine, name, value)
+        retrieval_engine.RetrievalEngine._instance = None
+        return retrieval_engine.RetrievalEngine(chroma_path, ENGINE_COLLECTION)
+    make.collection = collection
+    return make
+
+
+def make_pdf(path: str, page_texts: list) -> str:
+    import fitz
+    doc = fitz.open()
+    for text in page_texts:
+        page = doc.new_page()
+        page.insert_text((72, 72), text)
+    doc.save(path)
+    doc.close()
+    return path
@@ -0,0 +1,66 @@
+import pytest
+
+import src.ingestion.bulk_writer as bulk_writer
+from src.ingestion.bulk_writer import ChromaBulkWriter
+
+
+class FlakyCollection:
+    """Colección falsa: el upsert de cualquier lote con un id de `broken` falla; los de `flaky` fallan una vez."""
+
+    def __init__(self, broken=(), flaky=()):
+        self.broken = set(broken)
+        self.flaky = set(flaky)
+        self.rows = {}
+        self.calls = []
+
+    def upsert(self, documents, metadatas, ids, embeddings=None):
+        self.calls.append(list(ids))
+        if self.broken & set(ids):
+            raise RuntimeError("metadata no válida")
+        if self.flaky & set(ids):
+            self.flaky -= set(ids)
+            raise RuntimeError("database is locked")
+        for doc_id, document, embedding in zip(ids, documents, embeddings or [None] * len(ids)):
+            self.rows[doc_id] = (document, embedding)
+
+
+def embed(texts):
+    return [[float(len(text)), 1.0] for text in texts]
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(bulk_writer, "RETRY_BACKOFF_SECONDS", 0)
+
+
+def chunks(start, end):
+    ids = [f"c{i}" for i in range(start, end)]
+    return {"documents": [f"texto {i}" for i in range(start, end)], "metadatas": [{"i": i} for i in range(start, end)], "ids": ids}
+
+
+def test_failed_batch_is_split_until_the_bad_chunk_is_isolated():
+    collection = FlakyCollection(broken={"c5"})
+    committed = []
+    writer = ChromaBulkWriter(collection, embedding_function=embed, batch_size=8, max_retries=2)
+    writer.add(**chunks(0, 4), on_committed=committed.append)
+    writer.add(**chunks(4, 8), on_committed=committed.append)
+    writer.add(**chunks(8, 10), on_committed=committed.append)
+    summary = writer.close()
+
+    assert writer.failed_ids == ["c5"]
+    assert set(collection.rows) == {f"c{i}" for i in range(10)} - {"c5"}
+    assert (summary["written"], summary["failed"]) == (9, 1)
+    # Solo la llamada que contenía el chunk fallido se confirma con ok=False
+    assert committed == [True, False, True]
+    # Lote de 8 -> mitades -> ... -> c5 solo, reintentado max_retries veces
+    assert collection.calls.count(["c5"]) == 3
+    assert collection.rows["c2"] == ("texto 2", [7.0, 1.0])
+
+
+def test_transient_error_is_retried_without_losing_chunks():
+    collection = FlakyCollection(flaky={"c1"})
+    with ChromaBulkWriter(collection, embedding_function=embed, batch_size=4) as writer:
+        writer.add(**chunks(0, 6))
+    assert writer.failed_ids == []
+    assert set(collection.rows) == {f"c{i}" for i in range(6)}
+    assert writer.stats["retries"] == 1
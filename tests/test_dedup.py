@@ -0,0 +1,53 @@
+from src.utils.dedup import DEDUP_MAX_HAMMING, collapse_near_duplicates, hamming, simhash
+
+BODY = ("Artículo 38. Vacaciones anuales. El periodo de vacaciones anuales retribuidas, no sustituible por "
+        "compensación económica, será el pactado en convenio colectivo o contrato individual. En ningún caso "
+        "la duración será inferior a treinta días naturales.")
+
+
+def candidate(doc_id, source, text):
+    return {"id": doc_id, "document": text, "metadata": {"source": source}}
+
+
+def test_simhash_ignores_the_chunk_header():
+    assert simhash(f"CONTEXTO: Estatuto (BOE-A-2015-11430)\nPÁGINA 12:\n{BODY}") == \
+        simhash(f"CONTEXTO: Texto consolidado (BOE-A-1995-7730)\n{BODY}")
+    assert hamming(simhash(BODY), simhash("Plus de nocturnidad del convenio de seguridad privada.")) > DEDUP_MAX_HAMMING
+    assert simhash("") == simhash("CONTEXTO: Ley\n... — ¡!") == ""
+
+
+def test_collapse_keeps_the_best_ranked_and_merges_sources():
+    candidates = [
+        candidate("a", "estatuto_2015.pdf", f"CONTEXTO: Estatuto 2015\n{BODY}"),
+        candidate("b", "convenio.pdf", "Plus de nocturnidad del convenio de seguridad privada, 25% del salario base."),
+        candidate("c", "estatuto_1995.pdf", f"CONTEXTO: Estatuto 1995\n{BODY}"),
+        candidate("d", "estatuto_2015.pdf", f"CONTEXTO: Estatuto 2015 (copia)\n{BODY}")
+    ]
+    kept = collapse_near_duplicates(candidates)
+    assert [item["id"] for item in kept] == ["a", "b"]
+    assert kept[0]["sources"] == ["estatuto_2015.pdf", "estatuto_1995.pdf"]
+    assert kept[0]["duplicate_ids"] == ["c", "d"]
+    assert kept[1]["sources"] == ["convenio.pdf"] and kept[1]["duplicate_ids"] == []
+
+
+def test_collapse_prefers_the_stored_fingerprint():
+    # La ingesta guarda `simhash` en la metadata; si coincide, se colapsan aunque el texto no se parezca
+    candidates = [
+        {"id": "a", "document": "uno", "metadata": {"source": "x.pdf", "simhash": "00000000000000ff"}},
+        {"id": "b", "document": "otro texto", "metadata": {"source": "y.pdf", "simhash": "00000000000000fe"}}
+    ]
+    assert [item["id"] for item in collapse_near_duplicates(candidates)] == ["a"]
+    assert [item["id"] for item in collapse_near_duplicates(candidates, max_distance=0)] == ["a", "b"]
+
+
+def test_chunks_without_words_are_never_collapsed():
+    candidates = [
+        candidate("a", "x.pdf", "CONTEXTO: Ley\n"),
+        candidate("b", "y.pdf", "— · —"),
+        # Firma de ceros guardada por ingestas anteriores para un chunk vacío
+        {"id": "c", "document": "", "metadata": {"source": "z.pdf", "simhash": "0" * 16}},
+        candidate("d", "w.pdf", BODY)
+    ]
+    kept = collapse_near_duplicates(candidates)
+    assert [item["id"] for item in kept] == ["a", "b", "c", "d"]
+    assert all(item["duplicate_ids"] == [] for item in kept)
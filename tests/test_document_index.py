@@ -0,0 +1,50 @@
+import numpy as np
+import pytest
+
+from src.api.document_index import DocumentIndex
+
+
+def unit(*values):
+    vec = np.array(values, dtype=np.float32)
+    return vec / np.linalg.norm(vec)
+
+
+CHUNKS = [
+    (unit(1, 0, 0), {"source": "estatuto.pdf", "category": "Laboral"}),
+    (unit(1, 0.2, 0), {"source": "estatuto.pdf", "category": "Laboral"}),
+    (unit(0.6, 0.8, 0), {"source": "erte.pdf", "category": "Laboral"}),
+    (unit(0, 0, 1), {"source": "constitucion.pdf", "category": "Constitucional"}),
+    (unit(0, 0.3, 1), {"source": "lobbies.pdf", "category": "Constitucional"})
+]
+
+
+def build(chunks):
+    index = DocumentIndex()
+    index.add(np.vstack([vec for vec, _ in chunks]), [meta for _, meta in chunks])
+    return index
+
+
+def test_top_documents_ranks_sources_by_centroid_and_category():
+    index = build(CHUNKS)
+    assert len(index) == 4
+    assert index.top_documents(unit(1, 0.1, 0), top_n=2) == ["estatuto.pdf", "erte.pdf"]
+    assert index.top_categories(unit(0, 0.1, 1), top_n=1) == ["Constitucional"]
+    # Los candidatos (p. ej. de un filtro `where`) restringen la primera etapa
+    assert index.top_documents(unit(1, 0.1, 0), top_n=2, candidates={"lobbies.pdf", "constitucion.pdf"}) == \
+        ["lobbies.pdf", "constitucion.pdf"]
+    assert index.top_documents(unit(1, 0, 0), candidates=set()) == []
+
+
+def test_incremental_updates_match_a_rebuild():
+    index = build(CHUNKS)
+    index.remove(np.vstack([CHUNKS[1][0]]), [CHUNKS[1][1]])
+    index.drop_sources(["lobbies.pdf"])
+    expected = build([CHUNKS[0], CHUNKS[2], CHUNKS[3]])
+    assert set(index.sums) == set(expected.sums)
+    for source in expected.sums:
+        assert index.sums[source] == pytest.approx(expected.sums[source], abs=1e-6)
+        assert index.counts[source] == expected.counts[source]
+    for category in expected.category_sums:
+        assert index.category_sums[category] == pytest.approx(expected.category_sums[category], abs=1e-6)
+    query = unit(0.5, 0.5, 0.5)
+    assert index.top_documents(query) == expected.top_documents(query)
@@ -0,0 +1,63 @@
+import pytest
+
+from src.utils.entity_extractor import EntityExtractor, query_type
+
+
+class FakeAnalytics:
+    """Directorio de empleados en memoria; `_signature` cambia como cuando se modifican los CSV."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._signature = 1
+
+    def ensure_loaded(self):
+        pass
+
+    def employee_directory(self):
+        return self.directory
+
+
+@pytest.fixture
+def analytics():
+    return FakeAnalytics([
+        ("EMP001", "Adrián García"),
+        ("EMP002", "Lola Flores"),
+        ("EMP003", "Lola Martín"),
+        ("EMP004", "Íñigo Pérez")
+    ])
+
+
+def names(result):
+    return {(entity["name"], entity["method"]) for entity in result["employees"]}
+
+
+@pytest.mark.parametrize("question, expected", [
+    ("¿Cuántos días de vacaciones tiene Adrian Garcia?", {("Adrián García", "name")}),
+    ("dame las bajas de emp004", {("Íñigo Pérez", "id")}),
+    ("¿Qué puesto tiene Iñigo?", {("Íñigo Pérez", "first_name")}),
+    ("¿Qué puesto tiene íñigo?", set()),                                   # nombre de pila en minúscula
+    ("Vacaciones de Lola Flores", {("Lola Flores", "name")}),              # el alias más largo gana
+    ("Vacaciones de Lola", {("Lola Flores", "first_name_ambiguous"), ("Lola Martín", "first_name_ambiguous")}),
+    ("Bajas de Adrain Garcia", {("Adrián García", "fuzzy")}),
+    ("¿Qué dice el Estatuto de los Trabajadores?", set())
+])
+def test_extract(analytics, question, expected):
+    assert names(EntityExtractor(analytics).extract(question)) == expected
+
+
+def test_extract_rebuilds_when_the_data_changes(analytics):
+    extractor = EntityExtractor(analytics)
+    assert extractor.extract("Permisos de Marta Ruiz")["employees"] == []
+    analytics.directory = analytics.directory + [("EMP005", "Marta Ruiz")]
+    analytics._signature = 2
+    assert names(extractor.extract("Permisos de Marta Ruiz")) == {("Marta Ruiz", "name")}
+
+
+@pytest.mark.parametrize("question, expected", [
+    ("¿Cuántas bajas médicas hubo?", "sick_leave"),
+    ("Días de vacaciones de Lola", "vacation"),
+    ("¿Qué salario tiene Adrián?", "role"),
+    ("Trabajadores del departamento", "general")
+])
+def test_query_type(question, expected):
+    assert query_type(question) == expected
@@ -0,0 +1,40 @@
+import os
+import types
+
+import pytest
+
+for module in ("ragas", "datasets", "langchain_community"):
+    pytest.importorskip(module)
+
+import src.evaluation.eval_ragas as eval_ragas
+import src.utils.hr_analytics as hr_analytics
+
+
+@pytest.fixture
+def pipeline_tree(tmp_path, monkeypatch):
+    for relative_path in ("src/api/main.py", "src/utils/helpers/extra.py", "data/bajas.csv"):
+        path = tmp_path / relative_path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text("x = 1\n")
+    monkeypatch.setattr(eval_ragas, "BASE_DIR", str(tmp_path))
+    analytics = types.SimpleNamespace(files={"bajas": str(tmp_path / "data/bajas.csv")})
+    monkeypatch.setattr(hr_analytics, "get_hr_analytics", lambda: analytics)
+    engine = types.SimpleNamespace(index_version=lambda: "idx")
+    return tmp_path, types.SimpleNamespace(retrieval_engine=engine, LLM_TEXT_MODEL="llama3.2")
+
+
+def test_pipeline_version_tracks_every_module_and_hr_csv(pipeline_tree):
+    root, main_module = pipeline_tree
+    assert [os.path.relpath(path, root) for path in eval_ragas.pipeline_files()] == [
+        os.path.join("src", "api", "main.py"), os.path.join("src", "utils", "helpers", "extra.py")
+    ]
+    version = eval_ragas.pipeline_version(main_module)
+    assert eval_ragas.pipeline_version(main_module) == version
+
+    (root / "src/utils/helpers/extra.py").write_text("x = 2\n")
+    changed_code = eval_ragas.pipeline_version(main_module)
+    assert changed_code != version
+
+    csv = root / "data/bajas.csv"
+    os.utime(csv, (csv.stat().st_atime, csv.stat().st_mtime + 60))
+    assert eval_ragas.pipeline_version(main_module) != changed_code
@@ -0,0 +1,43 @@
+import pytest
+
+for module in ("torch", "sentence_transformers"):
+    pytest.importorskip(module)
+
+import src.evaluation.eval_retrieval as eval_retrieval
+
+DATASET = [
+    {"question": "vacaciones anuales", "reference_doc": "ley.pdf"},
+    {"question": "permiso por matrimonio", "reference_doc": "ley.pdf"},
+    {"question": "fallo del servidor", "reference_doc": "ley.pdf"},
+    {"question": "plus de nocturnidad", "reference_doc": "convenio.pdf"}
+]
+
+
+class FakeEngine:
+    """Devuelve siempre ley.pdf primero; el lote con "fallo" lanza una excepción."""
+
+    def index_version(self):
+        return "test"
+
+    def search_many(self, questions, top_k_fusion=10, top_k=5):
+        if any("fallo" in q for q in questions):
+            raise RuntimeError("Chroma no disponible")
+        return [[{"id": "1", "metadata": {"source": "ley.pdf"}, "rerank_score": 1.0, "fusion_score": 0.1}] for _ in questions]
+
+
+def test_failed_batches_are_excluded_and_reported(tmp_path, monkeypatch):
+    monkeypatch.setattr(eval_retrieval, "EVAL_BATCH_SIZE", 2)
+    engine = FakeEngine()
+    cache = eval_retrieval.CandidateCache(engine, cache_dir=str(tmp_path))
+
+    failed = eval_retrieval.fill_cache(engine, cache, [item["question"] for item in DATASET])
+    assert failed == ["fallo del servidor", "plus de nocturnidad"]
+
+    row = eval_retrieval.evaluate_config(cache, DATASET, top_k=3)
+    # Solo cuentan las dos preguntas recuperadas (ambas aciertan en la posición 1)
+    assert (row["Preguntas"], row["Fallidas"]) == (2, 2)
+    assert row["Hit Rate"] == 1.0 and row["MRR"] == 1.0
+    assert row["Latencia"] == eval_retrieval.LATENCY_NOTE
+
+    # Las fallidas no se guardan: la próxima ejecución las reintenta
+    assert eval_retrieval.CandidateCache(engine, cache_dir=str(tmp_path)).missing([item["question"] for item in DATASET]) == failed
@@ -0,0 +1,81 @@
+import pytest
+
+from src.utils.hr_analytics import get_hr_analytics
+from src.utils.hr_answers import needs_reasoning, render, uncovered_words, use_template
+
+AGGREGATE_QUESTION = "¿Cuántas bajas profesionales hubo en febrero?"
+REASONING_QUESTION = "¿Cuántas bajas profesionales hubo en febrero y qué dice el convenio sobre su coste?"
+PARTIAL_QUESTION = "¿Cuántas bajas profesionales por gripe hubo en febrero?"
+
+
+@pytest.fixture(scope="module")
+def aggregate():
+    analytics = get_hr_analytics()
+    return {"intent": "aggregate", "result": analytics.run(analytics.match(AGGREGATE_QUESTION))}
+
+
+@pytest.fixture(scope="module")
+def partial():
+    return {"intent": "aggregate", "result": get_hr_analytics().answer(PARTIAL_QUESTION, partial=True)}
+
+
+def test_needs_reasoning():
+    assert not needs_reasoning(AGGREGATE_QUESTION)
+    assert needs_reasoning(REASONING_QUESTION)
+    assert needs_reasoning("¿Por qué tiene Lola Flores tantos días de baja?")
+    assert not needs_reasoning("¿Qué puesto tiene Lola Flores?")
+
+
+def test_render_aggregate(aggregate):
+    value = aggregate["result"]["rows"][0][0]
+    assert render(aggregate, "Directo") == f"- Nº de bajas (mes: 02, tipo: Profesional): {value}."
+    assert render(aggregate, "Estilo desconocido") == render(aggregate, "Formal")
+
+
+def test_generator_sends_reasoning_aggregates_to_llm(aggregate, monkeypatch):
+    for module in ("langgraph", "ollama", "torch", "sentence_transformers"):
+        pytest.importorskip(module)
+    import src.api.main as main
+
+    prompts = []
+    def chat(model=None, messages=None, **kwargs):
+        prompts.append(messages[-1]["content"])
+        return {"message": {"content": "respuesta del LLM"}}
+    monkeypatch.setattr(main.ollama, "chat", chat)
+
+    state = {"pregunta": AGGREGATE_QUESTION, "style": "Formal", "structured_result": aggregate,
+             "docs_recuperados": aggregate["result"]["text"], "datos_visuales_extraidos": "", "debug_pipeline": []}
+    assert main.generator(state)["answer_path"] == "template"
+    assert not prompts
+
+    result = main.generator({**state, "pregunta": REASONING_QUESTION, "debug_pipeline": []})
+    assert result["answer_path"] == "llm"
+    assert aggregate["result"]["text"] in prompts[0]
+
+
+def test_partial_aggregate_is_never_templated(aggregate, partial):
+    assert uncovered_words(partial) == ["gripe"]
+    assert render(partial, "Formal") is None
+    assert not use_template(partial, PARTIAL_QUESTION)
+    assert use_template(aggregate, AGGREGATE_QUESTION)
+    assert not use_template(aggregate, REASONING_QUESTION)
+    assert not use_template(None, AGGREGATE_QUESTION)
+
+
+def test_data_tool_passes_partial_aggregates_to_llm(monkeypatch):
+    for module in ("langgraph", "ollama", "torch", "sentence_transformers"):
+        pytest.importorskip(module)
+    import src.api.main as main
+
+    prompts = []
+    def chat(model=None, messages=None, **kwargs):
+        prompts.append(messages[-1]["content"])
+        return {"message": {"content": "respuesta del LLM"}}
+    monkeypatch.setattr(main.ollama, "chat", chat)
+
+    state = {"pregunta": PARTIAL_QUESTION, "style": "Formal", "debug_pipeline": []}
+    state.update(main.data_tool_node(state))
+    assert uncovered_words(state["structured_result"]) == ["gripe"]
+    result = main.generator(state)
+    assert result["answer_path"] == "llm"
+    assert "Cálculo parcial" in prompts[0] and "gripe" in prompts[0]
@@ -0,0 +1,86 @@
+import os
+
+import pytest
+
+from src.utils.image_derivatives import ImageDerivatives
+
+Image = pytest.importorskip("PIL.Image")
+
+
+def make_image(path, color, size=(64, 48)):
+    Image.new("RGB", size, color).save(path)
+    return str(path)
+
+
+def test_prune_removes_only_derivatives_of_images_no_longer_present(tmp_path):
+    static = tmp_path / "static"
+    (static / "images").mkdir(parents=True)
+    derivatives = ImageDerivatives(str(static / "derivatives"))
+    kept = derivatives.paths(make_image(static / "images" / "kept.png", "red"))
+    removed_image = make_image(static / "images" / "removed.png", "blue")
+    orphaned = derivatives.paths(removed_image)
+    os.remove(removed_image)
+
+    # Recién generados: se conservan aunque ya no tengan original
+    assert derivatives.prune(str(static))["removed"] == 0
+    stats = derivatives.prune(str(static), min_age=0)
+    assert stats["removed"] == len(orphaned) and stats["bytes"] > 0
+    assert all(os.path.exists(path) for path in kept.values())
+    assert not any(os.path.exists(path) for path in orphaned.values())
+
+
+def test_derivatives_are_generated_once_and_sized_for_each_consumer(tmp_path, monkeypatch):
+    import base64
+    derivatives = ImageDerivatives(str(tmp_path / "derivatives"))
+    image = make_image(tmp_path / "grafico.png", "green", size=(2000, 1000))
+    generated = []
+    generate = derivatives._generate
+    monkeypatch.setattr(derivatives, "_generate", lambda path, paths: generated.append(path) or generate(path, paths))
+
+    paths = derivatives.paths(image)
+    assert derivatives.paths(image) == paths and len(generated) == 1
+    with Image.open(paths["vision"]) as vision, Image.open(paths["thumbnail"]) as thumbnail:
+        assert vision.size == (1024, 512) and thumbnail.size == (400, 200)
+    with open(paths["vision"], "rb") as f:
+        assert base64.b64decode(derivatives.vision_b64(image)) == f.read()
+    assert derivatives.thumbnail_path(image) == paths["thumbnail"]
+
+
+def test_derivatives_follow_changes_of_the_source_image(tmp_path):
+    derivatives = ImageDerivatives(str(tmp_path / "derivatives"))
+    image = make_image(tmp_path / "grafico.png", "green")
+    original = derivatives.thumbnail_path(image)
+
+    # Mismo contenido con otro mtime: se re-hashea pero el derivado es el mismo
+    os.utime(image, ns=(0, 0))
+    assert derivatives.thumbnail_path(image) == original
+    # Contenido nuevo: otro hash y otro derivado (el antiguo queda para `prune`)
+    make_image(tmp_path / "grafico.png", "purple")
+    updated = derivatives.thumbnail_path(image)
+    assert updated != original and os.path.exists(updated)
+    with Image.open(updated) as thumbnail:
+        assert thumbnail.convert("RGB").getpixel((0, 0))[0] > 100
+
+
+def test_thumbnail_endpoint_serves_the_cached_thumbnail(tmp_path, monkeypatch):
+    for module in ("langgraph", "ollama", "torch", "sentence_transformers"):
+        pytest.importorskip(module)
+    from fastapi.testclient import TestClient
+    import src.api.main as main
+
+    static = tmp_path / "static"
+    (static / "labeled_images").mkdir(parents=True)
+    make_image(static / "labeled_images" / "grafico.png", "green", size=(1200, 600))
+    derivatives = ImageDerivatives(str(static / "derivatives"))
+    monkeypatch.setattr(main, "BASE_DIR", str(tmp_path))
+    monkeypatch.setattr(main, "STATIC_DIR", str(static))
+    monkeypatch.setattr(main, "get_image_derivatives", lambda: derivatives)
+
+    client = TestClient(main.app)
+    response = client.get("/thumbnails/static/labeled_images/grafico.png")
+    assert response.status_code == 200 and response.headers["content-type"] == "image/jpeg"
+    assert response.headers["cache-control"] == "no-cache"
+    with open(derivatives.thumbnail_path(str(static / "labeled_images" / "grafico.png")), "rb") as f:
+        assert response.content == f.read()
+    assert client.get("/thumbnails/static/labeled_images/no_existe.png").status_code == 404
+    assert client.get("/thumbnails/../secreto.png").status_code == 404
@@ -0,0 +1,62 @@
+import io
+import os
+
+import fitz
+import numpy as np
+import pytest
+
+import src.ingestion.ingest as ingest
+
+Image = pytest.importorskip("PIL.Image")
+
+
+def png_bytes(size, seed):
+    pixels = np.random.default_rng(seed).integers(0, 255, size=(size, size, 3), dtype=np.uint8)
+    buf = io.BytesIO()
+    Image.fromarray(pixels).save(buf, format="PNG")
+    return buf.getvalue()
+
+
+def test_image_store_writes_each_distinct_image_once(tmp_path):
+    store = ingest.ImageStore(str(tmp_path))
+    logo, seal = png_bytes(120, 0), png_bytes(120, 1)
+    paths = [store.put(logo, "png"), store.put(seal, "png"), store.put(logo, "png")]
+    store.wait()
+    assert paths[0] == paths[2] != paths[1]
+    assert sorted(os.listdir(tmp_path)) == sorted(os.path.basename(path) for path in paths[:2])
+    with open(tmp_path / os.path.basename(paths[0]), "rb") as f:
+        assert f.read() == logo
+    assert (store.stats["written"], store.stats["deduplicated"], store.stats["bytes_saved"]) == (2, 1, len(logo))
+
+    # Otra ejecución (store nuevo) no reescribe lo que ya está en disco
+    again = ingest.ImageStore(str(tmp_path))
+    assert again.put(seal, "png") == paths[1]
+    assert again.stats["written"] == 0 and not again.futures
+
+
+def pdf_with_images(page_images):
+    doc = fitz.open()
+    for images in page_images:
+        page = doc.new_page()
+        for i, (image, side) in enumerate(images):
+            page.insert_image(fitz.Rect(72 + 130 * i, 72, 72 + 130 * i + side, 72 + side), stream=image)
+    return doc
+
+
+def test_repeated_pdf_images_are_extracted_once_per_xref_and_content(tmp_path):
+    logo, small = (png_bytes(120, 0), 120), (png_bytes(40, 2), 40)
+    # El mismo logo en cada página (un solo xref) y una imagen por debajo del tamaño mínimo
+    doc = pdf_with_images([[logo, small], [logo], [logo]])
+    store = ingest.ImageStore(str(tmp_path))
+    xref_cache = {}
+    per_page = [ingest.extract_images_from_page(page, doc, store, xref_cache) for page in doc]
+    assert per_page[0] == per_page[1] == per_page[2] and len(per_page[0]) == 1
+    assert (store.stats["written"], store.stats["xref_hits"], store.stats["occurrences"]) == (1, 2, 3)
+
+    # Otro documento con el mismo logo: xref distinto, mismo contenido -> misma ruta, sin reescribir
+    other = pdf_with_images([[logo]])
+    assert ingest.extract_images_from_page(other[0], other, store, {}) == per_page[0]
+    store.wait()
+    assert len(os.listdir(tmp_path)) == 1
+    assert store.stats["written"] == 1 and store.stats["deduplicated"] == 3
+    assert store.stats["bytes_saved"] == 3 * os.path.getsize(tmp_path / os.listdir(tmp_path)[0])
@@ -0,0 +1,114 @@
+import pandas as pd
+import pytest
+
+pytest.importorskip("torch")
+
+import chromadb
+
+import src.ingestion.ingest_csv as ic
+from src.ingestion.manifest import RowHashManifest
+
+EMPLOYEES = pd.DataFrame({
+    "id": [101, 102], "name": ["Carlos Ruiz", "Marta Vila"], "role": ["Técnico", "Inspectora"],
+    "vacation_days_left": [12, 25], "sick_leave_days": [0, 2], "last_pay_raise": ["2024-01-01", "2023-06-01"]
+})
+VACATIONS = pd.DataFrame({
+    "ID_Empleado": [101, 102, 101], "Nombre_Empleado": ["Carlos Ruiz", "Marta Vila", "Carlos Ruiz"],
+    "Departamento": ["IT", "Calidad", "IT"], "Tipo_Contrato": ["General"] * 3, "Tipo_Permiso": ["Vacaciones"] * 3,
+    "Fecha_Inicio": ["2026-08-01", "2026-07-10", "2026-12-22"], "Fecha_Fin": ["2026-08-15", "2026-07-20", "2026-12-31"],
+    "Días_Solicitados": [15, 10, 7], "Estado": ["Aprobado", "Pendiente", "Aprobado"]
+})
+SICK_LEAVE = pd.DataFrame({
+    "ID_Baja": ["B-001", "B-002"], "ID_Empleado": [101, 102], "Nombre_Empleado": ["Carlos Ruiz", "Marta Vila"],
+    "Tipo_Baja": ["Común", "Profesional"], "Motivo_Detallado": ["Gripe", "Esguince"],
+    "Fecha_Inicio": ["2026-01-10", "2026-02-01"], "Fecha_Alta": ["2026-01-15", "2026-02-10"],
+    "Dias_Totales": [5, 9], "Coste_Empresa_Est": ["120.50", "0.00"]
+})
+
+
+def employees():
+    df = EMPLOYEES.copy()
+    df["id"] = df["id"].astype(str)
+    return df
+
+
+def test_vacation_chunk_ids_do_not_depend_on_row_position():
+    chunks = ic.build_vacation_chunks(VACATIONS, employees())
+    assert list(chunks["id"]) == ["vac_101_2026-08-01_2026-08-15", "vac_102_2026-07-10_2026-07-20", "vac_101_2026-12-22_2026-12-31"]
+    # Una fila nueva al principio no renumera las demás; una clave repetida recibe sufijo
+    shifted = ic.build_vacation_chunks(pd.concat([VACATIONS.iloc[[1]], VACATIONS], ignore_index=True), employees())
+    assert list(shifted["id"]) == ["vac_102_2026-07-10_2026-07-20"] + list(chunks["id"][:1]) + \
+        ["vac_102_2026-07-10_2026-07-20_2"] + list(chunks["id"][2:])
+
+    document, metadata = chunks["document"][0], chunks["metadata"][0]
+    assert document.startswith("EMPLEADO: Carlos Ruiz (ID: 101)\nPuesto: Técnico\nVacaciones disponibles: 12 días\n\n")
+    assert "Periodo: 2026-08-01 a 2026-08-15\nDías solicitados: 15\nEstado: Aprobado" in document
+    assert metadata == {"source": "vacaciones_rrhh", "type": "vacation_request", "employee_id": "101",
+                        "employee_name": "Carlos Ruiz", "status": "Aprobado"}
+
+
+def test_sick_leave_chunks_are_keyed_by_leave_id_and_tolerate_unknown_employees():
+    chunks = ic.build_sick_leave_chunks(SICK_LEAVE, employees().iloc[:1])
+    assert list(chunks["id"]) == ["sick_B-001", "sick_B-002"]
+    assert chunks["document"][0].startswith("EMPLEADO: Carlos Ruiz (ID: 101)\nPuesto: Técnico\n\nBAJA MÉDICA:")
+    assert chunks["document"][1].startswith("BAJA MÉDICA:\nEmpleado: Marta Vila (ID: 102)")
+    assert chunks["metadata"][1]["sick_type"] == "Profesional"
+
+
+@pytest.fixture
+def csv_env(tmp_path, monkeypatch, hash_embeddings):
+    files = {key: str(tmp_path / f"{key}.csv") for key in ic.FILES}
+    EMPLOYEES.to_csv(files["employees"], index=False)
+    VACATIONS.to_csv(files["vacations"], index=False)
+    SICK_LEAVE.to_csv(files["sick_leave"], index=False)
+    collection = chromadb.PersistentClient(path=str(tmp_path / "chroma_db")).get_or_create_collection(
+        ic.COLLECTION_NAME, embedding_function=hash_embeddings)
+    written = []
+
+    class RecordingWriter(ic.ChromaBulkWriter):
+        def add(self, documents, metadatas, ids, *args, **kwargs):
+            written.append(list(ids))
+            return super().add(documents, metadatas, ids, *args, **kwargs)
+
+    monkeypatch.setattr(ic, "FILES", files)
+    monkeypatch.setattr(ic, "get_chroma_collection", lambda: collection)
+    monkeypatch.setattr(ic, "RowHashManifest", lambda: RowHashManifest(str(tmp_path / "csv_manifest.json")))
+    monkeypatch.setattr(ic, "ChromaBulkWriter", RecordingWriter)
+    return files, collection, written
+
+
+def test_resync_only_touches_new_changed_and_deleted_rows(csv_env):
+    files, collection, written = csv_env
+    ic.ingest_csvs()
+    assert len(written[0]) == len(VACATIONS) + len(SICK_LEAVE) + len(EMPLOYEES)
+    assert set(collection.get()["ids"]) == set(written[0])
+
+    # Sin cambios: nada que escribir
+    ic.ingest_csvs()
+    assert len(written) == 1
+
+    vacations = VACATIONS.copy()
+    vacations.loc[1, "Estado"] = "Aprobado"
+    vacations = vacations.drop(index=2)
+    sick_leave = pd.concat([SICK_LEAVE, SICK_LEAVE.iloc[[0]].assign(ID_Baja="B-003", Fecha_Inicio="2026-03-01")])
+    vacations.to_csv(files["vacations"], index=False)
+    sick_leave.to_csv(files["sick_leave"], index=False)
+    ic.ingest_csvs()
+
+    assert sorted(written[-1]) == ["sick_B-003", "vac_102_2026-07-10_2026-07-20"]
+    ids = set(collection.get()["ids"])
+    assert "vac_101_2026-12-22_2026-12-31" not in ids and "sick_B-003" in ids
+    assert collection.get(ids=["vac_102_2026-07-10_2026-07-20"])["metadatas"][0]["status"] == "Aprobado"
+
+    # --full re-escribe todas las filas (upsert: los ids existentes no fallan)
+    ic.ingest_csvs(full=True)
+    assert len(written[-1]) == len(ids)
+
+
+def test_unreadable_csv_does_not_delete_its_rows(csv_env):
+    files, collection, written = csv_env
+    ic.ingest_csvs()
+    with open(files["sick_leave"], "w", encoding="utf-8") as f:
+        f.write("columna_inesperada\nvalor\n")
+    ic.ingest_csvs()
+    assert {"sick_B-001", "sick_B-002"} <= set(collection.get()["ids"])
@@ -0,0 +1,137 @@
+import os
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("torch")
+pytest.importorskip("ollama")
+
+import src.ingestion.ingest_images as ii
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def monotonic(self):
+        return self.now
+
+
+class FakeStream:
+    """Respuesta en streaming de Ollama: cada fragmento tarda `step` segundos."""
+
+    def __init__(self, clock, parts, step):
+        self.clock, self.parts, self.step = clock, parts, step
+        self.closed = False
+
+    def __iter__(self):
+        for part in self.parts:
+            self.clock.now += self.step
+            yield {"message": {"content": part}}
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def vision(monkeypatch):
+    vision = SimpleNamespace(clock=FakeClock(), calls=[], stream=None)
+
+    class Client:
+        def chat(self, **kwargs):
+            vision.calls.append(kwargs)
+            return vision.stream
+
+    class Derivatives:
+        def vision_b64(self, path):
+            return "aW1hZ2Vu"
+
+    monkeypatch.setattr(ii, "time", SimpleNamespace(monotonic=vision.clock.monotonic))
+    monkeypatch.setattr(ii, "get_vision_client", lambda: Client())
+    monkeypatch.setattr(ii, "get_image_derivatives", lambda: Derivatives())
+    return vision
+
+
+def test_caption_joins_the_streamed_parts(vision):
+    vision.stream = FakeStream(vision.clock, ["Gráfico ", "de barras. "], step=1.0)
+    assert ii.generate_auto_caption("grafico.png") == "Gráfico de barras."
+    assert vision.calls[0]["stream"] is True
+    assert vision.stream.closed
+
+
+def test_caption_deadline_covers_the_whole_generation(vision):
+    # Cada lectura llega a tiempo, pero la generación completa supera CAPTION_TIMEOUT
+    step = ii.CAPTION_TIMEOUT / 4
+    vision.stream = FakeStream(vision.clock, ["palabra "] * 10, step=step)
+    assert ii.generate_auto_caption("lenta.png") is None
+    assert vision.stream.closed
+    assert vision.clock.now <= ii.CAPTION_TIMEOUT + step
+
+
+def test_group_near_duplicates_reuses_labeled_images_and_groups_the_rest():
+    hashes = {"logo.png": "ff00", "logo_copia.jpg": "ff01", "grafico.png": "0f0f", "grafico_b.png": "0f0e",
+              "tabla.png": "a5a5", "sin_hash.png": None}
+    groups, reuse = ii.group_near_duplicates(["logo_copia.jpg", "grafico.png", "grafico_b.png", "tabla.png", "sin_hash.png"],
+                                             hashes, {"logo.png": "Logo del BOE"})
+    assert reuse == {"logo_copia.jpg": "logo.png"}
+    assert groups == {"grafico.png": ["grafico_b.png"], "tabla.png": [], "sin_hash.png": []}
+
+
+def test_load_labels_merges_the_journal_and_ignores_a_torn_last_line(tmp_path):
+    labels_path, journal_path = tmp_path / "labels.json", tmp_path / ii.LABELS_JOURNAL_NAME
+    labels_path.write_text('{"manual.png": "Etiqueta manual"}', encoding="utf-8")
+    journal_path.write_text('{"filename": "auto.png", "caption": "Gráfico", "dhash": "ff00"}\n{"filename": "cort',
+                            encoding="utf-8")
+    labels, hashes = ii.load_labels(str(labels_path), str(journal_path))
+    assert labels == {"manual.png": "Etiqueta manual", "auto.png": "Gráfico"}
+    assert hashes == {"auto.png": "ff00"}
+
+    ii.compact_labels(str(labels_path), str(journal_path), labels)
+    assert not journal_path.exists()
+    assert ii.load_labels(str(labels_path), str(journal_path)) == (labels, {})
+
+
+def test_main_captions_each_group_of_near_duplicates_once(tmp_path, monkeypatch, hash_embeddings):
+    import json
+    import chromadb
+    import numpy as np
+    Image = pytest.importorskip("PIL.Image")
+
+    def noise(seed):
+        return np.random.default_rng(seed).integers(0, 255, size=(64, 64), dtype=np.uint8)
+    Image.fromarray(noise(0)).save(tmp_path / "grafico.png")
+    Image.fromarray(noise(0)).resize((48, 48)).save(tmp_path / "grafico_reducido.jpg", quality=90)
+    Image.fromarray(noise(1)).save(tmp_path / "tabla.png")
+    Image.fromarray(noise(2)).save(tmp_path / "manual.png")
+    (tmp_path / "labels.json").write_text(json.dumps({"manual.png": "Etiqueta manual"}), encoding="utf-8")
+
+    collection = chromadb.PersistentClient(path=str(tmp_path / "chroma_db")).get_or_create_collection(
+        ii.COLLECTION_NAME, embedding_function=hash_embeddings)
+    captioned = []
+    def caption(image_path):
+        captioned.append(os.path.basename(image_path))
+        return f"Descripción de {os.path.basename(image_path)}"
+
+    class Derivatives:
+        def paths(self, image_path):
+            return {}
+
+        def prune(self):
+            return {"removed": 0, "bytes": 0}
+
+    monkeypatch.setattr(ii, "LABELED_IMAGES_DIR", str(tmp_path))
+    monkeypatch.setattr(ii, "get_chroma_collection", lambda: collection)
+    monkeypatch.setattr(ii, "get_image_derivatives", lambda: Derivatives())
+    monkeypatch.setattr(ii, "generate_auto_caption", caption)
+
+    ii.main()
+
+    # La copia reducida hereda la descripción de su representante (una llamada por grupo)
+    assert sorted(captioned) in (["grafico.png", "tabla.png"], ["grafico_reducido.jpg", "tabla.png"])
+    labels = json.loads((tmp_path / "labels.json").read_text(encoding="utf-8"))
+    assert labels["grafico.png"] == labels["grafico_reducido.jpg"]
+    assert labels["manual.png"] == "Etiqueta manual"
+    assert not (tmp_path / ii.LABELS_JOURNAL_NAME).exists()
+    stored = collection.get()
+    assert sorted(stored["ids"]) == ["grafico.png", "grafico_reducido.jpg", "manual.png", "tabla.png"]
+    assert {meta["source"] for meta in stored["metadatas"]} == {"AUTO-IA", "DUPLICADA", "MANUAL"}
@@ -0,0 +1,302 @@
+import os
+import sys
+import shutil
+
+import pytest
+
+pytest.importorskip("torch")
+pytest.importorskip("pymupdf4llm")
+
+import chromadb
+import numpy as np
+
+from conftest import make_pdf
+import src.ingestion.ingest_multimodal as im
+import src.ingestion.manifest as manifest_module
+from src.ingestion.manifest import IngestManifest, file_sha256
+from src.utils.parent_store import ParentStore
+
+PAGE_TEXTS = [
+    f"Articulo {i}. El trabajador tiene derecho a {i} dias. Las vacaciones se pactan. Otra frase de relleno {i}."
+    for i in range(1, 4)
+]
+
+
+@pytest.fixture
+def fake_embeddings(monkeypatch, hash_embeddings):
+    monkeypatch.setattr(im, "get_embedding_func", lambda: hash_embeddings)
+    return hash_embeddings
+
+
+@pytest.mark.parametrize("strategy", ["pymupdf4llm_semantic", "fallback_standard"])
+def test_window_pages_are_zero_based(tmp_path, monkeypatch, fake_embeddings, strategy):
+    pdf = make_pdf(str(tmp_path / "ley.pdf"), PAGE_TEXTS)
+    if strategy == "fallback_standard":
+        def broken(*args, **kwargs):
+            raise RuntimeError("pymupdf4llm no disponible")
+        monkeypatch.setattr(im.pymupdf4llm, "to_markdown", broken)
+
+    page_hashes, windows, _ = im.plan_file(pdf, window_size=3)
+    assert windows == [[0, 1, 2]]
+
+    _, units, parents, info = im.parse_file_worker(pdf, windows[0])
+    assert info["strategy"] == strategy
+    assert sorted({unit["page"] for unit in units}) == [0, 1, 2]
+    assert sorted(info["page_parent_ids"]) == [0, 1, 2]
+    assert parents["ley_p0"].splitlines()[1] == "PÁGINA 1:"
+
+    docs, metas, ids, _ = im.build_chunks(units, info)
+    assert sorted({meta["page"] for meta in metas}) == [1, 2, 3]
+    assert all(chunk_id.startswith(f"ley_p{meta['page'] - 1}_") for meta, chunk_id in zip(metas, ids))
+
+    outputs = im.page_outputs(info, metas, ids, page_hashes)
+    assert sorted(outputs) == [0, 1, 2]
+    assert all(outputs[page]["chunk_ids"] and outputs[page]["hash"] == page_hashes[page] for page in outputs)
+
+
+@pytest.fixture
+def ingest_env(tmp_path, monkeypatch, fake_embeddings):
+    """Chroma, manifiesto y parent store en un directorio temporal."""
+    chroma_dir = tmp_path / "chroma_db"
+    monkeypatch.setattr(im, "CHROMA_PATH", str(chroma_dir))
+    monkeypatch.setattr(im, "IngestManifest", lambda: IngestManifest(str(chroma_dir / "ingest_manifest.json")))
+    monkeypatch.setattr(im, "ParentStore", lambda: ParentStore(str(chroma_dir / "parent_store.sqlite")))
+    monkeypatch.setattr(manifest_module, "LOCKS_DIR", str(chroma_dir / "locks"))
+    monkeypatch.setattr(im, "PAGE_WINDOW_SIZE", 2)
+    docs = tmp_path / "docs"
+    docs.mkdir()
+    monkeypatch.setattr(im, "DOCS_DIR", str(docs))
+    return docs
+
+
+def test_interrupted_ingest_resumes_from_last_committed_window(ingest_env, monkeypatch):
+    pdf = make_pdf(str(ingest_env / "convenio.pdf"), PAGE_TEXTS * 2) # 6 páginas -> ventanas [0,1] [2,3] [4,5]
+    source = os.path.basename(pdf)
+
+    # 1ª ejecución: se corta al construir la segunda ventana
+    build_chunks = im.build_chunks
+    calls = []
+    def crash_on_second_window(units, info):
+        calls.append(info["changed_pages"])
+        if len(calls) == 2:
+            raise KeyboardInterrupt("proceso detenido")
+        return build_chunks(units, info)
+    monkeypatch.setattr(im, "build_chunks", crash_on_second_window)
+    with pytest.raises(KeyboardInterrupt):
+        im.process_pdf(pdf)
+
+    entry = im.IngestManifest().get(source)
+    assert sorted(entry["pages"]) == ["0", "1"]
+    assert entry["sha256"] is None # fichero a medias: se ve como modificado
+
+    # 2ª ejecución: solo se parsean las ventanas no confirmadas
+    monkeypatch.setattr(im, "build_chunks", build_chunks)
+    parse_file_worker = im.parse_file_worker
+    parsed = []
+    def spy(filepath, pages=None):
+        parsed.append(pages)
+        return parse_file_worker(filepath, pages)
+    monkeypatch.setattr(im, "parse_file_worker", spy)
+    assert im.process_pdf(pdf) == "updated"
+    assert parsed == [[2, 3], [4, 5]]
+
+    entry = im.IngestManifest().get(source)
+    assert sorted(entry["pages"], key=int) == ["0", "1", "2", "3", "4", "5"]
+    assert entry["sha256"] == file_sha256(pdf)
+    collection = chromadb.PersistentClient(path=im.CHROMA_PATH).get_collection(im.COLLECTION_NAME)
+    stored_ids = set(collection.get(where={"source": source})["ids"])
+    assert stored_ids == {chunk_id for page in entry["pages"].values() for chunk_id in page["chunk_ids"]}
+    assert im.process_pdf(pdf) == "unchanged"
+
+
+def test_rename_reports_the_old_source(ingest_env):
+    pdf = make_pdf(str(ingest_env / "viejo.pdf"), PAGE_TEXTS)
+    assert im.process_pdf(pdf) == "new"
+    renamed = str(ingest_env / "nuevo.pdf")
+    os.rename(pdf, renamed)
+
+    details = {}
+    assert im.process_pdf(renamed, progress=lambda **fields: details.update(fields)) == "renamed"
+    assert details["renamed_from"] == "viejo.pdf"
+    collection = chromadb.PersistentClient(path=im.CHROMA_PATH).get_collection(im.COLLECTION_NAME)
+    assert not collection.get(where={"source": "viejo.pdf"})["ids"]
+    assert collection.get(where={"source": "nuevo.pdf"})["ids"]
+
+
+def test_identical_pdfs_in_one_batch_are_ingested_once(ingest_env, monkeypatch):
+    monkeypatch.setitem(sys.modules, "src.ingestion.ingest_csv", None) # sin CSVs en este test
+    first = make_pdf(str(ingest_env / "a_original.pdf"), PAGE_TEXTS)
+    shutil.copy(first, ingest_env / "b_copia.pdf")
+
+    im.main(num_workers=1)
+
+    manifest = im.IngestManifest()
+    assert manifest.get("b_copia.pdf")["alias_of"] == "a_original.pdf"
+    assert manifest.get("a_original.pdf")["sha256"] == file_sha256(first)
+    collection = chromadb.PersistentClient(path=im.CHROMA_PATH).get_collection(im.COLLECTION_NAME)
+    assert {meta["source"] for meta in collection.get(include=["metadatas"])["metadatas"]} == {"a_original.pdf"}
+
+
+def test_batch_ingest_locks_only_the_documents_in_flight(ingest_env, monkeypatch):
+    monkeypatch.setitem(sys.modules, "src.ingestion.ingest_csv", None)
+    monkeypatch.setattr(im, "MAX_LOCKED_DOCUMENTS", 2)
+    for i in range(5):
+        make_pdf(str(ingest_env / f"doc_{i}.pdf"), [f"Documento {i}. " + PAGE_TEXTS[0]])
+
+    held, peak = set(), []
+    class CountingLock(manifest_module.FileLock):
+        def acquire(self, blocking=True):
+            acquired = super().acquire(blocking)
+            if acquired:
+                held.add(self.path)
+                peak.append(len(held))
+            return acquired
+        def release(self):
+            held.discard(self.path)
+            super().release()
+    monkeypatch.setattr(im, "source_lock", lambda source: CountingLock(os.path.join(manifest_module.LOCKS_DIR, f"{source}.lock")))
+
+    im.main(num_workers=1)
+
+    assert max(peak) <= 2 and not held
+    manifest = im.IngestManifest()
+    assert all(manifest.get(f"doc_{i}.pdf")["sha256"] for i in range(5))
+
+
+def test_batch_ingest_skips_documents_another_process_ingested_after_planning(ingest_env, monkeypatch):
+    monkeypatch.setitem(sys.modules, "src.ingestion.ingest_csv", None)
+    ours = make_pdf(str(ingest_env / "a_ley.pdf"), PAGE_TEXTS)
+    theirs = make_pdf(str(ingest_env / "b_convenio.pdf"), PAGE_TEXTS[:1])
+
+    # Entre la planificación y el parseo, la API ingesta b_convenio.pdf y guarda su manifiesto
+    producer = im._parse_producer
+    def api_ingests_meanwhile(*args):
+        api = im.IngestManifest()
+        api.update_file("b_convenio.pdf", file_sha256(theirs), theirs, {0: "h"}, {0: {"chunk_ids": ["api_chunk"], "parent_ids": []}})
+        api.save()
+        producer(*args)
+    monkeypatch.setattr(im, "_parse_producer", api_ingests_meanwhile)
+
+    im.main(num_workers=1)
+
+    manifest = im.IngestManifest()
+    assert manifest.get("a_ley.pdf")["sha256"] == file_sha256(ours)
+    assert manifest.get("b_convenio.pdf")["pages"]["0"]["chunk_ids"] == ["api_chunk"]
+    collection = chromadb.PersistentClient(path=im.CHROMA_PATH).get_collection(im.COLLECTION_NAME)
+    assert {meta["source"] for meta in collection.get(include=["metadatas"])["metadatas"]} == {"a_ley.pdf"}
+
+
+def test_parse_producer_stops_parsing_while_the_queue_is_full(monkeypatch):
+    from concurrent.futures import ThreadPoolExecutor
+    import queue
+    import threading
+    import time
+
+    class ThreadPool(ThreadPoolExecutor):
+        def __init__(self, max_workers, mp_context=None):
+            super().__init__(max_workers=max_workers)
+
+    parsed = []
+    def parse(filepath, pages):
+        parsed.append(pages)
+        return filepath, [], {}, {"pages": len(pages)}
+    monkeypatch.setattr(im, "ProcessPoolExecutor", ThreadPool)
+    monkeypatch.setattr(im, "parse_file_worker", parse)
+
+    tasks = [("ley.pdf", [page]) for page in range(10)]
+    parsed_queue = queue.Queue(maxsize=1)
+    producer = threading.Thread(target=im._parse_producer, args=(tasks, 1, parsed_queue), daemon=True)
+    producer.start()
+    time.sleep(0.3)
+    # Nadie consume: 1 ventana en la cola, otra esperando a entrar y como mucho una más en vuelo
+    assert len(parsed) <= 1 * 2 + 1
+
+    results = []
+    while (item := parsed_queue.get(timeout=5)) is not None:
+        results.append(item)
+    producer.join(timeout=5)
+    assert sorted(info["pages"] for _, _, _, info in results) == [1] * 10
+    assert sorted(parsed) == [[page] for page in range(10)]
+
+
+def test_parallel_batch_ingest_stores_the_same_chunks_as_parsing_in_process(ingest_env, monkeypatch):
+    monkeypatch.setitem(sys.modules, "src.ingestion.ingest_csv", None)
+    pdfs = [make_pdf(str(ingest_env / f"doc_{i}.pdf"), [f"Documento {i}. {text}" for text in PAGE_TEXTS]) for i in range(3)]
+    expected = {}
+    for pdf in pdfs:
+        for window in im.plan_file(pdf)[1]:
+            _, units, _, info = im.parse_file_worker(pdf, window)
+            docs, _, ids, _ = im.build_chunks(units, info)
+            expected.update(zip(ids, docs))
+    # Los procesos del pool (spawn) no ven DOCS_DIR parcheado: la categoría de la cabecera difiere
+    def body(document):
+        return document.split("\n", 1)[1]
+
+    stages = []
+    class RecordingStats(im.StageStats):
+        def __init__(self):
+            super().__init__()
+            stages.append(self)
+    monkeypatch.setattr(im, "StageStats", RecordingStats)
+
+    im.main(num_workers=2, queue_size=1)
+
+    collection = chromadb.PersistentClient(path=im.CHROMA_PATH).get_collection(im.COLLECTION_NAME)
+    stored = collection.get()
+    assert {chunk_id: body(doc) for chunk_id, doc in zip(stored["ids"], stored["documents"])} == \
+        {chunk_id: body(doc) for chunk_id, doc in expected.items()}
+    counts = stages[0].counts
+    assert counts["parse"] == len(pdfs) * len(PAGE_TEXTS)
+    assert counts["split"] == counts["embed"] == counts["write"] == len(expected)
+
+
+def _naive_boundaries(embeddings, threshold_percentile):
+    """Referencia: similitud de cada par adyacente calculada una a una."""
+    sims = [float(embeddings[i] @ embeddings[i + 1]) / (np.linalg.norm(embeddings[i]) * np.linalg.norm(embeddings[i + 1]))
+            for i in range(len(embeddings) - 1)]
+    threshold = np.percentile(sims, 100 - threshold_percentile)
+    return [i + 1 for i, sim in enumerate(sims) if sim < threshold]
+
+
+def test_vectorised_split_matches_pairwise_similarities():
+    rng = np.random.default_rng(0)
+    sentences = [f"Frase {i}." for i in range(12)]
+    embeddings = im._normalize_rows(rng.normal(size=(12, 8)).astype(np.float32))
+    chunks, vectors = im._split_sentences(" ".join(sentences), sentences, embeddings, 80, max_chunk_size=10_000)
+
+    bounds = [0] + _naive_boundaries(embeddings, 80) + [len(sentences)]
+    assert chunks == [" ".join(sentences[a:b]) for a, b in zip(bounds, bounds[1:])]
+    # Vector de cada chunk: media normalizada de los embeddings de sus frases
+    for vector, (a, b) in zip(vectors, zip(bounds, bounds[1:])):
+        mean = embeddings[a:b].mean(axis=0)
+        assert vector == pytest.approx(mean / np.linalg.norm(mean), abs=1e-6)
+
+
+def test_semantic_split_embeds_all_sentences_in_one_batch(monkeypatch, hash_embeddings):
+    batches = []
+    def embed(texts):
+        batches.append(list(texts))
+        return hash_embeddings(texts)
+    monkeypatch.setattr(im, "get_embedding_func", lambda: embed)
+    texts = [PAGE_TEXTS[0], "", PAGE_TEXTS[1] + " " + PAGE_TEXTS[2]]
+    splits = im.semantic_split_many(texts, max_chunk_size=120)
+
+    assert len(batches) == 1 and len(batches[0]) == sum(len(im.split_into_sentences(text)) for text in texts)
+    assert splits[1] == ([], [])
+    for text, (chunks, vectors) in zip(texts, splits):
+        assert " ".join(chunks) == " ".join(im.split_into_sentences(text))
+        assert len(vectors) == len(chunks)
+    assert all(len(chunk) <= 120 for chunk in splits[2][0])
+
+
+@pytest.mark.parametrize("mode", ["reembed", "sentence_mean"])
+def test_build_chunks_only_returns_vectors_when_reusing_sentence_embeddings(tmp_path, monkeypatch, fake_embeddings, mode):
+    monkeypatch.setattr(im, "CHUNK_EMBEDDING_MODE", mode)
+    pdf = make_pdf(str(tmp_path / "ley.pdf"), PAGE_TEXTS)
+    _, units, _, info = im.parse_file_worker(pdf)
+    docs, _, ids, embeddings = im.build_chunks(units, info)
+    if mode == "reembed":
+        assert embeddings is None
+    else:
+        assert len(embeddings) == len(docs) == len(ids)
+        assert all(np.linalg.norm(vector) == pytest.approx(1.0, abs=1e-5) for vector in embeddings)
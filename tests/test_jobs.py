@@ -0,0 +1,41 @@
+import time
+
+from src.api.jobs import IngestJobManager
+
+
+def wait_finished(jobs: IngestJobManager, job_id: str, timeout: float = 5.0) -> dict:
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        job = jobs.get(job_id)
+        if job["finished_at"]:
+            return job
+        time.sleep(0.01)
+    raise TimeoutError(job_id)
+
+
+def test_job_reports_progress_and_renamed_source():
+    def process(path, progress):
+        progress(pages_total=4, pages_parsed=4)
+        if path.endswith("nuevo.pdf"):
+            progress(renamed_from="viejo.pdf")
+            return "renamed"
+        progress(chunks_total=3, chunks_embedded=3)
+        return "new"
+
+    done = []
+    jobs = IngestJobManager(process, on_file_done=lambda filename, status, renamed_from: done.append((filename, status, renamed_from)) or "ok")
+    job = wait_finished(jobs, jobs.submit(["docs/ley.pdf", "docs/nuevo.pdf"]))
+    assert job["status"] == "done"
+    assert (job["files_done"], job["pages_parsed"], job["chunks_embedded"]) == (2, 8, 3)
+    assert done == [("ley.pdf", "new", None), ("nuevo.pdf", "renamed", "viejo.pdf")]
+    assert job["files"][1]["renamed_from"] == "viejo.pdf"
+
+
+def test_job_with_only_errors_is_marked_error():
+    def process(path, progress):
+        raise RuntimeError("PDF corrupto")
+
+    jobs = IngestJobManager(process)
+    job = wait_finished(jobs, jobs.submit(["docs/roto.pdf"]))
+    assert job["status"] == "error"
+    assert job["files"][0]["message"] == "PDF corrupto"
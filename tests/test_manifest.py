@@ -0,0 +1,155 @@
+import os
+import sys
+import errno
+import json
+import time
+import types
+import subprocess
+import threading
+
+import pytest
+
+import src.ingestion.manifest as manifest_module
+from src.ingestion.manifest import FileLock, IngestManifest, source_lock
+
+
+@pytest.fixture
+def manifest_path(tmp_path, monkeypatch):
+    monkeypatch.setattr(manifest_module, "LOCKS_DIR", str(tmp_path / "locks"))
+    return str(tmp_path / "ingest_manifest.json")
+
+
+def saved_files(path: str) -> dict:
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)["files"]
+
+
+def test_update_file_keeps_untouched_pages(manifest_path):
+    manifest = IngestManifest(manifest_path)
+    manifest.update_file("ley.pdf", "sha1", "/docs/ley.pdf", {0: "h0", 1: "h1", 2: "h2"}, {
+        0: {"chunk_ids": ["ley_p0_c0"], "parent_ids": ["ley_p0"]},
+        1: {"chunk_ids": ["ley_p1_c0"], "parent_ids": ["ley_p1"]},
+        2: {"chunk_ids": ["ley_p2_c0"], "parent_ids": ["ley_p2"]}
+    })
+    # Cambia la página 1 y desaparece la 2
+    manifest.update_file("ley.pdf", "sha2", "/docs/ley.pdf", {0: "h0", 1: "h1b"}, {
+        1: {"chunk_ids": ["ley_p1_c0", "ley_p1_c1"], "parent_ids": ["ley_p1"]}
+    })
+    entry = manifest.get("ley.pdf")
+    assert entry["sha256"] == "sha2"
+    assert entry["pages"] == {
+        "0": {"hash": "h0", "chunk_ids": ["ley_p0_c0"], "parent_ids": ["ley_p0"]},
+        "1": {"hash": "h1b", "chunk_ids": ["ley_p1_c0", "ley_p1_c1"], "parent_ids": ["ley_p1"]}
+    }
+    assert manifest.page_hashes("ley.pdf") == {0: "h0", 1: "h1b"}
+    assert manifest.find_by_sha("sha2", exclude="otro.pdf") == "ley.pdf"
+    manifest.save()
+    assert IngestManifest(manifest_path).get("ley.pdf") == entry
+
+
+def test_save_merges_entries_written_by_other_instances(manifest_path):
+    IngestManifest(manifest_path).update_file("viejo.pdf", "s0", "/docs/viejo.pdf", {}, {}) # sin guardar: no cuenta
+    api, watcher = IngestManifest(manifest_path), IngestManifest(manifest_path)
+    api.update_file("subido.pdf", "s1", "/docs/subido.pdf", {0: "h"}, {0: {"chunk_ids": [], "parent_ids": []}})
+    watcher.update_file("copiado.pdf", "s2", "/docs/copiado.pdf", {}, {})
+    api.save()
+    watcher.save()
+    assert sorted(saved_files(manifest_path)) == ["copiado.pdf", "subido.pdf"]
+    assert watcher.get("subido.pdf")["sha256"] == "s1" # el save también recoge lo ajeno
+
+    api.remove("subido.pdf")
+    api.save()
+    watcher.reload()
+    assert sorted(saved_files(manifest_path)) == ["copiado.pdf"]
+    assert watcher.get("subido.pdf") is None
+
+
+def test_concurrent_saves_do_not_drop_entries(manifest_path):
+    def ingest(worker: int):
+        manifest = IngestManifest(manifest_path)
+        for i in range(20):
+            manifest.checkpoint_pages(f"doc_{worker}_{i}.pdf", f"/docs/doc_{worker}_{i}.pdf", {0: {"hash": "h"}})
+            manifest.save()
+    threads = [threading.Thread(target=ingest, args=(worker,)) for worker in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(saved_files(manifest_path)) == 80
+
+
+def test_file_lock_excludes_other_processes(tmp_path):
+    path = str(tmp_path / "doc.lock")
+    probe = ("import sys; sys.path.insert(0, sys.argv[1]); from src.ingestion.manifest import FileLock; "
+             "print(FileLock(sys.argv[2]).acquire(blocking=False))")
+    root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+    with FileLock(path):
+        held = subprocess.run([sys.executable, "-c", probe, root, path], capture_output=True, text=True, check=True)
+        assert FileLock(path).locked()
+    free = subprocess.run([sys.executable, "-c", probe, root, path], capture_output=True, text=True, check=True)
+    assert (held.stdout.strip(), free.stdout.strip()) == ("False", "True")
+
+
+def test_file_lock_without_free_descriptors_acts_as_busy(tmp_path, monkeypatch):
+    path = str(tmp_path / "doc.lock")
+    real_open = os.open
+    failures = []
+    def no_descriptors(*args, **kwargs):
+        if len(failures) < 2:
+            failures.append(args[0])
+            raise OSError(errno.EMFILE, "Too many open files")
+        return real_open(*args, **kwargs)
+    monkeypatch.setattr(manifest_module, "LOCK_POLL_SECONDS", 0)
+    monkeypatch.setattr(manifest_module.os, "open", no_descriptors)
+
+    lock = FileLock(path)
+    assert lock.acquire(blocking=False) is False
+    assert lock.acquire() is True # espera a que haya descriptores, como con un cerrojo ocupado
+    lock.release()
+    assert len(failures) == 2
+
+    def denied(*args, **kwargs):
+        raise PermissionError(errno.EACCES, "Permission denied")
+    monkeypatch.setattr(manifest_module.os, "open", denied)
+    with pytest.raises(PermissionError): # el resto de errores no se confunde con un cerrojo ocupado
+        FileLock(path).acquire(blocking=False)
+
+
+def test_reload_skips_reading_an_unchanged_file(manifest_path, monkeypatch):
+    manifest = IngestManifest(manifest_path)
+    manifest.update_file("ley.pdf", "s1", "/docs/ley.pdf", {}, {})
+    manifest.save()
+    reads = []
+    read = IngestManifest._read
+    monkeypatch.setattr(IngestManifest, "_read", lambda self: reads.append(1) or read(self))
+    manifest.reload()
+    assert reads == []
+    other = IngestManifest(manifest_path)
+    other.update_file("nuevo.pdf", "s2", "/docs/nuevo.pdf", {}, {})
+    other.save()
+    manifest.reload()
+    assert manifest.get("nuevo.pdf")["sha256"] == "s2"
+
+
+def test_watcher_leaves_files_with_an_active_ingest_queued(tmp_path, manifest_path, monkeypatch):
+    from src.ingestion.watch_docs import DocsWatcher
+
+    processed = []
+    fake_ingest = types.SimpleNamespace(process_pdf=lambda path, progress=None: processed.append(path) or "new",
+                                        remove_document=lambda source: [])
+    monkeypatch.setitem(sys.modules, "src.ingestion.ingest_multimodal", fake_ingest)
+    docs = tmp_path / "docs"
+    docs.mkdir()
+    uploaded, other = docs / "subido.pdf", docs / "otro.pdf"
+    uploaded.write_bytes(b"%PDF-1.4")
+    other.write_bytes(b"%PDF-1.4")
+
+    watcher = DocsWatcher(docs_dir=str(docs), api_url="http://localhost:0", debounce=0)
+    monkeypatch.setattr(watcher, "notify", lambda upserted, removed: None)
+    watcher.poll(now=0)
+    with source_lock("subido.pdf"): # la API lo está ingestando
+        watcher.process(watcher.ready(now=1))
+    assert processed == [str(other)]
+    assert list(watcher.pending) == [str(uploaded)]
+    watcher.process(watcher.ready(now=time.time() + 1)) # vuelve a esperar el debounce tras quedar libre
+    assert processed == [str(other), str(uploaded)]
@@ -0,0 +1,73 @@
+import sqlite3
+
+import pytest
+
+from src.utils.parent_store import SQLITE_MAX_VARS, ParentStore
+
+PAGE = "CONTEXTO: Estatuto\nPÁGINA 1:\n" + "Artículo 38. Vacaciones anuales retribuidas. " * 40
+
+
+def test_parents_round_trip_compressed(tmp_path):
+    store = ParentStore(str(tmp_path / "parents.sqlite"))
+    store.put_many({"ley_p0": PAGE, "ley_p0_s1": "Sección 1"}, source="ley.pdf")
+    assert store.get_many(["ley_p0", None, "no_existe", "ley_p0"]) == {"ley_p0": PAGE}
+    with sqlite3.connect(store.path) as conn:
+        (size,) = conn.execute("SELECT length(data) FROM parents WHERE id = 'ley_p0'").fetchone()
+    assert size < len(PAGE.encode("utf-8")) / 4
+
+
+def test_get_many_splits_large_lookups_into_batches(tmp_path):
+    store = ParentStore(str(tmp_path / "parents.sqlite"))
+    parents = {f"doc_p{i}": f"Página {i}" for i in range(SQLITE_MAX_VARS * 2 + 5)}
+    store.put_many(parents, source="doc.pdf")
+    assert store.get_many(parents) == parents
+    store.delete_many(list(parents)[:SQLITE_MAX_VARS + 1])
+    assert len(store.get_many(parents)) == SQLITE_MAX_VARS + 4
+
+
+def test_source_level_delete_and_rename(tmp_path):
+    store = ParentStore(str(tmp_path / "parents.sqlite"))
+    store.put_many({"a_p0": "A"}, source="a.pdf")
+    store.put_many({"b_p0": "B"}, source="b.pdf")
+    store.rename_source("a.pdf", "a_v2.pdf")
+    store.delete_source("a.pdf")
+    assert store.get_many(["a_p0", "b_p0"]) == {"a_p0": "A", "b_p0": "B"}
+    store.delete_source("a_v2.pdf")
+    assert store.get_many(["a_p0", "b_p0"]) == {"b_p0": "B"}
+
+
+def test_retriever_fetches_parents_only_for_the_final_top_k_and_merges_siblings(tmp_path, monkeypatch):
+    for module in ("langgraph", "ollama", "torch", "sentence_transformers"):
+        pytest.importorskip(module)
+    import src.api.main as main
+
+    store = ParentStore(str(tmp_path / "parents.sqlite"))
+    store.put_many({"ley_p3": "Página 3 completa", "ley_p9": "Página 9 completa"}, source="ley.pdf")
+    lookups = []
+    real_get_many = store.get_many
+    monkeypatch.setattr(store, "get_many", lambda ids: lookups.append(list(ids)) or real_get_many(lookups[-1]))
+
+    def chunk(doc_id, parent_id):
+        return {"id": doc_id, "document": f"texto de {doc_id}", "metadata": {"source": "ley.pdf", "page": 4, "parent_id": parent_id}}
+    candidates = [chunk("c1", "ley_p3"), chunk("c2", "ley_p3"), chunk("c3", None), chunk("c4", "ley_p9")]
+
+    class Engine:
+        def hybrid_search(self, question, **kwargs):
+            return candidates
+
+        def rerank(self, question, items, top_k=5):
+            return items[:3]
+
+        def embed_queries(self, queries):
+            raise RuntimeError("sin imágenes en el test")
+
+    monkeypatch.setattr(main, "retrieval_engine", Engine())
+    monkeypatch.setattr(main, "parent_store", store)
+    monkeypatch.setattr(main, "generar_hyde", lambda question: "hipótesis")
+
+    result = main.retriever({"pregunta": "¿Qué regula el artículo 40 del Estatuto?", "debug_pipeline": []})
+    # Una sola lectura, solo con los padres del top-k final (c4 no pasó el reranker)
+    assert lookups == [["ley_p3", "ley_p3", None]]
+    # c1 y c2 comparten padre: una sola entrada de contexto
+    assert result["contextos"] == ["Página 3 completa", "texto de c3"]
+    assert len(result["sources"]) == 3
@@ -0,0 +1,288 @@
+import numpy as np
+import pytest
+
+for module in ("torch", "sentence_transformers"):
+    pytest.importorskip(module)
+
+import src.api.retrieval_engine as retrieval_engine
+from conftest import ENGINE_CHUNKS as CHUNKS
+
+
+def test_persisted_ann_is_rebuilt_when_content_changes_under_the_same_ids(make_engine, hash_embeddings):
+    pytest.importorskip("hnswlib")
+    engine = make_engine(VECTOR_BACKEND="hnswlib")
+    saved_version = engine.ann_index.corpus_version
+    assert saved_version == engine._content_version()
+
+    # Restart without changes: the index on disk is reused
+    assert make_engine(VECTOR_BACKEND="hnswlib").ann_index.corpus_version == saved_version
+
+    # Re-ingest with the same ids while the API is down (upsert): same id set, different vectors
+    new_text = "Articulo 0. Registro salarial y brecha retributiva entre hombres y mujeres"
+    make_engine.collection.upsert(ids=["ley_p0_c0"], documents=[new_text], metadatas=[CHUNKS["ley_p0_c0"][1]])
+    engine = make_engine(VECTOR_BACKEND="hnswlib")
+    assert engine.ann_index.corpus_version != saved_version
+    labels, dists = engine.ann_index.search(np.asarray(hash_embeddings([new_text]), dtype=np.float32), 1)
+    assert engine.ann_index.ids[labels[0][0]] == "ley_p0_c0"
+    assert dists[0][0] == pytest.approx(0.0, abs=1e-4)
+
+
+def test_incremental_update_keeps_ann_version_in_sync(make_engine):
+    pytest.importorskip("hnswlib")
+    engine = make_engine(VECTOR_BACKEND="hnswlib")
+    make_engine.collection.upsert(ids=["ley_p1_c0"], documents=["Articulo 1. Permiso por nacimiento"],
+                                  metadatas=[CHUNKS["ley_p1_c0"][1]])
+    engine.apply_source_changes(upserted=["ley.pdf"])
+    assert engine.ann_index.corpus_version == engine._content_version()
+    reloaded = make_engine(VECTOR_BACKEND="hnswlib")
+    assert reloaded.ann_index.corpus_version == engine.ann_index.corpus_version
+
+
+@pytest.mark.parametrize("fusion", [
+    {"method": "max"},
+    {"weights": [1.0]},
+    {"weights": "1,1"},
+    {"weights": [1.0, -0.5]},
+    {"weights": [0, 0]},
+    {"weights": [True, 1.0]},
+    {"rrf_k": 0},
+    {"rrf_k": "60"},
+    {"cutoff_gap": "0.3"},
+    {"cutoff_gap": -0.1},
+    {"min_candidates": 0},
+    {"min_candidates": 2.5},
+    {"top_k": 5},
+    ["rrf"]
+])
+def test_resolve_fusion_config_rejects_invalid_values(fusion):
+    with pytest.raises(ValueError):
+        retrieval_engine.resolve_fusion_config(fusion)
+
+
+def test_resolve_fusion_config_merges_defaults():
+    config = retrieval_engine.resolve_fusion_config({"weights": [1, 2], "rrf_k": 20, "cutoff_gap": None})
+    assert config["weights"] == (1.0, 2.0)
+    assert config["rrf_k"] == 20
+    assert config["cutoff_gap"] == retrieval_engine.DEFAULT_FUSION_CONFIG["cutoff_gap"]
+    assert config["method"] == retrieval_engine.DEFAULT_FUSION_CONFIG["method"]
+
+
+def _results(*ids_scores):
+    return [{"id": doc_id, "score": score, "document": doc_id, "metadata": {}} for doc_id, score in ids_scores]
+
+
+def test_fuse_rrf_is_weighted_by_rank():
+    bm25 = _results(("a", 12.0), ("b", 3.0))
+    vector = _results(("b", 0.9), ("c", 0.8))
+    fused = retrieval_engine.RetrievalEngine.fuse(None, [bm25, vector], method="rrf", weights=(1.0, 2.0), rrf_k=10)
+    assert [item["id"] for item in fused] == ["b", "c", "a"]
+    assert fused[0]["fusion_score"] == pytest.approx(1 / 12 + 2 / 11)
+    assert fused[0]["scores"] == [3.0, 0.9]
+    assert fused[1]["scores"] == [None, 0.8]
+
+
+def test_fuse_score_normalizes_each_list():
+    bm25 = _results(("a", 12.0), ("b", 3.0), ("c", 0.0))
+    vector = _results(("c", 0.9), ("a", 0.3))
+    fused = retrieval_engine.RetrievalEngine.fuse(None, [bm25, vector], method="score", weights=(1.0, 1.0))
+    scores = {item["id"]: item["fusion_score"] for item in fused}
+    assert scores == pytest.approx({"a": 1.0, "b": 0.25, "c": 1.0})
+    # A igual score se respeta el orden de aparición
+    assert [item["id"] for item in fused] == ["a", "c", "b"]
+
+
+@pytest.mark.parametrize("scores, gap, min_candidates, expected", [
+    ([1.0, 0.95, 0.9, 0.2, 0.1], 0.3, 2, 3),    # corta en el salto 0.9 -> 0.2
+    ([1.0, 0.2, 0.1, 0.05], 0.3, 3, 4),         # el único salto grande está antes del mínimo
+    ([1.0, 0.9, 0.8, 0.7], 0.3, 1, 4),          # sin saltos grandes
+    ([1.0, 0.1, 0.05], None, 1, 3),             # corte desactivado
+    ([1.0, 0.1], 0.3, 3, 2),                    # menos candidatos que el mínimo
+    ([0.0, 0.0, 0.0, 0.0], 0.3, 1, 4)           # sin score de referencia
+])
+def test_adaptive_cutoff(scores, gap, min_candidates, expected):
+    assert retrieval_engine.adaptive_cutoff(scores, gap, min_candidates) == expected
+
+
+def test_invalid_fusion_config_is_a_bad_request(monkeypatch):
+    for module in ("langgraph", "ollama"):
+        pytest.importorskip(module)
+    from fastapi.testclient import TestClient
+    import src.api.main as main
+    monkeypatch.setattr(main.app_graph, "invoke", lambda *args, **kwargs: pytest.fail("no debe llegar al grafo"))
+    client = TestClient(main.app)
+    response = client.post("/chat", json={"question": "vacaciones", "retrieval_config": {"rrf_k": "abc"}})
+    assert response.status_code == 400
+    assert "rrf_k" in response.json()["detail"]
+    # El nodo de recuperación tampoco lo convierte en "sin contexto"
+    with pytest.raises(ValueError):
+        main.retriever({"pregunta": "vacaciones", "debug_pipeline": [], "retrieval_config": {"weights": [1]}})
+
+
+def test_unfiltered_faiss_search_falls_back_when_stale_labels_crowd_out_results(make_engine, hash_embeddings):
+    pytest.importorskip("faiss")
+    engine = make_engine(VECTOR_BACKEND="faiss")
+    query = "permiso por nacimiento"
+    query_vector = np.asarray(hash_embeddings([query]), dtype=np.float32)
+    expected = [item["id"] for item in engine._search_vector_chroma([query], hash_embeddings([query]), 3, None)[0]]
+
+    # Vectores obsoletos idénticos a la query (faiss los sigue devolviendo): ocupan los primeros vecinos
+    zombies = [f"obsoleto_{i}" for i in range(6)]
+    engine.ann_index.add(zombies, np.repeat(query_vector, len(zombies), axis=0))
+    engine.ann_index.remove(zombies)
+
+    results = engine.search_vector_many([query], top_k=3)[0]
+    assert [item["id"] for item in results] == expected
+
+
+def _ids(results):
+    return [item["id"] for item in results]
+
+
+@pytest.mark.parametrize("where, expected", [
+    ({"source": "convenio.pdf"}, {f"ley_p{i}_c0" for i in range(6, 12)}),
+    ({"source": {"$ne": "convenio.pdf"}}, {f"ley_p{i}_c0" for i in range(6)}),
+    ({"$and": [{"source": {"$in": ["ley.pdf"]}}, {"page": {"$lte": 2}}]}, {"ley_p0_c0", "ley_p1_c0"}),
+    ({"$or": [{"page": 1}, {"page": {"$gt": 11}}]}, {"ley_p0_c0", "ley_p11_c0"}),
+    ({"$and": [{"source": "ley.pdf"}, {"page": {"$nin": [1, 2, 3]}}]}, {"ley_p3_c0", "ley_p4_c0", "ley_p5_c0"})
+])
+def test_filter_positions_match_chroma_semantics(make_engine, where, expected):
+    engine = make_engine()
+    assert {engine.bm25_corpus[pos]["id"] for pos in engine._filter_positions(where)} == expected
+    assert set(make_engine.collection.get(where=where)["ids"]) == expected
+
+
+@pytest.mark.parametrize("backend", ["chroma", "hnswlib"])
+def test_hybrid_search_pushes_the_filter_down_to_both_retrievers(make_engine, backend):
+    if backend != "chroma":
+        pytest.importorskip(backend)
+    engine = make_engine(VECTOR_BACKEND=backend)
+    where = {"source": "convenio.pdf"}
+    query = "vacaciones anuales retribuidas y plus de nocturnidad"
+
+    # Sin filtro gana el chunk de vacaciones de ley.pdf; con filtro solo quedan los de convenio.pdf
+    assert "ley_p0_c0" in _ids(engine.hybrid_search(query))
+    results = engine.hybrid_search(query, where=where)
+    assert results and all(item["metadata"]["source"] == "convenio.pdf" for item in results)
+    assert _ids(results)[0] == "ley_p11_c0"
+
+    # Cada retriever devuelve lo mismo que filtrar después su ranking completo
+    full_bm25 = engine.search_bm25(query, top_k=len(CHUNKS))
+    assert _ids(engine.search_bm25(query, top_k=3, where=where)) == \
+        [item["id"] for item in full_bm25 if item["metadata"]["source"] == "convenio.pdf"][:3]
+    full_vector = engine.search_vector(query, top_k=len(CHUNKS))
+    assert _ids(engine.search_vector(query, top_k=3, where=where)) == \
+        [item["id"] for item in full_vector if item["metadata"]["source"] == "convenio.pdf"][:3]
+
+
+class WordOverlapReranker:
+    """Cross-Encoder de prueba: puntúa por palabras compartidas y registra cada llamada."""
+
+    def __init__(self):
+        self.calls = []
+
+    def predict(self, pairs, batch_size=32):
+        self.calls.append(len(pairs))
+        return [len(set(query.lower().split()) & set(doc.lower().split())) + 1 / (1 + len(doc)) for query, doc in pairs]
+
+
+BATCH_QUERIES = ["vacaciones anuales", "plus de nocturnidad", "permiso por matrimonio", "despido objetivo", "vacaciones anuales"]
+
+
+@pytest.mark.parametrize("where", [None, {"source": "ley.pdf"}])
+def test_search_many_matches_the_single_query_path(make_engine, where):
+    engine = make_engine()
+    engine.reranker = WordOverlapReranker()
+    single = [engine.rerank(query, engine.hybrid_search(query, top_k_fusion=6, where=where), top_k=3) for query in BATCH_QUERIES]
+    single_calls = len(engine.reranker.calls)
+
+    batched = engine.search_many(BATCH_QUERIES, top_k_fusion=6, top_k=3, where=where)
+    assert [_ids(results) for results in batched] == [_ids(results) for results in single]
+    assert [[item["rerank_score"] for item in results] for results in batched] == \
+        [[item["rerank_score"] for item in results] for results in single]
+    # Todos los pares (query, pasaje) del lote van en una sola llamada al Cross-Encoder
+    assert single_calls == len(BATCH_QUERIES) and len(engine.reranker.calls) == single_calls + 1
+
+
+def test_batched_retrievers_accept_one_filter_per_query(make_engine):
+    engine = make_engine()
+    wheres = [{"source": "ley.pdf"}, None, {"source": "convenio.pdf"}]
+    queries = BATCH_QUERIES[:3]
+    assert engine.search_bm25_many(queries, top_k=4, where=wheres) == \
+        [engine.search_bm25(query, top_k=4, where=where) for query, where in zip(queries, wheres)]
+    assert [_ids(results) for results in engine.search_vector_many(queries, top_k=4, where=wheres)] == \
+        [_ids(engine.search_vector(query, top_k=4, where=where)) for query, where in zip(queries, wheres)]
+
+
+class CountingEmbedder:
+    def __init__(self):
+        self.batches = []
+
+    def __call__(self, texts):
+        self.batches.append(list(texts))
+        return [np.full(4, len(text), dtype=np.float32) for text in texts]
+
+
+def test_query_embedding_cache_normalizes_keys_and_batches_misses():
+    cache = retrieval_engine.QueryEmbeddingCache(maxsize=8)
+    embed = CountingEmbedder()
+    first = cache.get_many(["vacaciones  anuales", "despido", "despido"], embed)
+    # Los fallos repetidos se calculan una sola vez, en un solo lote
+    assert embed.batches == [["vacaciones anuales", "despido"]]
+    second = cache.get_many([" vacaciones anuales\n", "despido"], embed)
+    assert len(embed.batches) == 1
+    assert all(np.array_equal(a, b) for a, b in zip(second, first[:2]))
+    # Mayúsculas y acentos no se normalizan: cambian el embedding
+    cache.get_many(["Despido"], embed)
+    assert embed.batches[-1] == ["Despido"]
+
+    stats = cache.stats()
+    assert (stats["entries"], stats["hits"], stats["misses"]) == (3, 2, 4)
+    assert stats["hit_rate"] == pytest.approx(2 / 6)
+    assert stats["memory_bytes"] >= 3 * 4 * 4
+
+
+def test_query_embedding_cache_evicts_least_recently_used():
+    cache = retrieval_engine.QueryEmbeddingCache(maxsize=2)
+    embed = CountingEmbedder()
+    cache.get_many(["a", "b"], embed)
+    cache.get_many(["a"], embed)   # "a" pasa a ser el más reciente
+    cache.get_many(["c"], embed)   # expulsa "b"
+    cache.get_many(["a", "b"], embed)
+    assert embed.batches[-1] == ["b"]
+    assert cache.stats()["entries"] == 2
+
+
+def test_engine_embeds_each_question_once(make_engine, hash_embeddings, monkeypatch):
+    engine = make_engine()
+    calls = []
+    monkeypatch.setattr(engine, "emb_fn", lambda texts: calls.append(list(texts)) or hash_embeddings(texts))
+    engine.embedding_cache.clear()
+    engine.hybrid_search("permiso por matrimonio")
+    engine.hybrid_search("permiso  por matrimonio", where={"source": "ley.pdf"})
+    engine.search_vector("permiso por matrimonio")
+    assert calls == [["permiso por matrimonio"]]
+
+
+def test_two_stage_search_restricts_chunks_to_the_selected_documents(make_engine):
+    engine = make_engine()
+    query = "seguridad privada vigilantes nocturnidad plus"
+    embedding = engine.embed_queries([query])
+    assert engine.select_documents(embedding, top_n=1) == [["convenio.pdf"]]
+    assert engine.query_wheres(embedding, two_stage=True, top_documents=1) == [{"source": {"$in": ["convenio.pdf"]}}]
+
+    results = engine._hybrid_many([query], two_stage=True, top_documents=1)[0]
+    assert results and {item["metadata"]["source"] for item in results} == {"convenio.pdf"}
+    # Un filtro explícito se combina con el de la primera etapa
+    where = {"source": "ley.pdf"}
+    assert engine.query_wheres(embedding, where, two_stage=True, top_documents=1) == \
+        [{"$and": [where, {"source": {"$in": ["ley.pdf"]}}]}]
+    assert {item["metadata"]["source"] for item in engine.hybrid_search(query, where=where, two_stage=True)} == {"ley.pdf"}
+
+
+def test_document_index_follows_incremental_source_changes(make_engine):
+    engine = make_engine()
+    engine._ensure_document_index()
+    make_engine.collection.delete(where={"source": "convenio.pdf"})
+    engine.apply_source_changes(removed=["convenio.pdf"])
+    assert set(engine.document_index.sums) == {"ley.pdf"}
+    assert engine.select_documents(engine.embed_queries(["plus de nocturnidad"]), top_n=3) == [["ley.pdf"]]
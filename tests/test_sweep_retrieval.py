@@ -0,0 +1,45 @@
+import pandas as pd
+import pytest
+
+for module in ("torch", "sentence_transformers"):
+    pytest.importorskip(module)
+
+import src.api.retrieval_engine as retrieval_engine
+from src.evaluation.sweep_retrieval import pareto_front, run_sweep
+
+DATASET = [
+    {"question": "vacaciones anuales retribuidas", "reference_doc": "ley.pdf"},
+    {"question": "teletrabajo acuerdo escrito", "reference_doc": "convenio.pdf"},
+    {"question": "plus de nocturnidad", "reference_doc": "convenio.pdf"}
+]
+
+
+def test_pareto_front_keeps_only_undominated_configs():
+    df = pd.DataFrame({
+        "p50 (ms)": [10.0, 20.0, 20.0, 30.0, 40.0],
+        "MRR": [0.5, 0.7, 0.6, 0.7, 0.9]
+    })
+    assert pareto_front(df).tolist() == [True, True, False, False, True]
+
+
+@pytest.mark.parametrize("fusion, two_stage", [({}, False), ({"method": "score", "cutoff_gap": 0.3}, False), ({}, True)])
+def test_sweep_ranks_like_the_engine(make_engine, monkeypatch, fusion, two_stage):
+    monkeypatch.setattr(retrieval_engine, "DEFAULT_FUSION_CONFIG", {**retrieval_engine.DEFAULT_FUSION_CONFIG, **fusion})
+    monkeypatch.setattr(retrieval_engine, "TWO_STAGE_TOP_DOCUMENTS", 1)
+    engine = make_engine()
+    grid = {"top_k_fusion": [4], "rrf_k": [20], "rerank_top_k": [1, 3], "reranker": ["none"]}
+    where = {"source": "convenio.pdf"}
+
+    df = run_sweep(engine, DATASET, grid, where=where, two_stage=two_stage)
+
+    results = engine.search_many([item["question"] for item in DATASET], top_k_fusion=4, top_k=3, where=where,
+                                 rerank=False, two_stage=two_stage, fusion={"rrf_k": 20})
+    for rerank_top_k in grid["rerank_top_k"]:
+        expected_hits = [
+            any(c["metadata"]["source"] == item["reference_doc"] for c in ranked[:rerank_top_k])
+            for item, ranked in zip(DATASET, results)
+        ]
+        row = df[df["rerank_top_k"] == rerank_top_k].iloc[0]
+        assert row["Hit Rate"] == pytest.approx(sum(expected_hits) / len(DATASET))
+        assert row["fusion"] == retrieval_engine.DEFAULT_FUSION_CONFIG["method"]
+    assert df["Pareto"].any()